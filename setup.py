@@ -4,7 +4,8 @@ from setuptools import setup
 setup(
     name="enabler",
     version="0.1.2",
-    packages=["enabler", "src.enabler_keitaro_inc.commands", "src.enabler_keitaro_inc.helpers"], # noqa
+    packages=["enabler", "src.enabler_keitaro_inc.commands", "src.enabler_keitaro_inc.helpers", "src.enabler_keitaro_inc.templates"], # noqa
+    package_data={"src.enabler_keitaro_inc.templates": ["*.yaml", "*.json"]},
     include_package_data=True,
     install_requires=["click>=7.1",
                       "click-log==0.3.2",
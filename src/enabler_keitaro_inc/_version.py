@@ -0,0 +1,3 @@
+# Version of the source tree, used when Enabler is run without being
+# installed. Keep in sync with setup.py and pyproject.toml
+__version__ = '0.1.2'
@@ -1,7 +1,12 @@
 from src.enabler_keitaro_inc.enabler import pass_environment, logger
+from src.enabler_keitaro_inc.helpers import configdata, kube, kubeapi
 
 import click
-import subprocess as s
+import json
+
+
+# Objects built and applied together by configmap and secret
+BATCH_SIZE = 50
 
 
 # App group of commands
@@ -16,17 +21,53 @@ def cli(ctx, kube_context_cli):
     pass
 
 
+def load_namespaces(path):
+    """Read namespaces from a YAML file, either a list or a mapping with a
+    namespaces list. Entries are names or mappings with a name, labels
+    and annotations"""
+    # Imported here to keep the startup of the CLI fast
+    import yaml
+    with open(path, 'r') as f:
+        data = yaml.safe_load(f) or []
+    if isinstance(data, dict):
+        data = data.get('namespaces') or []
+    entries = []
+    for entry in data:
+        if isinstance(entry, str):
+            entry = {'name': entry}
+        if not isinstance(entry, dict) or not entry.get('name'):
+            raise click.BadParameter('Invalid namespace entry: ' + str(entry),
+                                     param_hint='--file')
+        entries.append(entry)
+    return entries
+
+
 # Namespace setup
-@cli.command('namespace', short_help='Create namespace')
+@cli.command('namespace', short_help='Create namespaces')
 @click.option('--kube-context',
               help='The kubernetes context to use',
               required=False)
-@click.argument('name',
-                required=True)
+@click.option('--file', '-f', 'file_path',
+              help='YAML file listing namespaces with labels and annotations',
+              type=click.Path(exists=True, dir_okay=False),
+              required=False)
+@click.option('--istio-injection/--no-istio-injection',
+              help='Label the namespaces for istio injection',
+              default=True)
+@click.option('--output', '-o',
+              help='Output format of the results',
+              type=click.Choice(['text', 'json']),
+              default='text')
+@click.argument('names',
+                nargs=-1,
+                required=False)
 @click.pass_context
 @pass_environment
-def ns(ctx, kube_context_cli, kube_context, name):
-    """Create a namespace with auto-injection"""
+def ns(ctx, kube_context_cli, kube_context, file_path, istio_injection,
+       output, names):
+    """Create namespaces with auto-injection. All of them are applied
+    in one go and existing namespaces are only updated when their labels
+    or annotations differ"""
 
     if ctx.kube_context is not None:
         kube_context = ctx.kube_context
@@ -34,37 +75,157 @@ def ns(ctx, kube_context_cli, kube_context, name):
         logger.error("--kube-context was not specified")
         raise click.Abort()
 
-    # Create a namespace in kubernetes
-    ns_exists = s.run(['kubectl',
-                       'get',
-                       'ns',
-                       name,
-                       '--context',
-                       'kind-' + kube_context],
-                      capture_output=True)
-    if ns_exists.returncode != 0:
-        try:
-            app_ns = s.run(['kubectl',  # noqa
-                            'create',
-                            'ns',
-                            name,
-                            '--context',
-                            'kind-' + kube_context],
-                           capture_output=True, check=True)
-            logger.info('Created a namespace for ' + name)
-            app_ns_label = s.run(['kubectl',   # noqa
-                                  'label',
-                                  'namespace',
-                                  name,
-                                  'istio-injection=enabled',
-                                  '--context',
-                                  'kind-' + kube_context],
-                                 capture_output=True, check=True)
-            logger.info('Labeled ' + name + ' namespace for istio injection')
-        except s.CalledProcessError as error:
-            logger.error('Something went wrong with namespace: ' +
-                         error.stderr.decode('utf-8'))
-            raise click.Abort()
+    entries = [{'name': name} for name in names]
+    if file_path:
+        entries += load_namespaces(file_path)
+    if not entries:
+        raise click.UsageError('Specify namespace names or --file')
+
+    manifests = {}
+    for entry in entries:
+        labels = dict(entry.get('labels') or {})
+        if istio_injection:
+            labels.setdefault('istio-injection', 'enabled')
+        # A name given twice is created once, the last entry wins
+        manifests[entry['name']] = kube.namespace_manifest(
+            entry['name'], labels, entry.get('annotations'))
+
+    # Create the namespaces in kubernetes
+    results = kube.apply_namespaces(kube_context, list(manifests.values()))
+
+    report(results, 'Namespace', output)
+
+
+def report(results, kind, output):
+    """Log or print (name, status, message) results and abort if any of
+    them failed"""
+    if output == 'json':
+        click.echo(json.dumps([{'name': name, 'status': status,
+                                'message': message}
+                               for name, status, message in results],
+                              indent=2))
     else:
-        logger.info('Skipping creation of ' + name + ' namespace '
-                    'since it already exists.')
+        for name, status, message in results:
+            if status == kube.FAILED:
+                logger.error(kind + ' ' + name + ' failed: ' + str(message))
+            else:
+                logger.info(kind + ' ' + name + ' ' + status)
+    counts = {}
+    for _, status, _ in results:
+        counts[status] = counts.get(status, 0) + 1
+    logger.info(', '.join('{} {}'.format(counts.get(status, 0), status)
+                          for status in (kube.CREATED, kube.CONFIGURED,
+                                         kube.UNCHANGED, kube.FAILED)))
+    if counts.get(kube.FAILED):
+        raise click.Abort()
+
+
+def apply_directory(kube_context, directory, namespace, name, kind):
+    """Apply a ConfigMap or Secret for every directory of the tree below
+    directory. Objects whose content hash matches the live object are
+    skipped, the others are applied in batches of BATCH_SIZE"""
+    bundles = configdata.collect(directory, name)
+    names = [bundle.name for bundle in bundles]
+    duplicates = sorted(set(n for n in names if names.count(n) > 1))
+    if duplicates:
+        logger.error('Directories map to the same name: ' +
+                     ', '.join(duplicates))
+        raise click.Abort()
+    configdata.hash_bundles(bundles)
+
+    plural = kind.lower() + 's'
+    try:
+        live = kube.live_annotations(
+            kube_context, namespace, plural,
+            configdata.MANAGED_LABEL + '=' + configdata.MANAGED_BY)
+    except kubeapi.ApiError as error:
+        logger.error('Could not list ' + plural + ': ' + str(error))
+        raise click.Abort()
+
+    results = {}
+    changed = []
+    for bundle in bundles:
+        annotations = live.get(bundle.name)
+        if annotations and \
+                annotations.get(configdata.HASH_ANNOTATION) == bundle.digest:
+            results[bundle.name] = (bundle.name, kube.UNCHANGED, None)
+        else:
+            changed.append(bundle)
+    # Only one batch of objects is held in memory at a time
+    for start in range(0, len(changed), BATCH_SIZE):
+        manifests = [configdata.manifest(bundle, kind, namespace)
+                     for bundle in changed[start:start + BATCH_SIZE]]
+        for result in kube.apply_batch(kube_context, manifests):
+            results[result[0]] = result
+    return [results[bundle.name] for bundle in bundles]
+
+
+def directory_options(kind):
+    """Options shared by the commands creating objects from directories"""
+    options = [
+        click.option('--kube-context',
+                     help='The kubernetes context to use',
+                     required=False),
+        click.option('--namespace', '-n',
+                     help='The namespace of the ' + kind + 's',
+                     default='default'),
+        click.option('--name',
+                     help='Name of the ' + kind + ' holding the files at the '
+                     'top of the directory, defaults to its name',
+                     required=False),
+        click.option('--output', '-o',
+                     help='Output format of the results',
+                     type=click.Choice(['text', 'json']),
+                     default='text'),
+        click.argument('directory',
+                       type=click.Path(exists=True, file_okay=False),
+                       required=True),
+    ]
+
+    def decorator(f):
+        for option in reversed(options):
+            f = option(f)
+        return f
+    return decorator
+
+
+# Configmap setup
+@cli.command('configmap', short_help='Create configmaps from directories')
+@directory_options('configmap')
+@click.pass_context
+@pass_environment
+def configmap(ctx, kube_context_cli, kube_context, namespace, name, output,
+              directory):
+    """Create a configmap from every directory of the tree below
+    DIRECTORY, with one key per file. Configmaps whose files did not
+    change are skipped"""
+    if ctx.kube_context is not None:
+        kube_context = ctx.kube_context
+    if ctx.kube_context is None and kube_context is None:
+        logger.error("--kube-context was not specified")
+        raise click.Abort()
+
+    results = apply_directory(kube_context, directory, namespace, name,
+                              'ConfigMap')
+    report(results, 'ConfigMap', output)
+
+
+# Secret setup
+@cli.command('secret', short_help='Create secrets from directories')
+@directory_options('secret')
+@click.pass_context
+@pass_environment
+def secret(ctx, kube_context_cli, kube_context, namespace, name, output,
+           directory):
+    """Create an opaque secret from every directory of the tree below
+    DIRECTORY, with one key per file. Secrets whose files did not change
+    are skipped"""
+    if ctx.kube_context is not None:
+        kube_context = ctx.kube_context
+    if ctx.kube_context is None and kube_context is None:
+        logger.error("--kube-context was not specified")
+        raise click.Abort()
+
+    results = apply_directory(kube_context, directory, namespace, name,
+                              'Secret')
+    report(results, 'Secret', output)
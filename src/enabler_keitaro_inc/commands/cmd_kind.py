@@ -1,13 +1,18 @@
 from src.enabler_keitaro_inc.enabler import pass_environment, logger
-from src.enabler_keitaro_inc.helpers import kind, kube
+from src.enabler_keitaro_inc.helpers import containers, images, kind, \
+    kindconfig, kube, kubeapi, registry, snapshots
 
 import click
 import click_spinner
+import json
 import subprocess as s
-import docker
 import os
-from time import sleep
-import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Clusters worked on at the same time by start, stop, status and delete
+PARALLEL = 4
 
 
 # Kind group of commands
@@ -28,9 +33,13 @@ def cli(ctx, kube_context_cli):
 @click.option('--kube-context',
               help='The kubernetes context to use',
               required=False)
+@click.option('--registry', 'with_registry',
+              help='Run a local registry at localhost:{} and have the nodes '
+              'pull from it'.format(registry.PORT),
+              is_flag=True)
 @click.pass_context
 @pass_environment
-def create(ctx, kube_context_cli, kube_context, configfile):
+def create(ctx, kube_context_cli, kube_context, configfile, with_registry):
     if ctx.kube_context is not None:
         kube_context = ctx.kube_context
     if ctx.kube_context is None and kube_context is None:
@@ -45,9 +54,20 @@ def create(ctx, kube_context_cli, kube_context, configfile):
     kind_configfile_validation(configfile)
 
     # Check if kind cluster is already created
-    if kind.kind_get(kube_context):
+    if kind.cluster(kube_context) is not None:
         logger.error('Kind cluster \'' + kube_context + '\' already exists')
         raise click.Abort()
+    if with_registry:
+        # kind reads the config with the containerd patch from stdin
+        import yaml
+        try:
+            registry.ensure()
+        except registry.RegistryError as error:
+            logger.error(str(error))
+            raise click.Abort()
+        config = yaml.safe_dump(registry.patch_config(
+            kindconfig.load(configfile))).encode('utf-8')
+        configfile = '-'
     try:
         logger.debug('Running: `kind create cluster`')
         create_cluster = s.run(['kind',  # noqa
@@ -57,219 +77,542 @@ def create(ctx, kube_context_cli, kube_context, configfile):
                                 kube_context,
                                 '--config',
                                click.format_filename(configfile)],
+                               input=config if with_registry else None,
                                capture_output=False, check=True)
     except s.CalledProcessError as error:
         logger.critical('Could not create kind cluster: ' + str(error))
+        return
+    finally:
+        containers.invalidate(kube_context)
+    if with_registry:
+        connect_registry(kube_context, registry.PORT)
+
+
+def connect_registry(kube_context, port):
+    """Point the nodes of a cluster at the local registry and advertise
+    it in the cluster"""
+    info = kind.cluster(kube_context)
+    registry.connect(info.nodes, port=port)
+    try:
+        kube.apply(kube_context, registry.hosting_manifest(port))
+    except kubeapi.ApiError as error:
+        logger.warning('Could not advertise the registry: ' + str(error))
+    logger.info('Kind cluster \'' + kube_context + '\' pulls from '
+                'localhost:{}'.format(port))
 
 
-@cli.command('delete', short_help='Delete cluster')
+@cli.command('registry', short_help='Run a local registry')
 @click.option('--kube-context',
               help='The kubernetes context to use',
               required=False)
+@click.option('--port',
+              help='Port of the registry on localhost',
+              type=click.IntRange(1, 65535),
+              default=registry.PORT)
 @click.pass_context
 @pass_environment
-def delete(ctx, kube_context_cli, kube_context):
-    """Delete a kind cluster"""
-    # Check if the kind cluster exists
+def local_registry(ctx, kube_context_cli, kube_context, port):
+    """Run a local registry container at localhost:PORT and, when the
+    cluster of --kube-context exists, have its nodes pull images pushed
+    to localhost:PORT from it. Nodes only read the registry hosts when
+    the cluster was created with --registry"""
+    if ctx.kube_context is not None:
+        kube_context = ctx.kube_context
+    try:
+        created = registry.ensure(port=port)
+    except registry.RegistryError as error:
+        logger.error(str(error))
+        raise click.Abort()
+    if created:
+        logger.info('Registry started at localhost:{}'.format(port))
+    else:
+        logger.info('Registry is running')
+    if kube_context and kind.cluster(kube_context) is not None:
+        connect_registry(kube_context, port)
+
+
+@cli.command('load', short_help='Load images into the nodes')
+@click.option('--kube-context',
+              help='The kubernetes context to use',
+              required=False)
+@click.argument('names',
+                nargs=-1,
+                required=True)
+@click.pass_context
+@pass_environment
+def load(ctx, kube_context_cli, kube_context, names):
+    """Load docker images into every node of the cluster. The images are
+    saved once and streamed to all nodes at the same time, nodes having
+    an image already are skipped"""
     if ctx.kube_context is not None:
         kube_context = ctx.kube_context
     if ctx.kube_context is None and kube_context is None:
         logger.error("--kube-context was not specified")
         raise click.Abort()
-    if not kind.kind_get(kube_context):
-        logger.error('Kind cluster \'' + kube_context + '\' doesn\'t exist')
+    info = kind.cluster(kube_context)
+    if info is None or not info.running:
+        logger.error('Kind cluster \'' + kube_context + '\' is not running')
+        raise click.Abort()
+    try:
+        ids = dict((name, images.image_id(name)) for name in names)
+    except images.ImageError as error:
+        logger.error(str(error))
+        raise click.Abort()
+
+    nodes = [node for node in info.nodes
+             if node.role != containers.LOAD_BALANCER]
+    pending = images.missing(nodes, ids)
+    for node in nodes:
+        if not pending[node]:
+            logger.info(node.name + ' has all images')
+    nodes = [node for node in nodes if pending[node]]
+    if not nodes:
+        return
+    wanted = sorted(set(name for node in nodes for name in pending[node]))
+    start = time.monotonic()
+    with click_spinner.spinner():
+        failed = images.stream(wanted, nodes)
+    for name, error in sorted(failed.items()):
+        logger.error('Could not load images on ' + name + ': ' + error)
+    if failed:
+        raise click.Abort()
+    logger.info('Loaded {} on {} in {:.2f}s'.format(
+        ', '.join(wanted), ', '.join(node.name for node in nodes),
+        time.monotonic() - start))
+
+
+class ClusterError(Exception):
+    """An operation failed on one cluster, the message says why"""
+
+
+def fleet_options(f):
+    """Options selecting the clusters of start, stop, status and delete
+    and how their results are reported"""
+    options = [
+        click.option('--kube-context',
+                     help='The kubernetes context to use',
+                     required=False),
+        click.option('--all', 'select_all',
+                     help='Every kind cluster on this host',
+                     is_flag=True),
+        click.option('--parallel',
+                     help='Clusters worked on at the same time',
+                     type=click.IntRange(min=1),
+                     default=PARALLEL),
+        click.option('--output', '-o',
+                     help='Output format of the results',
+                     type=click.Choice(['text', 'json']),
+                     default='text'),
+        click.argument('clusters',
+                       nargs=-1,
+                       required=False),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+def targets(kube_context, patterns, select_all):
+    """Return the names of the clusters given as names or glob patterns,
+    every cluster with --all, or else the one of --kube-context"""
+    if select_all:
+        return sorted(kind.clusters())
+    if patterns:
+        return kind.select(patterns)
+    return [kube_context] if kube_context else []
+
+
+def run_fleet(action, names, parallel):
+    """Run action(name) for every cluster, at most parallel at a time.
+    Returns (name, ok, seconds, message) tuples in the order of names"""
+    def timed(name):
+        start = time.monotonic()
+        try:
+            message, ok = action(name), True
+        except ClusterError as error:
+            message, ok = str(error), False
+        except Exception as error:
+            # Docker, the API server or kind failing on one cluster must
+            # not take the report of the others down
+            logger.debug('Kind cluster \'' + name + '\' failed',
+                         exc_info=True)
+            message, ok = 'failed, {}: {}'.format(
+                type(error).__name__, error), False
+        return name, ok, time.monotonic() - start, message
+    with ThreadPoolExecutor(max_workers=min(parallel, len(names))) as executor: # noqa
+        return list(executor.map(timed, names))
+
+
+def report(results, output):
+    """Log the result of a single cluster or print a table, or JSON, of
+    the results of all of them. Aborts if any of them failed"""
+    if output == 'json':
+        click.echo(json.dumps([{'cluster': name,
+                                'status': 'ok' if ok else 'failed',
+                                'seconds': round(seconds, 2),
+                                'message': message}
+                               for name, ok, seconds, message in results],
+                              indent=2))
+    elif len(results) == 1:
+        name, ok, seconds, message = results[0]
+        text = 'Kind cluster \'{}\' {} ({:.2f}s)'.format(name, message,
+                                                         seconds)
+        if ok:
+            logger.info(text)
+        else:
+            logger.error(text)
+    else:
+        width = max(len('CLUSTER'), max(len(r[0]) for r in results))
+        row = '{:<' + str(width) + '}  {:<6}  {:>7}  {}'
+        click.echo(row.format('CLUSTER', 'STATUS', 'SECONDS', 'MESSAGE'))
+        for name, ok, seconds, message in results:
+            click.echo(row.format(name, 'ok' if ok else 'failed',
+                                  '{:.2f}'.format(seconds), message))
+    if not all(ok for _, ok, _, _ in results):
         raise click.Abort()
 
-    # Delete the kind cluster
+
+def fleet(kube_context, patterns, select_all, action, parallel, output):
+    names = targets(kube_context, patterns, select_all)
+    if not names:
+        logger.error('No kind clusters selected')
+        raise click.Abort()
+    with click_spinner.spinner(disable=output == 'json'):
+        results = run_fleet(action, names, parallel)
+    report(results, output)
+
+
+def delete_cluster(name):
+    info = kind.cluster(name)
+    if info is None:
+        raise ClusterError('does not exist')
+    # Removing the node containers is the slow part and runs for every
+    # cluster at once, kind then only has to clean up the kubeconfig
+    containers.remove_nodes(info.nodes)
     try:
         logger.debug('Running: `kind delete cluster`')
-        create_cluster = s.run(['kind',  # noqa
-                                'delete',
-                                'cluster',
-                                '--name',
-                                kube_context],
-                               capture_output=False, check=True)
+        with kube.kubeconfig_lock:
+            s.run(['kind', 'delete', 'cluster', '--name', name],
+                  capture_output=True, check=True)
     except s.CalledProcessError as error:
-        logger.critical('Could not delete kind cluster:' + str(error))
+        raise ClusterError('could not be deleted: ' +
+                           error.stderr.decode('utf-8').strip())
+    finally:
+        containers.invalidate(name)
+    return 'deleted'
 
 
-@cli.command('status', short_help='Cluster status')
-@click.option('--kube-context',
-              help='The kubernetes context to use',
-              required=False)
+@cli.command('delete', short_help='Delete cluster')
+@fleet_options
 @click.pass_context
-def status(ctx, kube_context):
-    """Check the status of the kind cluster"""
-    if kube_context is not None:
-        if kind.kind_get(kube_context):
-            if kube.kubectl_info(kube_context):
-                logger.info('Kind cluster \'' + kube_context + '\' is running')
-            else:
-                logger.error('Cluster not running. Please start the cluster')
-                raise click.Abort()
-        else:
-            logger.error('Kind cluster \'' + kube_context + '\' does not exist.') # noqa
-    else:
-        logger.error('No kube-context provided.')
+@pass_environment
+def delete(ctx, kube_context_cli, kube_context, select_all, parallel, output,
+           clusters):
+    """Delete kind clusters, given by name or glob pattern, every one
+    with --all, or else the one of --kube-context"""
+    # Check if the kind cluster exists
+    if ctx.kube_context is not None:
+        kube_context = ctx.kube_context
+    if ctx.kube_context is None and kube_context is None and \
+            not clusters and not select_all:
+        logger.error("--kube-context was not specified")
+        raise click.Abort()
+    fleet(kube_context, clusters, select_all, delete_cluster, parallel,
+          output)
 
 
-@cli.command('start', short_help='Start cluster')
-@click.option('--kube-context',
-              help='The kubernetes context to use',
-              required=False)
+def cluster_status(name):
+    info = kind.cluster(name)
+    if info is None:
+        raise ClusterError('does not exist')
+    if not info.running:
+        raise ClusterError('is not running, {} of {} nodes stopped'.format(
+            len(info.stopped), len(info.nodes)))
+    if not kube.kubectl_info(name):
+        raise ClusterError('is not ready, the API server does not answer')
+    return 'is running'
+
+
+@cli.command('status', short_help='Cluster status')
+@fleet_options
 @click.pass_context
 @pass_environment
-def start(ctx, kube_context_cli, kube_context):
-    """Start kind cluster"""
+def status(ctx, kube_context_cli, kube_context, select_all, parallel,
+           output, clusters):
+    """Check the status of kind clusters"""
+    if ctx.kube_context:
+        kube_context = ctx.kube_context
+    if kube_context is None and not clusters and not select_all:
+        logger.error('No kube-context provided.')
+        return
+    fleet(kube_context, clusters, select_all, cluster_status, parallel,
+          output)
+
 
+def start_cluster(name, timeout):
     # Kind creates containers with a label io.x-k8s.kind.cluster
     # Kind naming is clustername-control-plane and clustername-worker{x}
     # The idea is to find the containers check status and ports
     # and start them then configure kubectl context
+    info = kind.cluster(name)
+    if info is None:
+        raise ClusterError('does not exist, create it with '
+                           '"enabler kind create"')
+    if info.running and kube.kubectl_info(name):
+        return 'is running'
+
+    deadline = time.monotonic() + timeout
+    with containers.NodeWatcher(name) as watcher:
+        # Start all stopped node containers at once
+        containers.start_nodes(info.stopped)
+
+        # Ports are only published once the containers run
+        api_node = kind.cluster(name, refresh=True).api_node
+        # Configure kubeconfig
+        if api_node and kube.kubeconfig_set(api_node, name):
+            logger.debug('Reconfigured kubeconfig')
+        else:
+            raise ClusterError('started but the kubeconfig could not be '
+                               'configured')
+
+        # Return as soon as the API server is ready, or a node died
+        logger.debug('Cluster components started. '
+                     'Waiting for cluster to be ready')
+        ready = kube.wait_until_ready(api_node.ports['6443/tcp'], deadline,
+                                      failed=lambda: watcher.died)
+    if ready:
+        return 'started'
+    if watcher.died:
+        raise ClusterError('could not be started, ' +
+                           ', '.join(watcher.died) + ' exited')
+    raise ClusterError('was not ready after {:g}s'.format(timeout))
+
 
+@cli.command('start', short_help='Start cluster')
+@fleet_options
+@click.option('--timeout',
+              help='Seconds to wait for the cluster to become ready',
+              type=float,
+              default=300)
+@click.pass_context
+@pass_environment
+def start(ctx, kube_context_cli, kube_context, select_all, parallel, output,
+          clusters, timeout):
+    """Start kind clusters, given by name or glob pattern, every one with
+    --all, or else the one of --kube-context"""
     if ctx.kube_context is not None:
         kube_context = ctx.kube_context
-    if ctx.kube_context is None and kube_context is None:
+    if ctx.kube_context is None and kube_context is None and \
+            not clusters and not select_all:
         logger.error("--kube-context was not specified")
         raise click.Abort()
+    fleet(kube_context, clusters, select_all,
+          lambda name: start_cluster(name, timeout), parallel, output)
 
-    kind_cp = kube_context + '-control-plane'
-    kind_workers = kube_context + '-worker'
 
-    # Check if the cluster exists
-    if kind.kind_get(kube_context):
-        if kube.kubectl_info(kube_context):
-            logger.info('Kind cluster \'' + kube_context + '\' is running')
-        else:
-            # Check and start kind cluster docker containers
-            client = docker.from_env()
-            kind_containers = client.containers.list(
-                            all, filters={'label': 'io.x-k8s.kind.cluster'})
-            with click_spinner.spinner():
-                for container in kind_containers:
-                    if kind_cp in container.name:
-                        if container.status != 'running':
-                            container.start()
-                            logger.debug('Container ' +
-                                         container.name + ' started')
-                            container = client.containers.get(container.id)
-                            # Configure kubeconfig
-                            if kube.kubeconfig_set(container, kube_context):
-                                logger.debug('Reconfigured kubeconfig')
-                            else:
-                                logger.critical('Couldnt configure kubeconfig')
-                                raise click.Abort()
-                        else:
-                            logger.debug('Container ' + container.name +
-                                         ' is running')
-                            if kube.kubeconfig_set(container, kube_context):
-                                logger.debug('Reconfigured kubeconfig')
-                            else:
-                                logger.critical('Couldnt configure kubeconfig')
-                                raise click.Abort()
-                    elif kind_workers in container.name:
-                        container.start()
-                        logger.info('Container ' + container.name + ' started')
-                # It takes a while for the cluster to start
-                logger.debug('Cluster components started. '
-                             'Waiting for cluster to be ready')
-                tries = 1
-                while not kube.kubectl_info(kube_context) and tries < 10:
-                    sleep(30)
-                    tries += 1
-            if kube.kubectl_info(kube_context):
-                logger.debug('Kind cluster ' + kube_context + ' started!')
-            else:
-                logger.error('Couldn\'t start kind cluster ' + kube_context)
-    else:
-        logger.error('Kind cluster \'' + kube_context + '\' does not exist.')
-        logger.error('Please create a cluster with "enabler kind create"')
+def stop_cluster(name, grace):
+    # Kind creates containers with a label io.x-k8s.kind.cluster
+    # Kind naming is clustername-control-plane and clustername-worker{x}
+    # The idea is to find the containers and stop them
+    info = kind.cluster(name)
+    if info is None:
+        raise ClusterError('does not exist')
+    for node in info.stopped:
+        logger.debug('Container ' + node.name + ' is already stopped')
+    timings = containers.stop_nodes(
+        [node for node in info.nodes if node.running], grace=grace)
+    for node, seconds in timings:
+        logger.debug('Container {} stopped in {:.2f}s'.format(
+            node.name, seconds))
+    containers.invalidate(name)
+    return 'was stopped'
 
 
 @cli.command('stop', short_help='Stop cluster')
-@click.option('--kube-context',
-              help='The kubernetes context to use',
-              required=False)
+@fleet_options
+@click.option('--timeout',
+              help='Seconds a node gets to shut down before it is killed',
+              type=int,
+              default=containers.STOP_GRACE)
+@click.option('--fast',
+              help='Kill nodes after a short grace period',
+              is_flag=True)
 @click.pass_context
 @pass_environment
-def stop(ctx, kube_context_cli, kube_context):
-    """Stop kind cluster"""
-    # Check if the cluster exists
+def stop(ctx, kube_context_cli, kube_context, select_all, parallel, output,
+         clusters, timeout, fast):
+    """Stop kind clusters, given by name or glob pattern, every one with
+    --all, or else the one of --kube-context. Workers are stopped before
+    the control plane"""
     if ctx.kube_context is not None:
         kube_context = ctx.kube_context
-    if ctx.kube_context is None and kube_context is None:
+    if ctx.kube_context is None and kube_context is None and \
+            not clusters and not select_all:
         logger.error("--kube-context was not specified")
         raise click.Abort()
+    grace = containers.FAST_STOP_GRACE if fast else timeout
+    fleet(kube_context, clusters, select_all,
+          lambda name: stop_cluster(name, grace), parallel, output)
 
-    # Kind creates containers with a label io.x-k8s.kind.cluster
-    # Kind naming is clustername-control-plane and clustername-worker{x}
-    # The idea is to find the containers and stop them
-    kind_cp = kube_context + '-control-plane'
-    kind_workers = kube_context + '-worker'
-
-    if kind.kind_get(kube_context):
-        # Check and stop kind cluster docker containers
-        client = docker.from_env()
-        kind_containers = client.containers()
-        with click_spinner.spinner():
-            for container_info in kind_containers:
-                container_name = container_info['Names'][0]
-                if container_name and (kind_cp in container_name or kind_workers in container_name): # noqa
-                    container_state = container_info['State'][0]
-                    if container_state == 'running':
-                        container_info.stop()
-                        logger.debug('Container ' + container_name + ' stopped') # noqa
-                    else:
-                        logger.debug('Container ' + container_name + ' is already stopped') # noqa
-        logger.info('Kind cluster ' + kube_context + ' was stopped.')
-    else:
-        logger.error('Kind cluster \'' + kube_context + '\' does not exist.')
+
+def host_errors():
+    """Errors of docker, the kubeconfig, the API server and the host that
+    end an operation on one cluster"""
+    import docker
+    return (docker.errors.DockerException, kubeapi.ApiError,
+            kubeapi.ConfigError, OSError)
 
 
-# Functions to check if config file has neccessary fields
-# and localhost port is free
+def snapshot_cluster(name, tag, timeout):
+    info = kind.cluster(name)
+    if info is None:
+        raise ClusterError('does not exist')
+    try:
+        kubeconfig = kubeapi.export_context('kind-' + name)
+    except kubeapi.ConfigError as error:
+        raise ClusterError('has no kubeconfig to snapshot: ' + str(error))
+    running = any(node.running for node in info.nodes)
+    taken = False
+    try:
+        # etcd and containerd are only consistent on disk once they stopped
+        stop_cluster(name, containers.STOP_GRACE)
+        snapshots.take(name, info.nodes, tag, kubeconfig)
+        taken = True
+    except snapshots.SnapshotError as error:
+        raise ClusterError(str(error))
+    except host_errors() as error:
+        raise ClusterError('could not be stopped: ' + str(error))
+    finally:
+        if running:
+            try:
+                start_cluster(name, timeout)
+            except (ClusterError,) + host_errors() as error:
+                if taken:
+                    raise ClusterError('snapshot ' + tag + ' taken, but it '
+                                       'could not be started again: ' +
+                                       str(error))
+                # The snapshot error is what the user has to see
+                logger.error('Kind cluster \'' + name + '\' could not be '
+                             'started again: ' + str(error))
+    return 'snapshot ' + tag + ' taken'
+
+
+def restore_cluster(name, tag, force, timeout):
+    try:
+        snapshot = snapshots.load(name, tag)
+        # The cluster is only deleted for a snapshot that can be restored
+        snapshots.verify(snapshot)
+    except snapshots.SnapshotError as error:
+        raise ClusterError(str(error))
+    except host_errors() as error:
+        raise ClusterError('could not check the snapshot: ' + str(error))
+    if kind.cluster(name) is not None:
+        if not force:
+            raise ClusterError('already exists, delete it first or pass '
+                               '--force')
+        try:
+            delete_cluster(name)
+        except host_errors() as error:
+            raise ClusterError('could not be deleted: ' + str(error))
+    try:
+        snapshots.restore(snapshot)
+        # kind delete removed the context, the new API server port is
+        # set when the nodes start
+        with kube.kubeconfig_lock:
+            kubeapi.import_context(snapshot['kubeconfig'])
+    except snapshots.SnapshotError as error:
+        raise ClusterError(str(error))
+    except host_errors() as error:
+        raise ClusterError('could not be restored: ' + str(error))
+    finally:
+        containers.invalidate(name)
+    try:
+        start_cluster(name, timeout)
+    except host_errors() as error:
+        raise ClusterError('was restored but could not be started: ' +
+                           str(error))
+    return 'restored from snapshot ' + tag
+
+
+def snapshot_tag(ctx, param, value):
+    if not snapshots.TAG.match(value):
+        raise click.BadParameter('use letters, digits, _, . and -')
+    return value
+
+
+@cli.command('snapshot', short_help='Snapshot cluster')
+@fleet_options
+@click.option('--tag',
+              help='Name of the snapshot',
+              callback=snapshot_tag,
+              default=snapshots.DEFAULT_TAG)
+@click.option('--timeout',
+              help='Seconds to wait for a running cluster to be ready again',
+              type=float,
+              default=300)
+@click.pass_context
+@pass_environment
+def snapshot(ctx, kube_context_cli, kube_context, select_all, parallel,
+             output, clusters, tag, timeout):
+    """Save the state of kind clusters, given by name or glob pattern,
+    every one with --all, or else the one of --kube-context. The nodes
+    are stopped, committed to images and their /var is archived. Running
+    clusters are started again"""
+    if ctx.kube_context is not None:
+        kube_context = ctx.kube_context
+    if ctx.kube_context is None and kube_context is None and \
+            not clusters and not select_all:
+        logger.error("--kube-context was not specified")
+        raise click.Abort()
+    fleet(kube_context, clusters, select_all,
+          lambda name: snapshot_cluster(name, tag, timeout), parallel,
+          output)
+
+
+@cli.command('restore', short_help='Restore cluster from a snapshot')
+@fleet_options
+@click.option('--tag',
+              help='Name of the snapshot',
+              callback=snapshot_tag,
+              default=snapshots.DEFAULT_TAG)
+@click.option('--force',
+              help='Delete the cluster first if it exists',
+              is_flag=True)
+@click.option('--timeout',
+              help='Seconds to wait for the cluster to become ready',
+              type=float,
+              default=300)
+@click.pass_context
+@pass_environment
+def restore(ctx, kube_context_cli, kube_context, select_all, parallel,
+            output, clusters, tag, force, timeout):
+    """Create kind clusters again from a snapshot taken with enabler kind
+    snapshot, with everything that was set up on them"""
+    if ctx.kube_context is not None:
+        kube_context = ctx.kube_context
+    if ctx.kube_context is None and kube_context is None and \
+            not clusters and not select_all:
+        logger.error("--kube-context was not specified")
+        raise click.Abort()
+    fleet(kube_context, clusters, select_all,
+          lambda name: restore_cluster(name, tag, force, timeout), parallel,
+          output)
+
+
+# Check the config file against the schema of kind and that the host
+# ports it maps are free
 def kind_configfile_validation(configfile):
-    """Validates kind-cluster.yaml file"""
-
-    # Get content of configfile
-    with open(configfile, 'r') as yaml_file:
-        yaml_content = yaml_file.read()
-
-    keywords_to_check = ['kind', 'apiVersion', 'nodes']
-    lines = yaml_content.split('\n')
-    keywords_in_file = []
-    for line in lines:
-        index = line.find('hostPort:')
-        if index != -1:
-            line_content = line.strip().split(" ")
-            port = line_content[1]
-            if check_if_port_is_free(int(port)) is not True:
-                logger.warn("Possible port conflict on hostPort: " + port
-                            + ' in ' + configfile + '.')
-                pass
-
-        # Check if all key parameters are present and at level 1
-        for key in keywords_to_check:
-            if f'{key}:' in line[0:len(key)+1]:
-                keywords_in_file.append(key)
-
-    # Get only unique key words that are missing from yaml
-    difference = list(set(keywords_to_check) - set(keywords_in_file))
-    missing_string = ",".join(difference)
-
-    if len(difference) == 1:
-        logger.warn("Field "+missing_string+" missing in "+configfile+'.')
-    elif len(difference) >= 2:
-        logger.warn("Fields "+missing_string+" missing in "+configfile+'.')
-
-
-def check_if_port_is_free(port_number):
+    """Validates kind-cluster.yaml file, logging every problem found and
+    aborting if there is any"""
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(2)
-            s.bind(("127.0.0.1", port_number))
-            s.listen(1)
-    except (socket.error, ConnectionRefusedError):
-        return False
-
-    return True
+        config = kindconfig.load(configfile)
+    except ValueError as error:
+        logger.error(configfile + ': ' + str(error))
+        raise click.Abort()
+    errors = kindconfig.validate(config)
+    if not errors:
+        errors = kindconfig.port_conflicts(kindconfig.port_mappings(config))
+    for error in errors:
+        logger.error(configfile + ': ' + error)
+    if errors:
+        raise click.Abort()
@@ -1,15 +1,11 @@
 from src.enabler_keitaro_inc.enabler import pass_environment, logger
+from src.enabler_keitaro_inc.helpers import kube, kubeapi
 from src.enabler_keitaro_inc.helpers.git import get_submodules, get_repo
 from src.enabler_keitaro_inc.type import semver
 
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.backends import default_backend
 import click
 import click_spinner
-import git
 import os
-import subprocess as s
 
 
 # App group of commands
@@ -66,23 +62,13 @@ def info(ctx,  kube_context_cli, kube_context):
         logger.error("--kube-context was not specified")
         raise click.Abort()
     try:
-        gw_url = s.run(['kubectl',
-                        '--context',
-                        'kind-' + kube_context,
-                        '-n',
-                        'istio-system',
-                        'get',
-                        'service',
-                        'istio-ingressgateway',
-                        '-o',
-                        'jsonpath={.status.loadBalancer.ingress[0].ip}'],
-                       capture_output=True, check=True)
+        gw_ip = kube.load_balancer_ip(kube_context, 'istio-system',
+                                      'istio-ingressgateway')
         logger.info('Platform can be accessed through the URL:')
-        logger.info(u'\u2023' + ' http://' + gw_url.stdout.decode('utf-8'))
-        kube_info = s.run(['kubectl', 'cluster-info'], capture_output=True, check=True) # noqa
-        logger.info(kube_info.stdout.decode('utf-8'))
-    except s.CalledProcessError as error:
-        logger.error(error.stderr.decode('utf-8'))
+        logger.info(u'\u2023' + ' http://' + (gw_ip or ''))
+        logger.info(kube.cluster_info(kube_context))
+    except kubeapi.ApiError as error:
+        logger.error(str(error))
         raise click.Abort()
 
 
@@ -114,7 +100,11 @@ def keys(ctx,  kube_context_cli, bits):
         if not click.confirm('Keys already exist, overwrite y/n?'):
             raise click.Abort()
 
-    # Generate the keys using cryptography
+    # Generate the keys using cryptography, imported here to keep
+    # the startup of the CLI fast
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.backends import default_backend
     logger.info('Generating keys...')
     with click_spinner.spinner():
         key = rsa.generate_private_key(
@@ -152,6 +142,7 @@ def release(ctx, kube_context_cli, version, submodule_path):
     """Release platform by tagging platform repo and
     tagging the individual component (git submodule)
     using its respective SHA that the submodule points at"""
+    import git
     submodule_name = os.path.basename(submodule_path)
 
     # Get the repository
@@ -187,6 +178,7 @@ def release(ctx, kube_context_cli, version, submodule_path):
 
 
 def tag_repo(repo, tag_name, commit_sha=None):
+    import git
     try:
         if commit_sha:
             repo.create_tag(tag_name, ref=commit_sha)
@@ -214,6 +206,7 @@ def version(ctx, kube_context_cli, submodules, repopath):
     """Check versions of microservices in git submodules
         You can provide a comma-separated list of submodules
         or you can use 'all' for all submodules"""
+    import git
 
     # Get the repo from arguments defaults to cwd
     try:
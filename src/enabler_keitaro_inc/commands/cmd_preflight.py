@@ -1,112 +1,73 @@
 from src.enabler_keitaro_inc.enabler import pass_environment, logger
+from src.enabler_keitaro_inc.helpers import preflight, versions
 
 import click
-import subprocess as s
+import json
+import time
 
 
-@click.command('preflight', short_help='Preflight checks')
-@click.pass_context
-@pass_environment
-def cli(ctx, kube_context_cli):
-    """Preflight checks to ensure all tools and versions are present"""
-    # Check java
-    try:
-        java_ver = s.run(['java', '-version'],
-                         capture_output=True, check=True)
-        # Check that we have java 11
-        java_major_ver = java_ver.stderr.decode('utf-8').split()[2].strip('"')
-        if java_major_ver[:2] != '11':
-            logger.error(
-                'Java JDK 11 needed, please change the version of java on your system')  # noqa
-        else:
-            logger.info('✓ java jdk 11')
-            logger.debug(java_ver.stdout.decode('utf-8'))
-    except FileNotFoundError:
-        logger.critical('java not found in PATH.')
-    except s.CalledProcessError as error:
-        logger.critical('java -version returned something unexpected: ' +
-                        error.stderr.decode('utf-8'))
+def require_major(major, message):
+    def require(version):
+        if version.major != major:
+            return message
+    return require
+
 
-    # Check docker
-    try:
-        docker_ps = s.run(['docker', 'ps'],
-                          capture_output=True, check=True)
-        logger.info('✓ docker')
-        logger.debug(docker_ps.stdout.decode('utf-8'))
-    except FileNotFoundError:
-        logger.critical('docker not found in PATH.')
-    except s.CalledProcessError as error:
-        logger.critical('`docker ps` returned something unexpected: ' +
-                        error.stderr.decode('utf-8'))
-        logger.critical('Please ensure the docker daemon is running and that '
-                        'your user is part of the docker group. See README')
+def require_istio(version):
+    # Check that we have istio 1.5 or higher
+    if (version.major, version.minor) < (1, 5):
+        return 'Old version of istio detected when running "istioctl" from PATH.'  # noqa
 
-    # Check helm 3
-    try:
-        helm_ver = s.run(['helm', 'version', '--short'],
-                         capture_output=True, check=True)
-        # Check that we have helm 3
-        if helm_ver.stdout.decode('utf-8')[1] != "3":
-            logger.error(
-                'Old version of helm detected when running "helm" from PATH.')
-        else:
-            logger.info('✓ helm 3')
-            logger.debug(helm_ver.stdout.decode('utf-8'))
-    except FileNotFoundError:
-        logger.critical('helm not found in PATH.')
-    except s.CalledProcessError as error:
-        logger.critical('helm version returned something unexpected: ' +
-                        error.stderr.decode('utf-8'))
 
-    # Check kind
-    try:
-        kind_ver = s.run(['kind', 'version'],
-                         capture_output=True, check=True)
-        logger.info('✓ kind')
-        logger.debug(kind_ver.stdout.decode('utf-8'))
-    except FileNotFoundError:
-        logger.critical('kind not found in PATH.')
-    except s.CalledProcessError as error:
-        logger.critical('kind version returned something unexpected: ' +
-                        error.stderr.decode('utf-8'))
+# Registry of preflight checks, they all run concurrently
+CHECKS = [
+    preflight.Check('java', ['java', '-version'],
+                    label='java jdk 11', parse=versions.parse_java,
+                    require=require_major(11, 'Java JDK 11 needed, please change the version of java on your system')),  # noqa
+    preflight.Check('docker', ['docker', 'ps'],
+                    failure_hint='Please ensure the docker daemon is running '
+                    'and that your user is part of the docker group. '
+                    'See README',
+                    # The daemon can stop while the binary stays the same
+                    cacheable=False),
+    preflight.Check('helm', ['helm', 'version', '--short'],
+                    label='helm 3', parse=versions.parse,
+                    require=require_major(3, 'Old version of helm detected when running "helm" from PATH.')),  # noqa
+    preflight.Check('kind', ['kind', 'version'], parse=versions.parse),
+    preflight.Check('skaffold', ['skaffold', 'version'],
+                    parse=versions.parse),
+    preflight.Check('kubectl', ['kubectl', 'version', '--client=true'],
+                    parse=versions.parse),
+    preflight.Check('istioctl', ['istioctl', 'version', '-s',
+                                 '--remote=false'],
+                    parse=versions.parse, require=require_istio),
+]
 
-    # Check skaffold
-    try:
-        skaffold_ver = s.run(['skaffold', 'version'],
-                             capture_output=True, check=True)
-        logger.info('✓ skaffold')
-        logger.debug(skaffold_ver.stdout.decode('utf-8'))
-    except FileNotFoundError:
-        logger.critical('skaffold not found in PATH.')
-    except s.CalledProcessError as error:
-        logger.critical('skaffold version returned something unexpected: ' +
-                        error.stderr.decode('utf-8'))
 
-    # Check kubectl
-    try:
-        kubectl_ver = s.run(['kubectl', 'version', '--client=true'],
-                            capture_output=True, check=True)
-        logger.info('✓ kubectl')
-        logger.debug(kubectl_ver.stdout.decode('utf-8'))
-    except FileNotFoundError:
-        logger.critical('kubectl not found in PATH.')
-    except s.CalledProcessError as error:
-        logger.critical('kubectl version returned something unexpected: ' +
-                        error.stderr.decode('utf-8'))
+@click.command('preflight', short_help='Preflight checks')
+@click.option('--output', '-o',
+              help='Output format of the results',
+              type=click.Choice(['text', 'json']),
+              default='text')
+@click.option('--timeout',
+              help='Seconds after which a single check is failed',
+              type=float,
+              default=30)
+@click.option('--no-cache',
+              help='Run every check even if a cached result is still valid',
+              is_flag=True)
+@click.pass_context
+@pass_environment
+def cli(ctx, kube_context_cli, output, timeout, no_cache):
+    """Preflight checks to ensure all tools and versions are present"""
+    start = time.monotonic()
+    results = preflight.run_checks(CHECKS, timeout, use_cache=not no_cache)
+    duration = time.monotonic() - start
 
-    # Check istioctl
-    try:
-        istioctl_ver = s.run(['istioctl', 'version', '-s', '--remote=false'],
-                             capture_output=True, check=True)
-        # Check that we have istio 1.5 or higher
-        if istioctl_ver.stdout.decode('utf-8')[2] < "5":
-            logger.error(
-                'Old version of istio detected when running "istioctl" from PATH.')  # noqa
-        else:
-            logger.info('✓ istioctl')
-            logger.debug(istioctl_ver.stdout.decode('utf-8'))
-    except FileNotFoundError:
-        logger.critical('istioctl not found in PATH.')
-    except s.CalledProcessError as error:
-        logger.critical('istioctl version returned something unexpected: ' +
-                        error.stderr.decode('utf-8'))
+    if output == 'json':
+        click.echo(json.dumps({'checks': [r.as_dict() for r in results],
+                               'duration': round(duration, 3)}, indent=2))
+    else:
+        for result in results:
+            result.log()
+        logger.debug('Preflight checks took {:.2f}s'.format(duration))
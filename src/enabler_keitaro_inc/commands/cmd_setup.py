@@ -1,18 +1,21 @@
 from src.enabler_keitaro_inc.enabler import pass_environment, logger
+from src.enabler_keitaro_inc.helpers import addresses, cache, dependencies
+from src.enabler_keitaro_inc.helpers import download
+from src.enabler_keitaro_inc.helpers import containers, helm, istioctl, kube
+from src.enabler_keitaro_inc.helpers import kubeapi
+from src.enabler_keitaro_inc.helpers import manifests, versions
 
 import click
 import click_spinner
-import subprocess as s
-import docker
-import ipaddress
-import urllib.request
+import contextlib
 import os
 import stat
-import tarfile
-import yaml
-import requests
 import semver
-import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+BITNAMI_REPO = 'https://charts.bitnami.com/bitnami'
 
 
 # Setup group of commands
@@ -28,9 +31,18 @@ def cli(ctx, kube_context_cli):
 
 # Fetch all binaries for the dependencies
 @cli.command('init', short_help='Initialize dependencies')
+@click.option('--verify',
+              help='Re-hash the binaries in bin/ and download again the ones '
+              'that do not match their recorded checksum',
+              is_flag=True)
+@click.option('--insecure',
+              help='Install binaries without a checksum to verify them '
+              'against when none is pinned and the upstream one cannot be '
+              'fetched',
+              is_flag=True)
 @click.pass_context
 @pass_environment
-def init(ctx, kube_context_cli):
+def init(ctx, kube_context_cli, verify, insecure):
     """Download binaries for all dependencies"""
 
     # Check if bin folder exists
@@ -39,60 +51,60 @@ def init(ctx, kube_context_cli):
     # Figure out what kind of OS are we on
     ostype = os.uname().sysname.lower()
 
-    # Load URLs from the JSON file
+    # Load the dependencies manifest
     enabler_path = get_path()
     file_path = os.path.join(enabler_path, 'dependencies.yaml')
-    with open(file_path, 'r') as f:
-        urls = yaml.safe_load(f)
-
-    # Use the URLs
-    kubectl_url = urls["kubectl"].format(ostype)
-    helm_url = urls["helm"].format(ostype)
-    istioctl_url = urls["istioctl"].format(ostype)
-    kind_url = urls["kind"].format(ostype)
-    skaffold_url = urls["skaffold"].format(ostype)
-
-    with click_spinner.spinner():
-        # Download kubectl if not exists
-        kubectl_location = 'bin/kubectl'
-        if os.path.exists(kubectl_location):
-            logger.info(f'kubectl already exists at: {kubectl_location}')
-        else:
-            logger.info('Downloading kubectl...')
-            download_and_make_executable(kubectl_url, kubectl_location, 'kubectl') # noqa
-
-        # Download helm if not exists or update if necessary
-        helm_location = 'bin/helm'
-        if os.path.exists(helm_location):
-            logger.info(f'helm already exists at: {helm_location}')
-            update_binary_if_necessary(helm_location, helm_url, ostype)
-        else:
-            download_and_make_executable(helm_url, helm_location, 'helm')
-
-        # Download istioctl if not exists or update if necessary
-        istioctl_location = 'bin/istioctl'
-        if os.path.exists(istioctl_location):
-            logger.info(f'istioctl already exists at: {istioctl_location}')
-            update_binary_if_necessary(istioctl_location, istioctl_url, ostype)
+    deps = dependencies.load(file_path, ostype)
+
+    if verify:
+        # Only the binaries that fail verification are fetched again
+        corrupt = dependencies.verify_installed('bin', [d.name for d in deps]) # noqa
+        for name, error in corrupt.items():
+            logger.warning(f'{name} failed verification ({error}), '
+                           'downloading it again')
+        deps = [dep for dep in deps if dep.name in corrupt]
+        for dep in deps:
+            cache.discard(dep.url)
+            if os.path.exists('bin/' + dep.name):
+                os.remove('bin/' + dep.name)
+        if not deps:
+            logger.info('✓ All binaries in bin/ verified')
+
+    # Probe the installed binaries once and replace the ones that are
+    # not at the version pinned in the manifest
+    installed = versions.installed_versions('bin', [d.name for d in deps])
+    for dep in deps:
+        if dep.name not in installed:
+            continue
+        wanted = versions.normalize(dep.version)
+        if installed[dep.name] is None:
+            # A probe failing says nothing about the binary, keep it
+            logger.warning(f'Could not tell the version of bin/{dep.name}, '
+                           'keeping it')
+        elif wanted is None or installed[dep.name] == wanted:
+            logger.info(f'{dep.name} {installed[dep.name] or ""} already '
+                        f'exists at: bin/{dep.name}')
         else:
-            download_and_make_executable(istioctl_url, istioctl_location, 'istioctl') # noqa
-
-        # Download kind if not exists or update if necessary
-        kind_location = 'bin/kind'
-        if os.path.exists(kind_location):
-            logger.info(f'kind already exists at: {kind_location}')
-            update_binary_if_necessary(kind_location, kind_url, ostype)
-        else:
-            logger.info('Downloading kind...')
-            download_and_make_executable(kind_url, kind_location, 'kind')
+            logger.info(f'Updating {dep.name} from '
+                        f'{installed[dep.name]} to {wanted}...')
+            os.remove('bin/' + dep.name)
+
+    # Download every missing dependency concurrently, the total time is
+    # roughly that of the slowest download
+    digests = {}
+    jobs = [(dep.name, install_binary, (dep, digests, insecure))
+            for dep in deps
+            if not os.path.exists('bin/' + dep.name)]
+    with click_spinner.spinner():
+        failed = download.run_parallel(jobs)
+    if digests:
+        dependencies.record_checksums('bin', digests)
+    for name, error in failed.items():
+        logger.error('Could not download ' + name + ': ' + str(error))
+    if failed:
+        raise click.Abort()
 
-        # Download skaffold if not exists
-        skaffold_location = 'bin/skaffold'
-        if os.path.exists(skaffold_location):
-            logger.info(f'skaffold already exists at: {skaffold_location}')
-        else:
-            logger.info('Downloading skaffold...')
-            download_and_make_executable(skaffold_url, skaffold_location, 'skaffold') # noqa
+    report_upstream_releases(deps)
 
     logger.info('All dependencies downloaded to bin/')
     logger.info('IMPORTANT: Please add the path to your user profile to ' +
@@ -101,84 +113,75 @@ def init(ctx, kube_context_cli):
     logger.info('$ source ~/.profile')
 
 
-def get_latest_version_from_github(repo_url, ostype):
-    try:
-        # Fetch the GitHub releases page
-        response = requests.get(repo_url)
-        response.raise_for_status()
-        latest_version = response.json()["tag_name"]
-        if latest_version:
-            return latest_version
+def install_binary(dep, digests, insecure=False):
+    """Download a single dependency into bin/. The digest of the
+    installed binary is added to digests"""
+    location = 'bin/' + dep.name
+    # A warm cache is used without fetching the upstream checksum, the
+    # download was verified against it when it was stored
+    cached = cache.lookup(dep.url, dep.pinned_sha256, verified=not insecure)
+    if cached is not None:
+        cache.link(cached, location)
+        logger.info(f'{dep.name} linked from the cache')
+    else:
+        logger.info(f'Downloading {dep.name}...')
+        sha256 = verified_sha256(dep, insecure)
+        if dep.member:
+            cached = download_and_extract_tar(dep.url, location, dep.member, sha256) # noqa
         else:
-            logger.error("Failed to find latest release tag")
-            return None
-    except requests.exceptions.RequestException as e: # noqa
-        logger.info("Latest release not found")
-        return None
+            cached = download_and_make_executable(dep.url, location, dep.name, sha256) # noqa
+    # Cached objects are named by their digest
+    digests[dep.name] = os.path.basename(cached)
 
 
-def get_current_version(binary_location, binary_name):
-    if os.path.exists(binary_location):
-        filename = os.path.basename(binary_location)
-        version = extract_version_from_filename(filename, binary_name)
-        return version
-    else:
-        logger.error(f"Binary {binary_name} not found at location: {binary_location}") # noqa
+def verified_sha256(dep, insecure):
+    """Return the digest to verify the download of dep against. Without
+    one dep is only installed, unverified, when insecure is set"""
+    try:
+        return dep.expected_sha256()
+    except download.DownloadError as error:
+        if not insecure:
+            raise download.DownloadError(
+                str(error) + ', pin its sha256 in dependencies.yaml or '
+                'pass --insecure')
+        logger.warning(str(error) + ', installing it unverified')
         return None
 
 
-def extract_version_from_filename(filename, binary_name):
-    if binary_name in filename:
-        # Check if the filename contains the binary_name
-        if binary_name == "helm" or binary_name == "istioctl":
-            match = re.search(r'{}-v(\d+\.\d+\.\d+)'.format(binary_name), filename) # noqa
-            if match:
-                return match.group(1)
-        elif binary_name == "kind":
-            match = re.search(r'{}-(\d+\.\d+\.\d+)'.format(binary_name), filename) # noqa
-            if match:
-                return match.group(1)
-    return None
-
-
-def download_and_make_executable(url, destination, binary_name):
-    if binary_name in ['skaffold', 'kind', 'kubectl']:
-        urllib.request.urlretrieve(url, destination)
-        st = os.stat(destination)
-        os.chmod(destination, st.st_mode | stat.S_IEXEC)
-        logger.info(f'{os.path.basename(destination)} downloaded and made executable!') # noqa
-    elif binary_name in ['helm', 'istioctl']:
-        download_and_extract_tar(url, destination, binary_name)
-
-
-def download_and_extract_tar(url, destination, binary_name):
-    tar_filename = f'bin/{binary_name}.tar.gz'
-    urllib.request.urlretrieve(url, tar_filename)
-    tar = tarfile.open(tar_filename, 'r:gz')
-    for member in tar.getmembers():
-        if member.isreg():
-            member.name = os.path.basename(member.name)
-            tar.extract(member, 'bin')
-    tar.close()
-    os.remove(tar_filename)
+def report_upstream_releases(deps):
+    """Let the user know about releases newer than the pinned versions"""
+    repos = dict((dep.github, dep) for dep in deps if dep.github)
+    latest = versions.latest_releases('bin', list(repos))
+    for repo, release in latest.items():
+        dep = repos[repo]
+        try:
+            newer = semver.compare(release, versions.normalize(dep.version))
+        except (TypeError, ValueError):
+            continue
+        if newer > 0:
+            logger.info(f'{dep.name} {release} is available, '
+                        f'dependencies.yaml pins {dep.version}')
+
+
+def download_and_make_executable(url, destination, binary_name, sha256=None):
+    if binary_name in ['helm', 'istioctl']:
+        return download_and_extract_tar(url, destination, binary_name, sha256)
+    # Link from the user cache and only hit the network on a miss
+    cached = cache.fetch(url, lambda url, path: download.fetch(url, path, sha256), sha256) # noqa
+    cache.link(cached, destination)
+    st = os.stat(destination)
+    os.chmod(destination, st.st_mode | stat.S_IEXEC)
+    logger.info(f'{os.path.basename(destination)} downloaded and made executable!') # noqa
+    return cached
+
+
+def download_and_extract_tar(url, destination, binary_name, sha256=None):
+    # Only the binary is extracted from the streamed tarball and the
+    # tarball itself is verified against sha256 while it is read
+    cached = cache.fetch(url, lambda url, path: download.extract(url, path, binary_name, sha256), sha256) # noqa
+    cache.link(cached, destination)
     logger.info(f'{binary_name} downloaded and made executable!')
-
-
-def update_binary_if_necessary(binary_location, binary_url, ostype):
-    current_version = get_current_version(binary_location, os.path.basename(binary_url)) # noqa
-    latest_version = get_latest_version_from_github(binary_url, ostype)
-    if latest_version is not None:
-        if semver.compare(current_version, latest_version) < 0:
-            logger.info(f"Updating {os.path.basename(binary_location)}...")
-            urllib.request.urlretrieve(binary_url, f'{binary_location}.tar.gz')
-            tar = tarfile.open(f'{binary_location}.tar.gz', 'r:gz')
-            for member in tar.getmembers():
-                if member.isreg():
-                    member.name = os.path.basename(member.name)
-                    tar.extract(member, os.path.dirname(binary_location))
-            tar.close()
-            os.remove(f'{binary_location}.tar.gz')
-            logger.info(f'{os.path.basename(binary_location)} updated!')
+    return cached
 
 
 # Metallb setup
@@ -188,14 +191,21 @@ def update_binary_if_necessary(binary_location, binary_url, ostype):
               required=False)
 @click.option('--ip-addresspool',
               help='IP Address range to be assigned to metallb, default is last 10 addresses from kind network.'   # noqa
-              'The IP address range should be in the kind network in order for the application to work properly.', # noqa
+              'The IP address range should be in the kind network in order for the application to work properly. ' # noqa
+              'Repeat the option to give metallb several ranges, e.g. an IPv4 and an IPv6 range.', # noqa
+              multiple=True,
               required=False)
+@click.option('--pool-size',
+              help='Number of addresses taken from the end of every subnet of the kind network when --ip-addresspool is not given', # noqa
+              type=click.IntRange(min=1),
+              default=addresses.POOL_SIZE)
 @click.option('--version',
               help='Version of metallb from bitnami. Default version is 4.6.0',
               default='4.6.0')
 @click.pass_context
 @pass_environment
-def metallb(ctx, kube_context_cli, kube_context, ip_addresspool, version):
+def metallb(ctx, kube_context_cli, kube_context, ip_addresspool, pool_size,
+            version):
     """Install and setup metallb on k8s"""
     # Check if metallb is installed
     if ctx.kube_context is not None:
@@ -204,159 +214,119 @@ def metallb(ctx, kube_context_cli, kube_context, ip_addresspool, version):
         logger.error("--kube-context was not specified")
         raise click.Abort()
 
-    try:
-        metallb_exists = s.run(['helm',
-                                'status',
-                                'metallb',
-                                '-n',
-                                'metallb',
-                                '--kube-context',
-                                'kind-' + kube_context],
-                               capture_output=True, check=True)
-        logger.info('Metallb is already installed, exiting...')
-        logger.debug(metallb_exists.stdout.decode('utf-8'))
-        raise click.Abort()
-    except s.CalledProcessError:
-        logger.info('Metallb not found. Installing...')
-        pass
-    try:
-        metallb_repo_add = s.run(['helm',
-                                  'repo',
-                                  'add',
-                                  'bitnami',
-                                  'https://charts.bitnami.com/bitnami'],
-                                 capture_output=True, check=True)
-        logger.info('Downloading metallb version ...')
-        logger.debug(metallb_repo_add.stdout.decode('utf-8'))
-        metallb_repo_add = s.run(['helm',
-                                  'repo',
-                                  'update'],
-                                 capture_output=True, check=True)
-        logger.info('Repo update ...')
-        logger.debug(metallb_repo_add.stdout.decode('utf-8'))
-
-    except s.CalledProcessError as error:
-        logger.info('Metallb repo not found.')
-        logger.error(error.stdout.decode('utf-8'))
-        raise click.Abort()
-
-    # Get the Subnet of the kind network
-    client = docker.from_env()
-    networks = client.networks()
-
-    # Find the network with name 'kind'
-    kind_network = None  # Initialize kind_network outside the loop
-    for network in networks:
-        if network['Name'] == 'kind':
-            kind_network = network
-            break
-
+    # Get the Subnets of the kind network, IPv4 and on dual-stack IPv6
+    kind_network = containers.network('kind')
     if kind_network is not None:
-        # Do something with kind_network
-        logger.info("Kind network found:", kind_network)
-        kind_subnet = kind_network['IPAM']['Config'][0]['Subnet']
+        logger.debug('Kind network found: ' + kind_network['Id'])
+        kind_subnets = [config['Subnet'] for config in
+                        kind_network['IPAM']['Config'] if 'Subnet' in config]
     else:
-        logger.info("Kind network not found.")
-
-    # Extract the last 10 ip addresses of the kind subnet
-    ips = [str(ip) for ip in ipaddress.IPv4Network(kind_subnet)]
-    metallb_ips = ips[-10:]
+        logger.error('Kind network not found.')
+        raise click.Abort()
 
-    if ip_addresspool is None:
-        ip_addresspool = metallb_ips[0] + ' - ' + metallb_ips[-1]
-    else:
-        # Check if ip address range is in kind network and print out a warning
-        ip_range = ip_addresspool.strip().split('-')
+    if not ip_addresspool:
+        # Take the last addresses of every subnet of the kind network
         try:
-            start_ip = ipaddress.IPv4Address(ip_range[0])
-            end_ip = ipaddress.IPv4Address(ip_range[1])
-        except Exception:
-            logger.error('Incorrect IP address range: ' + ip_addresspool)
-
-        if start_ip not in ipaddress.IPv4Network(kind_subnet) or end_ip not in ipaddress.IPv4Network(kind_subnet): # noqa
-            logger.error('Provided IP address range not in kind network.')
-            logger.error('Kind subnet is: ' + kind_subnet)
+            ranges = [addresses.tail_range(subnet, pool_size)
+                      for subnet in kind_subnets]
+        except ValueError as error:
+            logger.error(str(error))
             raise click.Abort()
+    else:
+        # Check if ip address ranges are in the kind network
+        ranges = []
+        for pool in ip_addresspool:
+            try:
+                address_range = addresses.parse_range(pool)
+            except ValueError:
+                logger.error('Incorrect IP address range: ' + pool)
+                raise click.Abort()
+            if not any(addresses.within(address_range, subnet)
+                       for subnet in kind_subnets):
+                logger.error('Provided IP address range not in kind network.') # noqa
+                logger.error('Kind subnet is: ' + ', '.join(kind_subnets))
+                raise click.Abort()
+            ranges.append(address_range)
+
+    # Addresses metallb hands out must not be taken by the kind nodes or
+    # other containers on the kind network
+    used = containers.network_addresses(kind_network)
+    taken = [(address_range, name, address) for address_range in ranges
+             for name, address in addresses.conflicts(address_range, used)]
+    for address_range, name, address in taken:
+        logger.error('IP address range ' + addresses.format_range(address_range) + # noqa
+                     ' overlaps with ' + str(address) + ' of ' + name)
+    if taken:
+        raise click.Abort()
+    ip_addresspool = ', '.join(addresses.format_range(address_range)
+                               for address_range in ranges)
+
+    # Metallb 3.x.x is configured with a config map, 4.x.x and newer
+    # with custom resources. The IP address range is set in memory
+    major = version.split('.')[0]
+    if major == '3':
+        template = 'metallb-configmap.yaml'
+    elif major.isdigit() and int(major) >= 4:
+        template = 'metallb-crd.yaml'
+    else:
+        logger.error('Incompatible format for Metallb version. Please check official versions ') # noqa
+        raise click.Abort()
+    documents = manifests.render(
+        template, addresses=[addresses.format_range(address_range)
+                             for address_range in ranges])
+    logger.info('Metallb will be configured in Layer 2 mode with the range: ' + ip_addresspool) # noqa
 
-    # Check if version is 3.x.x and then use config map to install, else if version 4.x.x use CDR file for installing. # noqa
-    # And dynamically set the IP Address range in the compatible .yaml file
-    if version.split('.')[0] == '3':
-        yaml_file_path = 'enabler/metallb-configmap.yaml'
-        with open(yaml_file_path, 'r') as yaml_file:
-            config = yaml.safe_load(yaml_file)
-        modified_string = config['data']['config'][:-32]+ip_addresspool+"\n"
-        config['data']['config'] = modified_string
-
-        logger.info('Metallb will be configured in Layer 2 mode with the range: ' + ip_addresspool) # noqa
-        updated_yaml = yaml.dump(config, default_flow_style=False)
-        with open(yaml_file_path, 'w') as yaml_file:
-            yaml_file.write(updated_yaml)
-
-    elif int(version.split('.')[0]) >= 4:
-        yaml_file_path = 'metallb-crd.yaml'
-        with open(yaml_file_path, 'r') as yaml_file:
-            config = list(yaml.safe_load_all(yaml_file))
-
-
-        logger.info('Metallb will be configured in Layer 2 mode with the range: ' + ip_addresspool) # noqa
-        for doc in config:
-            if 'kind' in doc and doc['kind'] == 'IPAddressPool':
-                doc['spec']['addresses'] = [ip_addresspool]
-
-        with open(yaml_file_path, 'w') as yaml_file:
-            yaml.dump_all(config, yaml_file, default_flow_style=False)
+    # Install or upgrade the chart unless the desired version is deployed
+    try:
+        deployed = helm.release('metallb', 'metallb', kube_context)
+    except helm.HelmError as error:
+        logger.error('Could not look up the metallb release')
+        logger.error(str(error))
+        raise click.Abort()
+    if deployed and deployed.get('status') == 'deployed' and \
+            helm.chart_version(deployed, 'metallb') == version:
+        logger.info('Metallb ' + version + ' is already installed.')
     else:
-        logger.info('Incompatible format for Metallb version. Please check official versions ') # noqa
-    ns_exists = s.run(['kubectl',
-                       'get',
-                       'ns',
-                       'metallb',
-                       '--context',
-                       'kind-' + kube_context],
-                      capture_output=True)
-    if ns_exists.returncode != 0:
         try:
-            metallb_ns = s.run(['kubectl',  # noqa
-                                'create',
-                                'ns',
-                                'metallb',
-                                '--context',
-                                'kind-' + kube_context],
-                               capture_output=True, check=True)
-            logger.info('Created a namespace for metallb')
-        except s.CalledProcessError as error:
+            if kube.ensure_namespace(kube_context, 'metallb'):
+                logger.info('Created a namespace for metallb')
+            else:
+                logger.info('Skipping creation of metallb namespace '
+                            'since it already exists.')
+        except kubeapi.ApiError as error:
             logger.error('Could not create namespace for metallb: ' +
-                         error.stderr.decode('utf-8'))
+                         str(error))
             raise click.Abort()
-    else:
-        logger.info('Skipping creation of metallb namespace '
-                    'since it already exists.')
-    # Install metallb on the cluster
+        logger.info('Installing metallb ' + version + ', please wait...')
+        try:
+            with click_spinner.spinner():
+                helm.ensure_repo('bitnami', BITNAMI_REPO)
+                helm_metallb = helm.upgrade_install(
+                    'metallb', 'bitnami/metallb', version, 'metallb',
+                    kube_context)
+            logger.debug(helm_metallb)
+        except helm.HelmError as error:
+            logger.error('Could not install metallb')
+            logger.error(str(error))
+            raise click.Abort()
+
+    # Apply the configuration unless the cluster already has it
     try:
-        helm_metallb = s.run(['helm',
-                              'install',
-                              'metallb',
-                              '--kube-context',
-                              'kind-' + kube_context,
-                              '--version',
-                              version,
-                              'bitnami/metallb',
-                              '-n',
-                              'metallb',
-                              '--wait'],
-                             capture_output=True, check=True)
-
-        # Apply configuration from CRD file
-        config_metallb = s.run(['kubectl',  # noqa
-                                'apply',
-                                '-f',
-                                yaml_file_path], capture_output=True, check=True) # noqa
-
-        logger.info('✓ Metallb installed on cluster.')
-        logger.debug(helm_metallb.stdout.decode("utf-8"))
-    except s.CalledProcessError as error:
-        logger.error('Could not install metallb')
-        logger.error(error.stderr.decode('utf-8'))
+        stale = [document for document in documents
+                 if not kube.up_to_date(kube.get_object(
+                     kube_context, document['apiVersion'], document['kind'],
+                     document['metadata']['name'],
+                     document['metadata'].get('namespace')), document)]
+        if stale:
+            kube.apply(kube_context, stale)
+            logger.info('Metallb configured.')
+        else:
+            logger.info('Metallb configuration is up to date.')
+    except kubeapi.ApiError as error:
+        logger.error('Could not configure metallb')
+        logger.error(str(error))
+        raise click.Abort()
+    logger.info('✓ Metallb installed on cluster.')
 
 
 # Istio setup
@@ -364,12 +334,16 @@ def metallb(ctx, kube_context_cli, kube_context, ip_addresspool, version):
 @click.option('--kube-context',
               help='The kubernetes context to use',
               required=False)
+@click.option('--timeout',
+              help='Seconds to wait for istio to become ready',
+              type=float,
+              default=600)
 @click.argument('monitoring_tools',
                 required=False
                 )
 @click.pass_context
 @pass_environment
-def istio(ctx, kube_context_cli, kube_context, monitoring_tools):
+def istio(ctx, kube_context_cli, kube_context, timeout, monitoring_tools):
     """Install and setup istio on k8s"""
     if ctx.kube_context is not None:
         kube_context = ctx.kube_context
@@ -377,62 +351,155 @@ def istio(ctx, kube_context_cli, kube_context, monitoring_tools):
         logger.error("--kube-context was not specified")
         raise click.Abort()
 
+    deadline = time.monotonic() + timeout
+    flags = list(istioctl.DEFAULT_FLAGS)
+    if monitoring_tools == 'monitoring-tools':
+        flags += istioctl.MONITORING_FLAGS
+    timings = []
+
+    # Render the manifest, or reuse the cached one, while looking up the
+    # hash of the manifest applied last time
+    with phase('render', timings), ThreadPoolExecutor(max_workers=2) as executor: # noqa
+        rendered = executor.submit(istioctl.render, flags)
+        live = executor.submit(kube.get_object, kube_context, 'v1',
+                               'Namespace', istioctl.NAMESPACE)
+        try:
+            manifest, cached = rendered.result()
+            namespace = live.result()
+        except (istioctl.IstioError, kubeapi.ApiError) as error:
+            logger.critical('Could not render the istio manifest')
+            logger.critical(str(error))
+            raise click.Abort()
+    logger.debug('Istio manifest ' + ('reused from cache' if cached
+                                      else 'rendered'))
+    digest = istioctl.manifest_hash(manifest)
+    annotations = (namespace or {}).get('metadata', {}).get(
+        'annotations') or {}
+    if annotations.get(istioctl.HASH_ANNOTATION) == digest:
+        logger.info('Istio is up to date')
+        return
+
     # Run verify install to check whether we are ready to install istio
-    try:
-        istio_verify = s.run(['istioctl',
-                              'verify-install',
-                              '--context',
-                              'kind-' + kube_context],
-                             capture_output=True, check=True)
-        logger.info('Istio pre-check passed. Proceeding with install')
-        logger.info(istio_verify.stderr.decode('utf-8'))
-    except s.CalledProcessError as error:
-        logger.critical('Istio pre-check failed')
-        logger.critical(error.stderr.decode('utf-8'))
-        raise click.Abort()
+    with phase('verify', timings):
+        try:
+            logger.info(istioctl.verify_install(kube_context))
+            logger.info('Istio pre-check passed. Proceeding with install')
+        except istioctl.IstioError as error:
+            logger.critical('Istio pre-check failed')
+            logger.critical(str(error))
+            raise click.Abort()
 
     # Install Istio
     logger.info('Installing istio, please wait...')
     with click_spinner.spinner():
-        istio_command = ['istioctl',
-                         'manifest',
-                         'apply',
-                         '-y',
-                         '--set',
-                         'profile=default']
-        if monitoring_tools == 'monitoring-tools':
-            monitoring_config = ['--set',
-                                 'addonComponents.grafana.enabled=true',
-                                 '--set',
-                                 'addonComponents.kiali.enabled=true',
-                                 '--set',
-                                 'addonComponents.prometheus.enabled=true',
-                                 '--set',
-                                 'addonComponents.tracing.enabled=true',
-                                 '--set',
-                                 'values.kiali.dashboard.jaegerURL=http://jaeger-query:16686',  # noqa
-                                 '--set',
-                                 'values.kiali.dashboard.grafanaURL=http://grafana:3000']  # noqa
-
-        istio_command.extend(monitoring_config)
-        istio_command.append('--context')
-        istio_command.append('kind-' + kube_context)
-        istio_command.append('--wait')
-        try:
-            istio_install = s.run(istio_command,
-                                  capture_output=True, check=True)
-            logger.info('Istio installed')
-            logger.debug(istio_install.stdout.decode('utf-8'))
-        except s.CalledProcessError as error:
-            logger.critical('Istio installation failed')
-            logger.critical(error.stderr.decode('utf-8'))
-            raise click.Abort()
-        if monitoring_tools == 'monitoring-tools':
+        with phase('apply', timings):
+            # Imported here to keep the startup of the CLI fast
+            import yaml
             try:
-                grafana_virtual_service = s.run(['kubectl', 'apply', '-f', 'grafana-vs.yaml'], capture_output=True, check=True) # noqa
-            except Exception as e:
-                logger.error('Error setting grafana URL')
-                logger.error(str(e))
+                kube.apply_manifest(kube_context,
+                                    [d for d in yaml.safe_load_all(manifest)
+                                     if d], deadline)
+            except kubeapi.ApiError as error:
+                logger.critical('Istio installation failed')
+                logger.critical(str(error))
+                raise click.Abort()
+
+        # Steps that only depend on the manifest being applied
+        with phase('addons', timings), ThreadPoolExecutor() as executor:
+            ready = executor.submit(kube.wait_for_deployments, kube_context,
+                                    istioctl.NAMESPACE, deadline)
+            if monitoring_tools == 'monitoring-tools':
+                grafana = executor.submit(kube.apply, kube_context,
+                                          manifests.render('grafana-vs.yaml'))
+                try:
+                    grafana.result()
+                except kubeapi.ApiError as error:
+                    logger.error('Error setting grafana URL')
+                    logger.error(str(error))
+            try:
+                pending = ready.result()
+            except (kubeapi.ApiError, OSError) as error:
+                logger.critical('Could not check whether istio is ready')
+                logger.critical(str(error))
+                raise click.Abort()
+    if pending:
+        logger.critical('Istio installation failed, not ready: ' +
+                        ', '.join(pending))
+        raise click.Abort()
+
+    # Remember what was applied so an unchanged setup is skipped next time.
+    # A merge patch, an apply would drop the labels of the istio manifest
+    try:
+        kube.annotate(kube_context, 'v1', 'Namespace', istioctl.NAMESPACE,
+                      {istioctl.HASH_ANNOTATION: digest})
+    except kubeapi.ApiError as error:
+        logger.warning('Could not record the istio manifest hash: ' +
+                       str(error))
+    logger.info('Istio installed')
+    logger.info(', '.join('{} {:.2f}s'.format(name, seconds)
+                          for name, seconds in timings))
+
+
+@contextlib.contextmanager
+def phase(name, timings):
+    """Record how long the block took as the timing of phase name"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        seconds = time.monotonic() - start
+        timings.append((name, seconds))
+        logger.debug('{} took {:.2f}s'.format(name.capitalize(), seconds))
+
+
+# Manage the binary cache shared between workspaces
+@cli.group('cache', short_help='Manage the binary cache')
+def cache_cli():
+    """Manage the user level cache of downloaded binaries, by default
+    located in $XDG_CACHE_HOME/enabler"""
+    pass
+
+
+@cache_cli.command('list', short_help='List cached binaries')
+def cache_list():
+    """List cached binaries and the URLs they were downloaded from"""
+    index = cache.load_index()
+    if not index:
+        logger.info('Cache at ' + cache.cache_dir() + ' is empty')
+        return
+    for url, entry in sorted(index.items(), key=lambda i: -i[1]['used']):
+        logger.info('{} {:>10} {}'.format(entry['sha256'][:12],
+                                          entry['size'], url))
+    total = sum(dict((e['sha256'], e['size']) for e in index.values()).values()) # noqa
+    logger.info(f'{len(index)} entries, {total} bytes in {cache.cache_dir()}') # noqa
+
+
+@cache_cli.command('prune', short_help='Evict cached binaries')
+@click.option('--max-size',
+              help='Evict least recently used binaries until the cache is '
+              'smaller than this many bytes',
+              type=int,
+              default=cache.MAX_SIZE)
+@click.option('--all', 'prune_all',
+              help='Remove every cached binary',
+              is_flag=True)
+def cache_prune(max_size, prune_all):
+    """Evict least recently used binaries from the cache"""
+    removed = cache.prune(0 if prune_all else max_size)
+    for url in removed:
+        logger.info('Evicted ' + url)
+    logger.info(f'{len(removed)} entries removed from the cache')
+
+
+@cache_cli.command('verify', short_help='Verify cached binaries')
+def cache_verify():
+    """Re-hash cached binaries and drop the corrupt ones"""
+    corrupt = cache.verify()
+    for url in corrupt:
+        logger.error('Corrupt cache entry removed: ' + url)
+    if corrupt:
+        raise click.Abort()
+    logger.info('✓ All cached binaries verified')
 
 
 def get_path():
@@ -0,0 +1,213 @@
+from src.enabler_keitaro_inc.enabler import pass_environment, logger
+from src.enabler_keitaro_inc.commands import cmd_apps, cmd_kind, \
+    cmd_platform, cmd_setup
+from src.enabler_keitaro_inc.helpers import cache, containers, kind, kube, \
+    kubeapi, stages
+
+import click
+import hashlib
+import json
+import os
+
+
+def invoke(ctx, command, **params):
+    """Run a command in this process with params converted and checked
+    like on the command line, missing params get their defaults"""
+    for param in command.params:
+        if param.name in params:
+            params[param.name] = param.type_cast_value(ctx,
+                                                       params[param.name])
+    return ctx.invoke(command, **params)
+
+
+def setup_init(ctx, cluster, options):
+    invoke(ctx, cmd_setup.init, verify=options.get('verify', False))
+
+
+def platform_init(ctx, cluster, options):
+    invoke(ctx, cmd_platform.init,
+           submodules=options.get('submodules', 'all'),
+           repopath=options.get('repopath', os.getcwd()))
+
+
+def cluster_up(ctx, cluster, options):
+    """Create the cluster or start it if it exists"""
+    if kind.cluster(cluster) is not None:
+        invoke(ctx, cmd_kind.start, kube_context=cluster,
+               timeout=options.get('timeout', 300))
+    else:
+        invoke(ctx, cmd_kind.create, kube_context=cluster,
+               configfile=options.get('config', 'kind-cluster.yaml'),
+               with_registry=options.get('registry', False))
+    # The kubeconfig and the node containers changed, the clients shared
+    # by the next stages are created from the new ones
+    kubeapi.invalidate('kind-' + cluster)
+    containers.invalidate(cluster)
+    if not kube.kubectl_info(cluster):
+        logger.error('Kind cluster \'' + cluster + '\' is not running')
+        raise click.Abort()
+
+
+def setup_metallb(ctx, cluster, options):
+    pools = options.get('ip-addresspool', ())
+    invoke(ctx, cmd_setup.metallb, kube_context=cluster,
+           ip_addresspool=[pools] if isinstance(pools, str) else pools,
+           **dict((key.replace('-', '_'), options[key])
+                  for key in ('pool-size', 'version') if key in options))
+
+
+def setup_istio(ctx, cluster, options):
+    invoke(ctx, cmd_setup.istio, kube_context=cluster,
+           timeout=options.get('timeout', 600),
+           monitoring_tools='monitoring-tools'
+           if options.get('monitoring') else None)
+
+
+def apps_namespaces(ctx, cluster, options):
+    invoke(ctx, cmd_apps.ns, kube_context=cluster,
+           names=options.get('names', ()),
+           file_path=options.get('file'),
+           istio_injection=options.get('istio-injection', True))
+
+
+# Stages known to `up`: the function running the stage, the stages it
+# needs when they are configured and the options it accepts
+STAGES = {
+    'init': (setup_init, (), ('verify',)),
+    'platform': (platform_init, (), ('submodules', 'repopath')),
+    'cluster': (cluster_up, ('init',), ('config', 'registry', 'timeout')),
+    'metallb': (setup_metallb, ('init', 'cluster'),
+                ('ip-addresspool', 'pool-size', 'version')),
+    'istio': (setup_istio, ('init', 'cluster', 'metallb'),
+              ('monitoring', 'timeout')),
+    'namespaces': (apps_namespaces, ('cluster',),
+                   ('names', 'file', 'istio-injection')),
+}
+
+
+def load_config(path):
+    """Read the config of `up`, a mapping with the cluster name and the
+    options of every stage to run, keyed by stage name"""
+    # Imported here to keep the startup of the CLI fast
+    import yaml
+    with open(path, 'r') as f:
+        config = yaml.safe_load(f) or {}
+    if not isinstance(config, dict) or \
+            not isinstance(config.get('stages') or {}, dict):
+        raise click.BadParameter('Expected a mapping with a stages mapping',
+                                 param_hint='CONFIGFILE')
+    configured = {}
+    for name, options in (config.get('stages') or {}).items():
+        options = options or {}
+        if name not in STAGES:
+            raise click.BadParameter('Unknown stage ' + str(name),
+                                     param_hint='CONFIGFILE')
+        if not isinstance(options, dict):
+            raise click.BadParameter('Options of stage ' + name +
+                                     ' must be a mapping',
+                                     param_hint='CONFIGFILE')
+        unknown = set(options) - set(STAGES[name][2]) - {'needs'}
+        if unknown:
+            raise click.BadParameter('Unknown options of stage ' + name +
+                                     ': ' + ', '.join(sorted(unknown)),
+                                     param_hint='CONFIGFILE')
+        configured[name] = options
+    return config.get('cluster'), configured
+
+
+def stage_digest(cluster, options):
+    """Hash what a stage was run with, a checkpoint is only reused for
+    the same cluster and options"""
+    return hashlib.sha256(json.dumps([cluster, options],
+                                     sort_keys=True).encode('utf-8')
+                          ).hexdigest()
+
+
+def state_path(cluster):
+    return os.path.join(cache.cache_dir(), 'up', cluster + '.json')
+
+
+@click.command('up', short_help='Bring up a cluster and its services')
+@click.argument('configfile',
+                type=click.Path(exists=True, dir_okay=False),
+                default='enabler.yaml')
+@click.option('--kube-context',
+              help='The kubernetes context to use',
+              required=False)
+@click.option('--fresh',
+              help='Run every stage, ignoring the stages a failed run '
+              'completed',
+              is_flag=True)
+@click.pass_context
+@pass_environment
+def cli(ctx, kube_context_cli, configfile, kube_context, fresh):
+    """Create or start a kind cluster and set it up as described in
+    CONFIGFILE. Stages that don't need each other run at the same time
+    and a failed run resumes after the stages it completed"""
+    cluster, configured = load_config(configfile)
+    # --kube-context of enabler, then of up, then the config
+    kube_context = ctx.kube_context or kube_context or cluster
+    if not kube_context:
+        logger.error("--kube-context was not specified")
+        raise click.Abort()
+    # Every stage works on this cluster
+    ctx.kube_context = kube_context
+
+    # Binaries downloaded by the init stage are used by the later ones
+    bin_path = os.path.join(os.getcwd(), 'bin')
+    if bin_path not in os.environ.get('PATH', '').split(os.pathsep):
+        os.environ['PATH'] = bin_path + os.pathsep + \
+            os.environ.get('PATH', '')
+
+    def action(name):
+        return lambda: STAGES[name][0](kube_context_cli, kube_context,
+                                       configured[name])
+
+    plan = []
+    for name, options in configured.items():
+        needs = options.get('needs')
+        if needs is None:
+            needs = [need for need in STAGES[name][1] if need in configured]
+        elif isinstance(needs, str):
+            needs = [needs]
+        plan.append(stages.Stage(name, action(name), needs))
+    try:
+        stages.order(plan)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint='CONFIGFILE')
+
+    digests = dict((name, stage_digest(kube_context, options))
+                   for name, options in configured.items())
+    path = state_path(kube_context)
+    state = {} if fresh else stages.load_state(path)
+    done = [name for name, digest in state.items()
+            if digests.get(name) == digest]
+    for name in done:
+        logger.info('Stage ' + name + ' completed by a previous run')
+
+    def checkpoint(name):
+        state[name] = digests[name]
+        stages.save_state(path, state)
+
+    results = stages.run(plan, done, checkpoint)
+    failed = False
+    for name in stages.order(plan):
+        outcome, seconds, error = results[name]
+        if outcome == stages.FAILED:
+            failed = True
+            if isinstance(error, click.ClickException):
+                error = error.format_message()
+            logger.error('Stage ' + name + ' failed' +
+                         (': ' + str(error) if str(error) else ''))
+        elif outcome == stages.BLOCKED:
+            logger.error('Stage ' + name + ' did not run')
+        else:
+            logger.info('{} {} {:.2f}s'.format(name, outcome, seconds))
+    if failed:
+        logger.error('Run `enabler up` again to resume')
+        raise click.Abort()
+
+    # Everything is up, the next run checks every stage again
+    if os.path.exists(path):
+        os.remove(path)
+    logger.info('Kind cluster \'' + kube_context + '\' is up')
@@ -1,5 +1,5 @@
 from src.enabler_keitaro_inc.enabler import pass_environment, logger
-import pkg_resources
+from src.enabler_keitaro_inc.version import get_version
 import click
 
 # Command to get the current Enabler version
@@ -8,6 +8,4 @@ import click
 @pass_environment
 def cli(ctx, kube_context_cli):
     """Get current version of Enabler"""
-    distribution = pkg_resources.get_distribution("enabler")
-    version = distribution.version
-    logger.info("Enabler "+version)
+    logger.info("Enabler "+get_version())
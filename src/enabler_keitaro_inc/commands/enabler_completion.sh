@@ -7,19 +7,22 @@ _enabler_complete() {
 
     case "$prev_word" in
         "enabler") # noqa
-            COMPREPLY=( $(compgen -W "apps kind preflight platform setup version" -- "$cur_word") )
+            COMPREPLY=( $(compgen -W "apps kind preflight platform setup up version" -- "$cur_word") )
             ;;
         "apps")
-            COMPREPLY=( $(compgen -W "namespace" -- "$cur_word") )
+            COMPREPLY=( $(compgen -W "namespace configmap secret" -- "$cur_word") )
             ;;
         "platform")
             COMPREPLY=( $(compgen -W "init info keys release version" -- "$cur_word") )
             ;;
         "kind")
-            COMPREPLY=( $(compgen -W "create delete status start stop" -- "$cur_word") )
+            COMPREPLY=( $(compgen -W "create delete status start stop registry load snapshot restore" -- "$cur_word") )
             ;;
         "setup")
-            COMPREPLY=( $(compgen -W "init metallb istio" -- "$cur_word") )
+            COMPREPLY=( $(compgen -W "init cache metallb istio" -- "$cur_word") )
+            ;;
+        "cache")
+            COMPREPLY=( $(compgen -W "list prune verify" -- "$cur_word") )
             ;;
         *)
             COMPREPLY=()
@@ -1,8 +1,8 @@
 import os
+import importlib
 import logging
 import click
 import click_log
-import subprocess
 
 
 class CLI:
@@ -10,11 +10,8 @@ class CLI:
         self.runner = runner
 
     def version_command(self):
-        try:
-            result = subprocess.run(['enabler', 'version'], capture_output=True, text=True, check=True) # noqa
-            return result.stdout.strip()
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"Failed to get version: {e}")
+        from src.enabler_keitaro_inc.version import get_version
+        return 'Enabler ' + get_version()
 
 
 CONTEXT_SETTINGS = dict(auto_envvar_prefix="ENABLER")
@@ -28,31 +25,41 @@ class Environment(object):
 
 
 pass_environment = click.make_pass_decorator(Environment, ensure=True)
-cmd_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), "commands")) # noqa
 
 # Use logging for nicer handling of log output
 logger = logging.getLogger(__name__)
 click_log.basic_config(logger)
 
+# Registry of commands and their short help. Command modules are only
+# imported when they are invoked so listing them in --help is free
+COMMANDS = {
+    'apps': 'App commands',
+    'kind': 'Manage kind clusters',
+    'platform': 'Platform commands',
+    'preflight': 'Preflight checks',
+    'setup': 'Setup infrastructure services',
+    'up': 'Bring up a cluster and its services',
+    'version': 'Get current version of Enabler',
+}
+
 
 class EnablerCLI(click.MultiCommand):
     def list_commands(self, ctx):
-        rv = []
-        for filename in os.listdir(cmd_folder):
-            if filename.endswith(".py") and filename.startswith("cmd_"):
-                rv.append(filename[4:-3])
-        rv.sort()
-        return rv
+        return sorted(COMMANDS)
 
     def get_command(self, ctx, name):
-        try:
-            mod = __import__(
-                "src.enabler_keitaro_inc.commands.cmd_{}".format(name), None, None, ["cli"] # noqa
-            )
-        except ImportError:
+        if name not in COMMANDS:
             return
+        mod = importlib.import_module(
+            "src.enabler_keitaro_inc.commands.cmd_{}".format(name))
         return mod.cli
 
+    def format_commands(self, ctx, formatter):
+        rows = [(name, COMMANDS[name]) for name in self.list_commands(ctx)]
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
 
 @click.command(cls=EnablerCLI, context_settings=CONTEXT_SETTINGS)
 @click.option('--kube-context',
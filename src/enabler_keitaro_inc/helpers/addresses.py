@@ -0,0 +1,56 @@
+import ipaddress
+
+
+# Addresses handed to metallb per subnet of the kind network
+POOL_SIZE = 10
+
+
+def parse_range(text):
+    """Parse a metallb address range, 172.18.255.246-172.18.255.255,
+    the same with spaces around the dash or a CIDR, into a (first, last)
+    pair of addresses. Raises ValueError if it is not one"""
+    text = text.strip()
+    if '/' in text:
+        network = ipaddress.ip_network(text, strict=False)
+        return network.network_address, network.broadcast_address
+    first, separator, last = text.partition('-')
+    if not separator:
+        raise ValueError(text + ' is not an address range')
+    first = ipaddress.ip_address(first.strip())
+    last = ipaddress.ip_address(last.strip())
+    if first.version != last.version or first > last:
+        raise ValueError(text + ' is not an address range')
+    return first, last
+
+
+def format_range(address_range):
+    return '{} - {}'.format(*address_range)
+
+
+def tail_range(subnet, size=POOL_SIZE):
+    """Return the last size addresses of subnet before its broadcast
+    address, computed without enumerating the subnet so a /16 or an IPv6
+    /64 cost the same as a /24"""
+    network = ipaddress.ip_network(subnet, strict=False)
+    last = network.broadcast_address - 1
+    # Leave the network address and the gateway right after it alone
+    if size < 1 or network.num_addresses - 3 < size:
+        raise ValueError('Subnet ' + subnet + ' has no room for ' +
+                         str(size) + ' addresses')
+    return last - (size - 1), last
+
+
+def within(address_range, subnet):
+    """Whether the whole range lies in subnet"""
+    network = ipaddress.ip_network(subnet, strict=False)
+    first, last = address_range
+    return first.version == network.version and \
+        network.network_address <= first and \
+        last <= network.broadcast_address
+
+
+def conflicts(address_range, used):
+    """Return the (name, address) pairs of used that fall in the range"""
+    first, last = address_range
+    return [(name, address) for name, address in used
+            if address.version == first.version and first <= address <= last]
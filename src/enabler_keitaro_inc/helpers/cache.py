@@ -0,0 +1,233 @@
+from src.enabler_keitaro_inc.enabler import logger
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import stat
+import time
+
+
+# Binaries are shared between workspaces through a user level cache.
+# Objects are stored by their sha256 and the index maps every source
+# URL to the object it produced along with its size and last use time.
+MAX_SIZE = int(os.environ.get('ENABLER_CACHE_SIZE', 2 * 1024 ** 3))
+# Seconds after which a partial download nobody resumed is pruned
+STALE_TMP = 24 * 3600
+
+
+def cache_dir():
+    """Return the cache directory, honouring $XDG_CACHE_HOME"""
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'enabler')
+
+
+@contextlib.contextmanager
+def locked(name):
+    """Hold an exclusive lock on the cache, shared by every thread and
+    every enabler process using it. flock locks belong to the open file,
+    so threads opening the lock file exclude each other as well"""
+    directory = os.path.join(cache_dir(), 'locks')
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name + '.lock'), 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def objects_dir():
+    return os.path.join(cache_dir(), 'objects')
+
+
+def object_path(digest):
+    return os.path.join(objects_dir(), digest)
+
+
+def index_path():
+    return os.path.join(cache_dir(), 'index.json')
+
+
+def load_index():
+    try:
+        with open(index_path(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_index(index):
+    os.makedirs(cache_dir(), exist_ok=True)
+    tmp = index_path() + '.{}.tmp'.format(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp, index_path())
+
+
+def sha256sum(path):
+    """Hash a file through a read-only memory map. hashlib releases the
+    GIL while hashing large buffers so files can be hashed in parallel"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return hashlib.sha256(m).hexdigest()
+
+
+def lookup(url, source_sha256=None, verified=False):
+    """Return the object path cached for url or None on a miss. Entries
+    produced from a download with a different digest are misses, and so
+    are those of unverified downloads when verified is set"""
+    with locked('index'):
+        index = load_index()
+        entry = index.get(url)
+        if entry is None or not os.path.exists(object_path(entry['sha256'])): # noqa
+            return None
+        if source_sha256 is not None and \
+                entry.get('source_sha256') != source_sha256:
+            return None
+        if verified and entry.get('source_sha256') is None:
+            return None
+        entry['used'] = time.time()
+        save_index(index)
+    return object_path(entry['sha256'])
+
+
+def store(url, path, source_sha256=None):
+    """Move a finished file at path into the cache and record it for url"""
+    digest = sha256sum(path)
+    os.makedirs(objects_dir(), exist_ok=True)
+    destination = object_path(digest)
+    st = os.stat(path)
+    os.chmod(path, st.st_mode | stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH)
+    # prune never sees the object without its entry
+    with locked('index'):
+        os.replace(path, destination)
+        index = load_index()
+        index[url] = {'sha256': digest,
+                      'size': os.path.getsize(destination),
+                      'used': time.time()}
+        if source_sha256 is not None:
+            index[url]['source_sha256'] = source_sha256
+        evict(index, MAX_SIZE)
+        save_index(index)
+    return destination
+
+
+def fetch(url, producer, source_sha256=None):
+    """Return the cached object for url. On a miss producer(url, path)
+    is called to create the file at path, which is then stored.
+    source_sha256 is the verified digest of the download, if known"""
+    cached = lookup(url, source_sha256)
+    if cached is not None:
+        logger.debug('Cache hit for ' + url)
+        return cached
+    key = hashlib.sha256(url.encode()).hexdigest()
+    # One process downloads a URL, the others wait and find it cached
+    with locked('fetch-' + key):
+        cached = lookup(url, source_sha256)
+        if cached is not None:
+            logger.debug('Cache hit for ' + url + ' after waiting')
+            return cached
+        os.makedirs(objects_dir(), exist_ok=True)
+        # The name is the same for every run, so the partial download
+        # of an interrupted run is resumed. prune removes stale ones
+        tmp = os.path.join(objects_dir(), 'tmp-' + key)
+        try:
+            producer(url, tmp)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return store(url, tmp, source_sha256)
+
+
+def discard(url):
+    """Forget the entry for url and remove its object unless shared"""
+    with locked('index'):
+        index = load_index()
+        entry = index.pop(url, None)
+        save_index(index)
+        if entry is None:
+            return
+        if all(e['sha256'] != entry['sha256'] for e in index.values()):
+            if os.path.exists(object_path(entry['sha256'])):
+                os.remove(object_path(entry['sha256']))
+
+
+def link(source, destination):
+    """Hardlink a cached object into place, copying across filesystems"""
+    tmp = destination + '.link'
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copy2(source, tmp)
+    os.replace(tmp, destination)
+
+
+def evict(index, max_size):
+    """Drop least recently used entries until the cache fits max_size"""
+    removed = []
+    entries = sorted(index.items(), key=lambda item: item[1]['used'])
+    # Objects can be shared by several URLs, count each of them once
+    total = sum(dict((e['sha256'], e['size']) for _, e in entries).values())
+    for url, entry in entries:
+        if total <= max_size:
+            break
+        del index[url]
+        removed.append(url)
+        if all(e['sha256'] != entry['sha256'] for e in index.values()):
+            total -= entry['size']
+            if os.path.exists(object_path(entry['sha256'])):
+                os.remove(object_path(entry['sha256']))
+    return removed
+
+
+def prune(max_size=MAX_SIZE):
+    """Evict down to max_size and remove objects no entry points at"""
+    # Objects are moved into place and indexed under the same lock, so
+    # an object without an entry here really is unreferenced
+    with locked('index'):
+        index = load_index()
+        removed = evict(index, max_size)
+        save_index(index)
+        referenced = set(entry['sha256'] for entry in index.values())
+        names = os.listdir(objects_dir()) \
+            if os.path.isdir(objects_dir()) else []
+        for name in names:
+            path = os.path.join(objects_dir(), name)
+            try:
+                # Leave in-flight and recent partial downloads alone
+                if name.startswith('tmp-') and \
+                        time.time() - os.path.getmtime(path) < STALE_TMP:
+                    continue
+                if name not in referenced:
+                    os.remove(path)
+            except FileNotFoundError:
+                # A download finished and was removed meanwhile
+                pass
+    return removed
+
+
+def verify():
+    """Re-hash every cached object, dropping the ones that do not match.
+    Returns the list of URLs whose objects were corrupt or missing"""
+    with locked('index'):
+        index = load_index()
+        corrupt = []
+        for url, entry in list(index.items()):
+            path = object_path(entry['sha256'])
+            if not os.path.exists(path) or sha256sum(path) != entry['sha256']: # noqa
+                corrupt.append(url)
+                del index[url]
+                if os.path.exists(path):
+                    os.remove(path)
+        save_index(index)
+    return corrupt
@@ -0,0 +1,126 @@
+from src.enabler_keitaro_inc.enabler import logger
+from src.enabler_keitaro_inc.helpers import cache
+
+import base64
+import hashlib
+import mmap
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Objects created from directories carry the hash of their content, so
+# unchanged objects are recognised without fetching their data
+HASH_ANNOTATION = 'enabler.keitaro.com/content-sha256'
+MANAGED_LABEL = 'app.kubernetes.io/managed-by'
+MANAGED_BY = 'enabler'
+
+KEY_RE = re.compile(r'^[-._a-zA-Z0-9]+$')
+INVALID_NAME_RE = re.compile(r'[^a-z0-9-]+')
+
+
+class Bundle(object):
+    """The files of one directory, which become one configmap or secret"""
+    __slots__ = ('name', 'files', 'digest')
+
+    def __init__(self, name, files):
+        self.name = name
+        # File name in the object mapped to its path
+        self.files = files
+        self.digest = None
+
+
+def object_name(name):
+    """Turn a path into a valid object name, app/nginx.d becomes
+    app-nginx-d"""
+    name = INVALID_NAME_RE.sub('-', name.lower()).strip('-')
+    return name[:253].rstrip('-')
+
+
+def collect(root, name=None):
+    """Walk root and return a bundle for every directory holding files.
+    The files directly in root are named after name, or root itself,
+    the ones in sub directories after their path below root. Files whose
+    names can not be keys of the object are left out with a warning"""
+    root = os.path.abspath(root)
+    base = object_name(name or os.path.basename(root))
+    bundles = []
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        files = {f: os.path.join(directory, f) for f in sorted(files)
+                 if not f.startswith('.') and
+                 os.path.isfile(os.path.join(directory, f))}
+        for invalid in [f for f in files if not KEY_RE.match(f)]:
+            logger.warning('Skipping ' + files.pop(invalid) + ', only '
+                           'letters, digits, -, _ and . are allowed in '
+                           'file names')
+        if not files:
+            continue
+        relative = os.path.relpath(directory, root)
+        bundle_name = base if relative == '.' else \
+            object_name(base + '-' + relative)
+        bundles.append(Bundle(bundle_name, files))
+    return bundles
+
+
+def content_hash(bundle):
+    """Hash the names and contents of the files of a bundle. Files are
+    hashed through a memory map and never read into memory"""
+    digest = hashlib.sha256()
+    for key in sorted(bundle.files):
+        digest.update(key.encode('utf-8') + b'\0' +
+                      cache.sha256sum(bundle.files[key]).encode('ascii') +
+                      b'\n')
+    return digest.hexdigest()
+
+
+def hash_bundles(bundles, workers=None):
+    """Set the digest of every bundle, hashing them in parallel"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for bundle, digest in zip(bundles,
+                                  executor.map(content_hash, bundles)):
+            bundle.digest = digest
+
+
+def read_encoded(path):
+    """Return the base64 encoding of a file, encoded straight from a
+    memory map of it"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return base64.b64encode(m).decode('ascii')
+
+
+def read_text(path):
+    """Return the content of a file as text or None if it is not UTF-8"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            try:
+                return str(m, 'utf-8')
+            except UnicodeDecodeError:
+                return None
+
+
+def manifest(bundle, kind, namespace):
+    """Build the ConfigMap or Secret of a hashed bundle"""
+    obj = {'apiVersion': 'v1',
+           'kind': kind,
+           'metadata': {'name': bundle.name,
+                        'namespace': namespace,
+                        'labels': {MANAGED_LABEL: MANAGED_BY},
+                        'annotations': {HASH_ANNOTATION: bundle.digest}}}
+    if kind == 'Secret':
+        obj['type'] = 'Opaque'
+        obj['data'] = {key: read_encoded(path)
+                       for key, path in bundle.files.items()}
+        return obj
+    for key, path in bundle.files.items():
+        text = read_text(path)
+        if text is None:
+            obj.setdefault('binaryData', {})[key] = read_encoded(path)
+        else:
+            obj.setdefault('data', {})[key] = text
+    return obj
@@ -0,0 +1,290 @@
+from src.enabler_keitaro_inc.enabler import logger
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Labels kind puts on the node containers of a cluster
+CLUSTER_LABEL = 'io.x-k8s.kind.cluster'
+ROLE_LABEL = 'io.x-k8s.kind.role'
+
+CONTROL_PLANE = 'control-plane'
+WORKER = 'worker'
+LOAD_BALANCER = 'external-load-balancer'
+
+_lock = threading.Lock()
+_client = None
+_clusters = None
+# Clusters changed since they were listed, listed again on next use
+_stale = set()
+
+
+def client():
+    """Return the Docker client shared by every step of the command.
+    The docker SDK is only imported the first time a client is needed"""
+    global _client
+    with _lock:
+        if _client is None:
+            import docker
+            logger.debug('Connecting to the docker daemon')
+            _client = docker.from_env()
+    return _client
+
+
+class Node(object):
+    """A node container of a kind cluster"""
+    __slots__ = ('id', 'name', 'role', 'state', 'ports')
+
+    def __init__(self, id, name, role, state, ports):
+        self.id = id
+        self.name = name
+        self.role = role
+        self.state = state
+        # Published ports, e.g. {'6443/tcp': '38765'}
+        self.ports = ports
+
+    @classmethod
+    def from_summary(cls, summary):
+        """Build a node from an entry of the docker container list"""
+        labels = summary.get('Labels') or {}
+        ports = {}
+        for port in summary.get('Ports') or []:
+            if port.get('PublicPort'):
+                key = '{}/{}'.format(port['PrivatePort'], port['Type'])
+                ports[key] = str(port['PublicPort'])
+        return cls(summary['Id'], summary['Names'][0].lstrip('/'),
+                   labels.get(ROLE_LABEL), summary['State'], ports)
+
+    @property
+    def running(self):
+        return self.state == 'running'
+
+    def __repr__(self):
+        return '<Node {} {} {}>'.format(self.name, self.role, self.state)
+
+
+class ClusterInfo(object):
+    """A kind cluster as found from the labels of its node containers"""
+    __slots__ = ('name', 'nodes')
+
+    def __init__(self, name, nodes):
+        self.name = name
+        self.nodes = nodes
+
+    @property
+    def api_node(self):
+        return api_server_node(self.nodes)
+
+    @property
+    def api_port(self):
+        """Host port of the API server, only published while it runs"""
+        node = self.api_node
+        return node.ports.get('6443/tcp') if node is not None else None
+
+    @property
+    def running(self):
+        return bool(self.nodes) and all(node.running for node in self.nodes)
+
+    @property
+    def stopped(self):
+        return [node for node in self.nodes if not node.running]
+
+    def __repr__(self):
+        return '<ClusterInfo {} {} nodes>'.format(self.name, len(self.nodes))
+
+
+def _list(cluster=None):
+    """List the node containers of every kind cluster, or of cluster,
+    in a single request filtered by label on the daemon"""
+    label = CLUSTER_LABEL if cluster is None else CLUSTER_LABEL + '=' + cluster
+    summaries = client().api.containers(all=True, filters={'label': label})
+    nodes = {}
+    for summary in summaries:
+        name = (summary.get('Labels') or {}).get(CLUSTER_LABEL)
+        nodes.setdefault(name, []).append(Node.from_summary(summary))
+    return dict((name, ClusterInfo(name, sorted(
+        members, key=lambda node: node.name)))
+        for name, members in nodes.items())
+
+
+def clusters(refresh=False):
+    """Return every kind cluster keyed by name. All node containers are
+    listed in a single request, which is what `kind get clusters` does,
+    and the result is reused for the rest of the process unless refresh
+    is set or a cluster was invalidated"""
+    global _clusters
+    with _lock:
+        found = _clusters
+        stale = set(_stale)
+    if found is None or refresh or stale:
+        found = _list()
+        with _lock:
+            _clusters = found
+            _stale.difference_update(stale)
+    return found
+
+
+def cluster_info(cluster, refresh=False):
+    """Return the ClusterInfo of a kind cluster or None if it does not
+    exist. An invalidated cluster is listed again on its own, the others
+    stay as they were found"""
+    global _clusters
+    with _lock:
+        found = _clusters
+        stale = cluster in _stale
+    if found is None:
+        return clusters().get(cluster)
+    if not (refresh or stale):
+        return found.get(cluster)
+    info = _list(cluster).get(cluster)
+    with _lock:
+        # Callers may hold the previous dict, it is replaced, not changed
+        _clusters = dict(_clusters or {})
+        if info is None:
+            _clusters.pop(cluster, None)
+        else:
+            _clusters[cluster] = info
+        _stale.discard(cluster)
+    return info
+
+
+def inventory(cluster, refresh=False):
+    """Return the nodes of a kind cluster"""
+    info = cluster_info(cluster, refresh)
+    return info.nodes if info is not None else []
+
+
+# Seconds docker waits for a node to exit before killing it
+STOP_GRACE = 10
+FAST_STOP_GRACE = 1
+
+
+def _timed(action, nodes):
+    """Run action on every node concurrently and return a list of
+    (node, seconds) pairs in the order of nodes"""
+    def run(node):
+        start = time.monotonic()
+        action(node)
+        return node, time.monotonic() - start
+    if not nodes:
+        return []
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        return list(executor.map(run, nodes))
+
+
+def start_nodes(nodes):
+    """Start the nodes concurrently"""
+    api = client().api
+    timings = _timed(lambda node: api.start(node.id), nodes)
+    for node, seconds in timings:
+        logger.debug('Container {} started in {:.2f}s'.format(
+            node.name, seconds))
+    return timings
+
+
+def stop_nodes(nodes, grace=STOP_GRACE):
+    """Stop the nodes, workers first and then the control plane and load
+    balancer they talk to. Each group stops concurrently and docker kills
+    a node still running after grace seconds. Returns (node, seconds)
+    pairs"""
+    api = client().api
+    workers = [node for node in nodes if node.role == WORKER]
+    others = [node for node in nodes if node.role != WORKER]
+    timings = []
+    for group in (workers, others):
+        timings += _timed(lambda node: api.stop(node.id, timeout=grace),
+                          group)
+    return timings
+
+
+def remove_nodes(nodes):
+    """Remove the nodes and their anonymous volumes concurrently, running
+    or not"""
+    api = client().api
+    return _timed(lambda node: api.remove_container(node.id, v=True,
+                                                    force=True), nodes)
+
+
+class NodeWatcher(object):
+    """Follow the docker events of the nodes of a cluster in the
+    background and remember the nodes that died"""
+
+    def __init__(self, cluster):
+        self.died = []
+        self._stream = client().api.events(
+            decode=True,
+            filters={'type': 'container',
+                     'label': CLUSTER_LABEL + '=' + cluster,
+                     'event': ['die', 'oom']})
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def _watch(self):
+        try:
+            for event in self._stream:
+                attributes = event.get('Actor', {}).get('Attributes', {})
+                logger.debug('Container ' + str(attributes.get('name')) +
+                             ': ' + str(event.get('status')))
+                self.died.append(attributes.get('name'))
+        except Exception as error:
+            # The stream raises once it is closed
+            logger.debug('Stopped watching docker events: ' + str(error))
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def invalidate(cluster=None):
+    """Forget what was found of cluster, or of every cluster, so it is
+    listed again on next use"""
+    global _clusters
+    with _lock:
+        if cluster is None:
+            _clusters = None
+            _stale.clear()
+        else:
+            _stale.add(cluster)
+
+
+def api_server_node(nodes):
+    """Return the node publishing the API server of the cluster, the
+    load balancer of HA clusters or else the control plane"""
+    for role in (LOAD_BALANCER, CONTROL_PLANE):
+        for node in nodes:
+            if node.role == role:
+                return node
+    return None
+
+
+def network(name):
+    """Return the docker network called name or None"""
+    networks = client().api.networks(names=[name])
+    # The name filter also matches on substrings
+    for net in networks:
+        if net['Name'] == name:
+            return net
+    return None
+
+
+def network_addresses(net):
+    """Return (name, address) pairs of everything holding an address on
+    a docker network, its containers and gateways"""
+    import ipaddress
+    details = client().api.inspect_network(net['Id'])
+    used = []
+    for config in (details.get('IPAM') or {}).get('Config') or []:
+        if config.get('Gateway'):
+            used.append(('gateway', ipaddress.ip_address(config['Gateway'])))
+    for container in (details.get('Containers') or {}).values():
+        for key in ('IPv4Address', 'IPv6Address'):
+            if container.get(key):
+                used.append((container.get('Name'), ipaddress.ip_interface(
+                    container[key]).ip))
+    return used
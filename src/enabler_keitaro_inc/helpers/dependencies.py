@@ -0,0 +1,97 @@
+from src.enabler_keitaro_inc.helpers import cache, download
+
+import json
+import os
+import urllib.error
+import urllib.request
+
+
+CHECKSUMS_FILE = '.checksums.json'
+
+
+class Dependency(object):
+    """A binary described by an entry of dependencies.yaml"""
+
+    def __init__(self, name, spec, ostype):
+        # Older manifests only hold a URL template formatted with the OS
+        if isinstance(spec, str):
+            spec = {'url': spec.replace('{}', '{os}')}
+        self.name = name
+        self.version = spec.get('version')
+        self.ostype = ostype
+        self.url = spec['url'].format(version=self.version, os=ostype)
+        self.checksum_url = None
+        if spec.get('checksum_url'):
+            self.checksum_url = spec['checksum_url'].format(
+                version=self.version, os=ostype)
+        self.pinned_sha256 = (spec.get('sha256') or {}).get(ostype)
+        self.member = spec.get('member')
+        self.github = spec.get('github')
+
+    def expected_sha256(self):
+        """Return the digest the download must match, fetching the upstream
+        checksum file when none is pinned in the manifest. Raises
+        DownloadError when there is no digest to verify against"""
+        if self.pinned_sha256:
+            return self.pinned_sha256
+        if self.checksum_url is None:
+            raise download.DownloadError('No sha256 or checksum_url for ' +
+                                         self.name + ' in the manifest')
+        try:
+            with urllib.request.urlopen(self.checksum_url, timeout=30) as r:
+                # Checksum files hold the digest optionally followed by
+                # the file name
+                return r.read().decode('utf-8').split()[0].lower()
+        except (urllib.error.URLError, OSError, IndexError) as error:
+            raise download.DownloadError('Could not fetch the checksum of ' +
+                                         self.name + ' from ' +
+                                         self.checksum_url + ': ' +
+                                         str(error))
+
+
+def load(file_path, ostype):
+    """Load dependencies.yaml and return its dependencies for ostype"""
+    import yaml
+    with open(file_path, 'r') as f:
+        manifest = yaml.safe_load(f)
+    return [Dependency(name, spec, ostype) for name, spec in manifest.items()]
+
+
+def checksums_path(bin_dir):
+    return os.path.join(bin_dir, CHECKSUMS_FILE)
+
+
+def load_checksums(bin_dir):
+    """Return the digests recorded for the binaries installed in bin_dir"""
+    try:
+        with open(checksums_path(bin_dir), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_checksums(bin_dir, digests):
+    """Record verified digests of installed binaries in bin_dir"""
+    checksums = load_checksums(bin_dir)
+    checksums.update(digests)
+    tmp = checksums_path(bin_dir) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checksums, f, indent=2, sort_keys=True)
+    os.replace(tmp, checksums_path(bin_dir))
+
+
+def verify_installed(bin_dir, names):
+    """Return the names whose binary in bin_dir is missing or no longer
+    matches its recorded digest. Binaries are hashed in parallel"""
+    checksums = load_checksums(bin_dir)
+
+    def check(name):
+        path = os.path.join(bin_dir, name)
+        if name not in checksums:
+            raise ValueError('no recorded checksum')
+        if not os.path.exists(path):
+            raise ValueError('binary missing')
+        if cache.sha256sum(path) != checksums[name]:
+            raise ValueError('checksum mismatch')
+
+    return download.run_parallel([(name, check, (name,)) for name in names])
@@ -0,0 +1,200 @@
+from src.enabler_keitaro_inc.enabler import logger
+
+import hashlib
+import os
+import shutil
+import tarfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+CHUNK_SIZE = 64 * 1024
+RETRIES = 5
+BACKOFF = 0.5
+TIMEOUT = 60
+
+
+def partial_path(destination):
+    """Return the file a download to destination is written to until it
+    is complete. The name is the same for every run so an interrupted
+    download is resumed, callers hold a lock on destination such as the
+    fetch lock of the cache"""
+    return destination + '.part'
+
+
+def retryable(error):
+    """Tell whether a failed download is worth another attempt. Client
+    errors other than 429 and 416, after which the download starts over,
+    will not go away by asking again"""
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code >= 500 or error.code in (416, 429)
+    return True
+
+
+def fetch(url, destination, sha256=None, retries=RETRIES):
+    """Download url to destination, resuming and retrying when needed.
+    The body is streamed to partial_path(destination) which is atomically
+    renamed once the transfer is complete, or kept for the next run when
+    it could not be completed. If sha256 is given the file is hashed
+    while it is written and discarded on a mismatch"""
+    partial = partial_path(destination)
+    for attempt in range(1, retries + 1):
+        try:
+            digest = stream_to_file(url, partial)
+            if sha256 is not None and digest != sha256:
+                os.remove(partial)
+                raise ChecksumError('Checksum mismatch for ' + url +
+                                    ': expected ' + sha256 + ', got ' +
+                                    digest)
+            os.replace(partial, destination)
+            return destination
+        except (urllib.error.URLError, OSError) as error:
+            if attempt == retries or not retryable(error):
+                if not retryable(error) and os.path.exists(partial):
+                    os.remove(partial)
+                raise
+            delay = BACKOFF * 2 ** (attempt - 1)
+            logger.debug('Download of ' + url + ' failed (' + str(error) +
+                         '), retrying in ' + str(delay) + 's')
+            time.sleep(delay)
+
+
+def stream_to_file(url, partial):
+    """Stream url into partial in chunks, continuing from its current size
+    with an HTTP Range request if it already exists. Returns the sha256
+    of the complete file"""
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    request = urllib.request.Request(url)
+    if offset:
+        request.add_header('Range', 'bytes={}-'.format(offset))
+    try:
+        response = urllib.request.urlopen(request, timeout=TIMEOUT)
+    except urllib.error.HTTPError as error:
+        if error.code == 416:
+            # The partial file is unusable, start over on the next attempt
+            os.remove(partial)
+        raise
+    digest = hashlib.sha256()
+    length = response.headers.get('Content-Length')
+    received = 0
+    with response:
+        # Servers that ignore Range send the whole body with a 200
+        mode = 'ab' if offset and response.status == 206 else 'wb'
+        if mode == 'ab':
+            logger.debug('Resuming ' + url + ' at byte ' + str(offset))
+            # The digest has to cover what was downloaded before
+            with open(partial, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+        with open(partial, mode) as f:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                received += len(chunk)
+    # A connection closed early ends the body without an error, what
+    # arrived is kept and resumed on the next attempt
+    if length is not None and received != int(length):
+        raise urllib.error.ContentTooShortError(
+            'Got {} of {} bytes of {}'.format(received, length, url), None)
+    return digest.hexdigest()
+
+
+class DownloadError(Exception):
+    """Raised when a download does not contain what was expected"""
+    pass
+
+
+class ChecksumError(DownloadError):
+    pass
+
+
+class HashingReader(object):
+    """File-like wrapper that hashes everything read through it"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.digest.update(data)
+        return data
+
+    def drain(self):
+        """Read the rest of the stream and return its hex digest"""
+        while self.read(CHUNK_SIZE):
+            pass
+        return self.digest.hexdigest()
+
+
+def extract(url, destination, member_name, sha256=None, retries=RETRIES):
+    """Extract member_name from the tarball at url to destination,
+    decompressing the response as it arrives instead of writing the
+    archive to disk. If sha256 is given the archive is verified on the
+    fly and nothing is written to destination on a mismatch"""
+    for attempt in range(1, retries + 1):
+        try:
+            stream_extract(url, destination, member_name, sha256)
+            return destination
+        except (urllib.error.URLError, OSError, EOFError,
+                tarfile.TarError) as error:
+            if attempt == retries or not retryable(error):
+                if os.path.exists(partial_path(destination)):
+                    os.remove(partial_path(destination))
+                raise
+            delay = BACKOFF * 2 ** (attempt - 1)
+            logger.debug('Extracting ' + member_name + ' from ' + url +
+                         ' failed (' + str(error) + '), retrying in ' +
+                         str(delay) + 's')
+            time.sleep(delay)
+
+
+def stream_extract(url, destination, member_name, sha256=None):
+    partial = partial_path(destination)
+    with urllib.request.urlopen(url, timeout=TIMEOUT) as response:
+        reader = HashingReader(response)
+        found = False
+        # Stream mode reads members sequentially, the member list of
+        # the archive is never built up in memory
+        with tarfile.open(fileobj=reader, mode='r|gz') as tar:
+            for member in tar:
+                if member.isreg() and os.path.basename(member.name) == member_name: # noqa
+                    with open(partial, 'wb') as target:
+                        shutil.copyfileobj(tar.extractfile(member), target,
+                                           CHUNK_SIZE)
+                    os.chmod(partial, member.mode & 0o777)
+                    found = True
+                    break
+        if not found:
+            raise DownloadError(member_name + ' not found in ' + url)
+        if sha256 is not None:
+            digest = reader.drain()
+            if digest != sha256:
+                os.remove(partial)
+                raise ChecksumError('Checksum mismatch for ' + url +
+                                    ': expected ' + sha256 + ', got ' +
+                                    digest)
+    os.replace(partial, destination)
+
+
+def run_parallel(jobs, max_workers=None):
+    """Run (name, function, args) jobs in a thread pool and return
+    a dict of name to the raised exception for every failed job"""
+    failed = {}
+    if not jobs:
+        return failed
+    with ThreadPoolExecutor(max_workers=max_workers or len(jobs)) as executor:
+        futures = {executor.submit(function, *args): name
+                   for name, function, args in jobs}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                future.result()
+            except Exception as error:
+                failed[name] = error
+    return failed
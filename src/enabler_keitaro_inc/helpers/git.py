@@ -1,11 +1,11 @@
 from src.enabler_keitaro_inc.enabler import logger
 import click
-import git
 import os
 
 
 def get_repo(repopath):
     """Function to get the repository."""
+    import git
     if not os.path.exists(repopath):
         logger.critical('The repo path ' + repopath + ' does not exist')
         raise click.Abort()
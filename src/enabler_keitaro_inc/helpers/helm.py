@@ -0,0 +1,66 @@
+from src.enabler_keitaro_inc.enabler import logger
+
+import json
+import subprocess as s
+
+
+class HelmError(Exception):
+    """A helm command failed, the message is what helm printed"""
+
+
+def run(args):
+    """Run helm with args and return its standard output"""
+    logger.debug('Running: `helm ' + ' '.join(args) + '`')
+    try:
+        result = s.run(['helm'] + args, capture_output=True, check=True)
+    except s.CalledProcessError as error:
+        raise HelmError(error.stderr.decode('utf-8').strip() or
+                        error.stdout.decode('utf-8').strip())
+    except FileNotFoundError:
+        raise HelmError('helm not found in PATH.')
+    return result.stdout.decode('utf-8')
+
+
+def release(name, namespace, cluster):
+    """Return the helm list entry of a release, such as {'name': 'metallb',
+    'status': 'deployed', 'chart': 'metallb-4.6.0', ...}, or None"""
+    releases = json.loads(run(['list', '-n', namespace, '--all',
+                               '--filter', '^' + name + '$',
+                               '--kube-context', 'kind-' + cluster,
+                               '-o', 'json']) or '[]')
+    for entry in releases:
+        if entry.get('name') == name:
+            return entry
+    return None
+
+
+def chart_version(entry, chart):
+    """Return the version of chart a release entry was installed from"""
+    if entry and entry.get('chart', '').startswith(chart + '-'):
+        return entry['chart'][len(chart) + 1:]
+    return None
+
+
+def ensure_repo(name, url):
+    """Add the repo unless it is known and refresh the repo indexes.
+    `helm repo update NAME` needs helm 3.7, the pinned helm updates all"""
+    try:
+        repos = json.loads(run(['repo', 'list', '-o', 'json']) or '[]')
+    except HelmError:
+        # helm fails instead of printing [] when no repo is configured
+        repos = []
+    if not any(repo.get('name') == name for repo in repos):
+        logger.debug(run(['repo', 'add', name, url]))
+    logger.debug(run(['repo', 'update']))
+
+
+def upgrade_install(name, chart, version, namespace, cluster, wait=True):
+    """Install the release or upgrade it to version of chart. The
+    namespace has to exist, --create-namespace needs helm 3.2"""
+    args = ['upgrade', '--install', name, chart,
+            '--version', version,
+            '-n', namespace,
+            '--kube-context', 'kind-' + cluster]
+    if wait:
+        args.append('--wait')
+    return run(args)
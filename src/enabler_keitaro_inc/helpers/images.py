@@ -0,0 +1,126 @@
+from src.enabler_keitaro_inc.enabler import logger
+from src.enabler_keitaro_inc.helpers import containers
+
+import json
+import queue
+import subprocess as s
+from concurrent.futures import ThreadPoolExecutor
+
+
+CHUNK_SIZE = 1024 * 1024
+# Chunks buffered for every node, a slow node only holds up the others
+# once it is this far behind
+QUEUE_SIZE = 64
+
+# What `kind load docker-image` runs on every node
+IMPORT = ['ctr', '--namespace=k8s.io', 'images', 'import', '--all-platforms',
+          '--digests', '--snapshotter=overlayfs', '-']
+
+
+class ImageError(Exception):
+    """An image is not available in docker"""
+
+
+def image_id(image):
+    """Return the ID of an image in docker, sha256:..."""
+    import docker
+    try:
+        return containers.client().api.inspect_image(image)['Id']
+    except docker.errors.ImageNotFound:
+        raise ImageError('Image ' + image + ' not found, pull or build it '
+                         'first')
+
+
+def node_image_id(node, image):
+    """Return the ID of an image in containerd of a node, or None"""
+    api = containers.client().api
+    run = api.exec_create(node.id, ['crictl', 'inspecti', '--output', 'json',
+                                    image])
+    output = api.exec_start(run['Id'])
+    try:
+        return json.loads(output.decode('utf-8'))['status']['id']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def missing(nodes, ids):
+    """Return, for every node, the images of ids, a dict of image to its
+    ID in docker, that the node does not have. All nodes and images are
+    checked at the same time"""
+    pairs = [(node, image) for node in nodes for image in sorted(ids)]
+    if not pairs:
+        return dict((node, []) for node in nodes)
+    with ThreadPoolExecutor(max_workers=min(len(pairs), 16)) as executor:
+        found = list(executor.map(
+            lambda pair: node_image_id(*pair), pairs))
+    result = dict((node, []) for node in nodes)
+    for (node, image), present in zip(pairs, found):
+        if present != ids[image]:
+            result[node].append(image)
+    return result
+
+
+def _feed(process, chunks):
+    """Write the chunks taken from the queue to the stdin of process
+    until None arrives. Returns an error message or None. The queue is
+    drained even when the process stopped reading, so the reader never
+    waits for a node that failed"""
+    error = None
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            break
+        if error is None:
+            try:
+                process.stdin.write(chunk)
+            except BrokenPipeError:
+                error = 'import stopped reading'
+    try:
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    return error
+
+
+def stream(images, nodes):
+    """Export images with a single `docker save` and import the archive
+    on every node at once, while it is being written. Every node is fed
+    by its own thread. Returns a dict of node name to the error of every
+    node that failed"""
+    save = s.Popen(['docker', 'save'] + list(images),
+                   stdout=s.PIPE, stderr=s.PIPE)
+    imports = dict((node.name, s.Popen(
+        ['docker', 'exec', '--privileged', '-i', node.name] + IMPORT,
+        stdin=s.PIPE, stdout=s.DEVNULL, stderr=s.PIPE)) for node in nodes)
+    queues = dict((name, queue.Queue(maxsize=QUEUE_SIZE))
+                  for name in imports)
+    with ThreadPoolExecutor(max_workers=len(imports) or 1) as executor:
+        writers = dict((name, executor.submit(_feed, process, queues[name]))
+                       for name, process in imports.items())
+        try:
+            while True:
+                chunk = save.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                for chunks in queues.values():
+                    chunks.put(chunk)
+            save_error = save.stderr.read().decode('utf-8').strip()
+            saved = save.wait() == 0
+            if not saved:
+                for process in imports.values():
+                    process.kill()
+        finally:
+            for chunks in queues.values():
+                chunks.put(None)
+        failed = dict((name, writer.result())
+                      for name, writer in writers.items() if writer.result())
+    if not saved:
+        return dict((name, 'docker save failed: ' + save_error)
+                    for name in imports)
+    for name, process in imports.items():
+        error = process.stderr.read().decode('utf-8').strip()
+        if process.wait() != 0:
+            failed[name] = error or failed.get(name) or 'import failed'
+        elif name not in failed:
+            logger.debug('Images imported on ' + name)
+    return failed
@@ -0,0 +1,87 @@
+from src.enabler_keitaro_inc.enabler import logger
+from src.enabler_keitaro_inc.helpers import cache, versions
+
+import hashlib
+import json
+import os
+import subprocess as s
+
+
+NAMESPACE = 'istio-system'
+# Hash of the manifest last applied, kept on the istio-system namespace
+HASH_ANNOTATION = 'enabler.keitaro.com/istio-manifest-sha256'
+
+DEFAULT_FLAGS = ['profile=default']
+MONITORING_FLAGS = [
+    'addonComponents.grafana.enabled=true',
+    'addonComponents.kiali.enabled=true',
+    'addonComponents.prometheus.enabled=true',
+    'addonComponents.tracing.enabled=true',
+    'values.kiali.dashboard.jaegerURL=http://jaeger-query:16686',
+    'values.kiali.dashboard.grafanaURL=http://grafana:3000',
+]
+
+
+class IstioError(Exception):
+    """An istioctl command failed, the message is what it printed"""
+
+
+def manifests_dir():
+    return os.path.join(cache.cache_dir(), 'istio')
+
+
+def manifest_path(version, flags):
+    """Return where the manifest istioctl version renders for the --set
+    flags is cached"""
+    key = hashlib.sha256(json.dumps([version, sorted(flags)]).encode(
+        'utf-8')).hexdigest()
+    return os.path.join(manifests_dir(), key + '.yaml')
+
+
+def client_version():
+    """Return the version of istioctl found in PATH"""
+    version = versions.probe('istioctl', 'istioctl')
+    if version is None:
+        raise IstioError('Could not determine the version of istioctl')
+    return version
+
+
+def render(flags):
+    """Return the manifest for the --set flags and whether it came from
+    the cache. istioctl only renders it when the pair of its version and
+    the flags was not rendered before"""
+    path = manifest_path(client_version(), flags)
+    try:
+        with open(path, 'r') as f:
+            return f.read(), True
+    except FileNotFoundError:
+        pass
+    command = ['istioctl', 'manifest', 'generate']
+    for flag in flags:
+        command += ['--set', flag]
+    logger.debug('Running: `' + ' '.join(command) + '`')
+    try:
+        result = s.run(command, capture_output=True, check=True)
+    except s.CalledProcessError as error:
+        raise IstioError(error.stderr.decode('utf-8'))
+    manifest = result.stdout.decode('utf-8')
+    os.makedirs(manifests_dir(), exist_ok=True)
+    tmp = path + '.{}.tmp'.format(os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(manifest)
+    os.replace(tmp, path)
+    return manifest, False
+
+
+def manifest_hash(manifest):
+    return hashlib.sha256(manifest.encode('utf-8')).hexdigest()
+
+
+def verify_install(cluster):
+    """Run the istioctl pre-check against the cluster"""
+    try:
+        result = s.run(['istioctl', 'verify-install', '--context',
+                        'kind-' + cluster], capture_output=True, check=True)
+    except s.CalledProcessError as error:
+        raise IstioError(error.stderr.decode('utf-8'))
+    return result.stderr.decode('utf-8')
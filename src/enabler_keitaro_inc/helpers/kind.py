@@ -1,20 +1,41 @@
 from src.enabler_keitaro_inc.enabler import logger
+from src.enabler_keitaro_inc.helpers import containers
 
 import click
-import subprocess as s
+import fnmatch
 
 
-def kind_get(cluster):
-    # Get kind clusters
+def clusters(refresh=False):
+    """Return every kind cluster as a dict of name to ClusterInfo. They
+    are found from the labels of their node containers, listed once per
+    process, instead of running `kind get clusters`"""
     try:
-        logger.debug('Running: `kind get clusters`')
-        result = s.run(['kind', 'get', 'clusters'],
-                       capture_output=True, check=True)
-        kind_clusters = result.stdout.decode('utf-8').splitlines()
-        if cluster in kind_clusters:
-            return True
-        else:
-            return False
-    except s.CalledProcessError as error:
-        logger.critical(error.stderr.decode('utf-8'))
+        return containers.clusters(refresh)
+    except Exception as error:
+        # Any error of the docker SDK or of the connection to the daemon
+        logger.critical('Could not list kind clusters: ' + str(error))
         raise click.Abort()
+
+
+def cluster(name, refresh=False):
+    """Return the ClusterInfo of a kind cluster, or None if it does not
+    exist"""
+    try:
+        return containers.cluster_info(name, refresh)
+    except Exception as error:
+        logger.critical('Could not list kind clusters: ' + str(error))
+        raise click.Abort()
+
+
+def select(patterns):
+    """Return the names of the clusters matching any of the names or
+    glob patterns, in the order given. Names without wildcards are kept
+    even when no such cluster exists, so they can be reported missing"""
+    found = sorted(clusters())
+    names = []
+    for pattern in patterns:
+        matched = fnmatch.filter(found, pattern)
+        if not matched and not any(c in pattern for c in '*?['):
+            matched = [pattern]
+        names += [name for name in matched if name not in names]
+    return names
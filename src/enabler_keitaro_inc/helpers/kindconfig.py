@@ -0,0 +1,230 @@
+from src.enabler_keitaro_inc.helpers import manifests
+
+import functools
+import ipaddress
+import json
+import os
+import socket
+
+
+# Schemas of the kind config API versions, packaged with the templates
+SCHEMAS = {
+    'kind.x-k8s.io/v1alpha4': 'kind-v1alpha4.schema.json',
+}
+
+TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'integer': int,
+    'boolean': bool,
+}
+
+# Listening sockets of the host, as the kernel lists them
+PROC_NET = {
+    'TCP': ('/proc/net/tcp', '/proc/net/tcp6'),
+    'UDP': ('/proc/net/udp', '/proc/net/udp6'),
+}
+TCP_LISTEN = '0A'
+
+
+def load(path):
+    """Parse a kind config file. Raises ValueError if it is not a YAML
+    mapping"""
+    # Imported here to keep the startup of the CLI fast
+    import yaml
+    with open(path, 'r') as f:
+        try:
+            config = yaml.safe_load(f)
+        except yaml.YAMLError as error:
+            raise ValueError('Invalid YAML: ' + str(error))
+    if not isinstance(config, dict):
+        raise ValueError('Expected a mapping at the top of the file')
+    return config
+
+
+def compile_schema(schema):
+    """Turn a JSON schema, limited to the keywords kind schemas use, into
+    a function check(value, path) returning a list of errors. All the
+    lookups in the schema happen here, once"""
+    checks = []
+    type_name = schema.get('type')
+    expected = TYPES.get(type_name)
+    if 'enum' in schema:
+        allowed = schema['enum']
+
+        def check_enum(value, path):
+            if value not in allowed:
+                return [path + ': expected one of ' + ', '.join(allowed) +
+                        ', got ' + json.dumps(value, default=str)]
+            return []
+        checks.append(check_enum)
+    if 'minimum' in schema or 'maximum' in schema:
+        low = schema.get('minimum', float('-inf'))
+        high = schema.get('maximum', float('inf'))
+
+        def check_range(value, path):
+            if not low <= value <= high:
+                return [path + ': {} is out of range'.format(value)]
+            return []
+        checks.append(check_range)
+    if type_name == 'object':
+        required = schema.get('required', [])
+        properties = dict((name, compile_schema(sub)) for name, sub in
+                          schema.get('properties', {}).items())
+        extra = schema.get('additionalProperties', True)
+        extra = compile_schema(extra) if isinstance(extra, dict) else extra
+
+        def check_object(value, path):
+            errors = [path + '.' + name + ': missing' for name in required
+                      if name not in value]
+            for name, item in value.items():
+                check = properties.get(name, extra)
+                if check is False:
+                    errors.append(path + '.' + str(name) + ': unknown field')
+                elif check is not True:
+                    errors += check(item, path + '.' + str(name))
+            return errors
+        checks.append(check_object)
+    if type_name == 'array' and 'items' in schema:
+        items = compile_schema(schema['items'])
+
+        def check_array(value, path):
+            errors = []
+            for index, item in enumerate(value):
+                errors += items(item, '{}[{}]'.format(path, index))
+            return errors
+        checks.append(check_array)
+
+    def check(value, path):
+        # Nothing else makes sense for a value of the wrong type. bool is
+        # an int, but not a valid integer
+        if expected is not None and (
+                not isinstance(value, expected) or
+                (expected is int and isinstance(value, bool))):
+            return [path + ': expected ' + type_name + ', got ' +
+                    json.dumps(value, default=str)]
+        errors = []
+        for part in checks:
+            errors += part(value, path)
+        return errors
+    return check
+
+
+@functools.lru_cache(maxsize=None)
+def validator(api_version):
+    """Return the compiled schema of a kind config API version, compiled
+    once per process, or None if the version is not known"""
+    if api_version not in SCHEMAS:
+        return None
+    return compile_schema(json.loads(manifests.template(
+        SCHEMAS[api_version])))
+
+
+def validate(config):
+    """Return every error found in a parsed kind config"""
+    api_version = config.get('apiVersion')
+    check = validator(api_version) if isinstance(api_version, str) else None
+    if check is None:
+        return ['apiVersion: expected one of ' + ', '.join(sorted(SCHEMAS)) +
+                ', got ' + json.dumps(api_version, default=str)]
+    return [error.lstrip('.') for error in check(config, '')]
+
+
+def port_mappings(config):
+    """Return (node index, listen address, host port, protocol) for every
+    extraPortMappings entry of the config binding a fixed host port"""
+    mappings = []
+    for index, node in enumerate(config.get('nodes') or []):
+        for mapping in (node or {}).get('extraPortMappings') or []:
+            if mapping.get('hostPort'):
+                mappings.append((index,
+                                 mapping.get('listenAddress') or '0.0.0.0',
+                                 mapping['hostPort'],
+                                 mapping.get('protocol') or 'TCP'))
+    return mappings
+
+
+def _proc_address(text):
+    """Decode an address of /proc/net/tcp, stored as 32 bit words in host
+    byte order, little endian on the hosts kind runs on"""
+    raw = bytes.fromhex(text)
+    raw = b''.join(raw[i:i + 4][::-1] for i in range(0, len(raw), 4))
+    return ipaddress.ip_address(raw)
+
+
+def listening(protocols):
+    """Return (address, port) pairs of the sockets bound on the host for
+    every protocol, each table of /proc/net read once. Returns None where
+    /proc/net is not available"""
+    bound = {}
+    for protocol in protocols:
+        bound[protocol] = []
+        for path in PROC_NET.get(protocol, ()):
+            try:
+                with open(path, 'r') as f:
+                    lines = f.read().splitlines()[1:]
+            except FileNotFoundError:
+                if not os.path.isdir('/proc/net'):
+                    return None
+                # No IPv6 on this host
+                continue
+            for line in lines:
+                fields = line.split()
+                if protocol == 'TCP' and fields[3] != TCP_LISTEN:
+                    continue
+                address, port = fields[1].split(':')
+                bound[protocol].append((_proc_address(address),
+                                        int(port, 16)))
+    return bound
+
+
+def _overlaps(listen, address):
+    """Whether binding listen clashes with a socket bound to address"""
+    if listen.version != address.version:
+        # A dual stack socket on :: also holds the IPv4 port
+        return str(address) == '::' or str(listen) == '::'
+    return listen.is_unspecified or address.is_unspecified or \
+        listen == address
+
+
+def _port_is_free(address, port, protocol):
+    """Try to bind the port, for hosts without /proc/net"""
+    family = socket.AF_INET6 if address.version == 6 else socket.AF_INET
+    kind = socket.SOCK_DGRAM if protocol == 'UDP' else socket.SOCK_STREAM
+    try:
+        with socket.socket(family, kind) as sock:
+            sock.bind((str(address), port))
+    except OSError:
+        return False
+    return True
+
+
+def port_conflicts(mappings):
+    """Return a message for every mapping whose host port is already
+    bound on the host or by another mapping of the config"""
+    conflicts = []
+    bound = listening(set(protocol for _, _, _, protocol in mappings))
+    seen = []
+    for index, listen, port, protocol in mappings:
+        where = 'nodes[{}] {} {}:{}'.format(index, protocol, listen, port)
+        try:
+            address = ipaddress.ip_address(listen)
+        except ValueError:
+            conflicts.append(where + ': invalid listenAddress')
+            continue
+        for other, other_address, other_port, other_protocol in seen:
+            if (other_port, other_protocol) == (port, protocol) and \
+                    _overlaps(address, other_address):
+                conflicts.append(where + ': also mapped by nodes[{}]'.format(
+                    other))
+                break
+        seen.append((index, address, port, protocol))
+        if bound is None:
+            if protocol in PROC_NET and \
+                    not _port_is_free(address, port, protocol):
+                conflicts.append(where + ': port is in use')
+        elif any(port == used_port and _overlaps(address, used)
+                 for used, used_port in bound.get(protocol, ())):
+            conflicts.append(where + ': port is in use')
+    return conflicts
@@ -1,9 +1,50 @@
 from src.enabler_keitaro_inc.enabler import logger
+from src.enabler_keitaro_inc.helpers import kubeapi
+
+import json
+import ssl
 import subprocess as s
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Statuses reported for applied objects, as kubectl apply prints them
+CREATED = 'created'
+CONFIGURED = 'configured'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+
+# Objects applied at the same time
+WORKERS = kubeapi.POOL_SIZE
+
+# Held while the kubeconfig file is rewritten, by us, kubectl or kind, so
+# clusters handled at the same time don't lose each other's changes
+kubeconfig_lock = threading.Lock()
+
+
+def api_client(cluster):
+    """Return the API client of the kind cluster, or None when the
+    kubeconfig needs kubectl, in which case callers fall back to it"""
+    try:
+        return kubeapi.client('kind-' + cluster)
+    except kubeapi.ConfigError as error:
+        logger.debug('Falling back to kubectl: ' + str(error))
+        return None
 
 
 def kubectl_info(cluster):
     # Get kubectl cluster-info
+    api = api_client(cluster)
+    if api is not None:
+        try:
+            logger.debug(api.get('/version'))
+            return True
+        except kubeapi.ApiError as error:
+            logger.debug(str(error))
+            return False
     try:
         logger.debug('Running: `kubectl cluster-info`')
         result = s.run(['kubectl',
@@ -18,9 +59,24 @@ def kubectl_info(cluster):
         return False
 
 
-def kubeconfig_set(cont, cluster):
+def kubeconfig_set(node, cluster):
     # Get mapped control plane port from docker
-    port = cont.attrs['NetworkSettings']['Ports']['6443/tcp'][0]['HostPort']
+    port = node.ports.get('6443/tcp')
+    if port is None:
+        logger.debug('The API server port of ' + node.name + ' is not published') # noqa
+        return False
+    with kubeconfig_lock:
+        return _kubeconfig_set(port, cluster)
+
+
+def _kubeconfig_set(port, cluster):
+    try:
+        path = kubeapi.set_server('kind-' + cluster,
+                                  'https://127.0.0.1:' + port)
+        logger.debug('Updated kind-' + cluster + ' in ' + path)
+        return True
+    except kubeapi.ConfigError as error:
+        logger.debug('Falling back to kubectl: ' + str(error))
     try:
         logger.debug('Running: `kubectl config set-cluster`')
         result = s.run(['kubectl',
@@ -35,3 +91,360 @@ def kubeconfig_set(cont, cluster):
     except s.CalledProcessError as error:
         logger.debug(error.stderr.decode('utf-8'))
         return False
+
+
+def ensure_namespace(cluster, name, labels=None):
+    """Create the namespace unless it exists. Returns True if it was
+    created and raises kubeapi.ApiError when it could not be"""
+    api = api_client(cluster)
+    if api is not None:
+        if api.get_object('v1', 'Namespace', name) is not None:
+            return False
+        namespace = {'apiVersion': 'v1', 'kind': 'Namespace',
+                     'metadata': {'name': name, 'labels': labels or {}}}
+        api.create('/api/v1/namespaces', namespace)
+        return True
+
+    context = ['--context', 'kind-' + cluster]
+    if s.run(['kubectl', 'get', 'ns', name] + context,
+             capture_output=True).returncode == 0:
+        return False
+    try:
+        s.run(['kubectl', 'create', 'ns', name] + context,
+              capture_output=True, check=True)
+        if labels:
+            s.run(['kubectl', 'label', 'namespace', name] +
+                  [key + '=' + value for key, value in labels.items()] +
+                  context, capture_output=True, check=True)
+    except s.CalledProcessError as error:
+        raise kubeapi.ApiError(None, error.stderr.decode('utf-8'))
+    return True
+
+
+def namespace_manifest(name, labels=None, annotations=None):
+    metadata = {'name': name}
+    if labels:
+        metadata['labels'] = dict(labels)
+    if annotations:
+        metadata['annotations'] = dict(annotations)
+    return {'apiVersion': 'v1', 'kind': 'Namespace', 'metadata': metadata}
+
+
+def _contains(actual, desired):
+    return all(actual.get(key) == value for key, value in desired.items())
+
+
+def apply_namespaces(cluster, manifests, workers=WORKERS):
+    """Apply Namespace manifests and return (name, status, message)
+    tuples in their order, status being created, configured, unchanged
+    or failed. Namespaces are listed once and only the missing or
+    different ones are applied"""
+    api = api_client(cluster)
+    if api is None:
+        return apply_batch(cluster, manifests)
+    try:
+        live = {ns['metadata']['name']: ns['metadata']
+                for ns in api.get('/api/v1/namespaces').get('items', [])}
+    except kubeapi.ApiError as error:
+        return [(m['metadata']['name'], FAILED, str(error))
+                for m in manifests]
+
+    pending = []
+    for manifest in manifests:
+        metadata = manifest['metadata']
+        current = live.get(metadata['name'])
+        if current is None or \
+                not _contains(current.get('labels') or {},
+                              metadata.get('labels', {})) or \
+                not _contains(current.get('annotations') or {},
+                              metadata.get('annotations', {})):
+            pending.append(manifest)
+    results = {name: (status, message) for name, status, message in
+               apply_batch(cluster, pending, workers=workers)}
+    return [(m['metadata']['name'],) +
+            results.get(m['metadata']['name'], (UNCHANGED, None))
+            for m in manifests]
+
+
+def apply_batch(cluster, manifests, workers=WORKERS):
+    """Server-side apply manifests of one kind, workers at a time, and
+    return (name, status, message) tuples in their order. Objects are
+    reported created only when the API server says it created them"""
+    if not manifests:
+        return []
+    api = api_client(cluster)
+    if api is None:
+        return _kubectl_apply_batch(cluster, manifests)
+
+    def apply_one(manifest):
+        name = manifest['metadata']['name']
+        try:
+            created, _ = api.apply_created(manifest)
+        except kubeapi.ApiError as error:
+            return name, FAILED, str(error)
+        return name, CREATED if created else CONFIGURED, None
+
+    with ThreadPoolExecutor(max_workers=min(workers,
+                                            len(manifests))) as executor:
+        return list(executor.map(apply_one, manifests))
+
+
+def _kubectl_apply_batch(cluster, manifests):
+    # Imported here to keep the startup of the CLI fast
+    import yaml
+    # All objects go through a single kubectl apply, which prints a line
+    # such as namespace/apps created for each of them
+    result = s.run(['kubectl', 'apply', '--context', 'kind-' + cluster,
+                    '-f', '-'],
+                   input=yaml.safe_dump_all(manifests).encode('utf-8'),
+                   capture_output=True)
+    statuses = {}
+    for line in result.stdout.decode('utf-8').splitlines():
+        parts = line.split()
+        if len(parts) == 2 and '/' in parts[0]:
+            statuses[parts[0].split('/', 1)[1]] = parts[1]
+    error = result.stderr.decode('utf-8').strip() or None
+    return [(m['metadata']['name'],) +
+            ((statuses[m['metadata']['name']], None)
+             if m['metadata']['name'] in statuses else (FAILED, error))
+            for m in manifests]
+
+
+def live_annotations(cluster, namespace, plural, selector):
+    """Return the annotations of the objects of a namespaced core
+    resource matching the label selector, keyed by name. Only metadata
+    is transferred, not the data of the objects"""
+    api = api_client(cluster)
+    if api is not None:
+        listing = api.get_metadata(
+            '/api/v1/namespaces/' + namespace + '/' + plural,
+            {'labelSelector': selector})
+        return {item['metadata']['name']:
+                item['metadata'].get('annotations') or {}
+                for item in listing.get('items', [])}
+    try:
+        result = s.run(['kubectl', 'get', plural, '--context',
+                        'kind-' + cluster, '-n', namespace, '-l', selector,
+                        '-o', 'json'], capture_output=True, check=True)
+    except s.CalledProcessError as error:
+        raise kubeapi.ApiError(None, error.stderr.decode('utf-8'))
+    return {item['metadata']['name']:
+            item['metadata'].get('annotations') or {}
+            for item in json.loads(result.stdout).get('items', [])}
+
+
+def get_object(cluster, api_version, kind, name, namespace=None):
+    """Return the live object or None if it does not exist. Raises
+    kubeapi.ApiError if it can not be read"""
+    api = api_client(cluster)
+    if api is not None:
+        return api.get_object(api_version, kind, name, namespace)
+    # kubectl accepts fully qualified kinds such as
+    # IPAddressPool.v1beta1.metallb.io
+    group, _, version = api_version.rpartition('/')
+    resource = kind + '.' + version + '.' + group if group else kind
+    command = ['kubectl', 'get', resource, name, '--context',
+               'kind-' + cluster, '-o', 'json', '--ignore-not-found']
+    if namespace:
+        command += ['-n', namespace]
+    try:
+        result = s.run(command, capture_output=True, check=True)
+    except s.CalledProcessError as error:
+        raise kubeapi.ApiError(None, error.stderr.decode('utf-8'))
+    return json.loads(result.stdout) if result.stdout.strip() else None
+
+
+def annotate(cluster, api_version, kind, name, annotations, namespace=None):
+    """Set annotations on a live object with a JSON merge patch, which
+    leaves the fields other appliers own, such as labels, alone. Raises
+    kubeapi.ApiError on failure"""
+    api = api_client(cluster)
+    if api is not None:
+        api.patch(api.path(api_version, kind, name, namespace),
+                  {'metadata': {'annotations': annotations}})
+        return
+    group, _, version = api_version.rpartition('/')
+    resource = kind + '.' + version + '.' + group if group else kind
+    command = ['kubectl', 'annotate', '--overwrite', resource, name,
+               '--context', 'kind-' + cluster] + \
+        [key + '=' + value for key, value in annotations.items()]
+    if namespace:
+        command += ['-n', namespace]
+    try:
+        s.run(command, capture_output=True, check=True)
+    except s.CalledProcessError as error:
+        raise kubeapi.ApiError(None, error.stderr.decode('utf-8'))
+
+
+def _subset(desired, live):
+    if isinstance(desired, dict):
+        return isinstance(live, dict) and \
+            all(_subset(value, live.get(key))
+                for key, value in desired.items())
+    return desired == live
+
+
+def up_to_date(live, desired):
+    """Whether the live object already has every field desired sets.
+    Fields the API server defaults or adds are ignored"""
+    return live is not None and _subset(
+        {key: value for key, value in desired.items()
+         if key not in ('apiVersion', 'kind')}, live)
+
+
+def apply(cluster, documents):
+    """Apply the objects, server-side through the API or with
+    `kubectl apply`. Raises kubeapi.ApiError on failure"""
+    api = api_client(cluster)
+    if api is not None:
+        for document in documents:
+            api.apply(document)
+        return
+    # Imported here to keep the startup of the CLI fast
+    import yaml
+    try:
+        s.run(['kubectl', 'apply', '--context', 'kind-' + cluster,
+               '-f', '-'],
+              input=yaml.safe_dump_all(documents).encode('utf-8'),
+              capture_output=True, check=True)
+    except s.CalledProcessError as error:
+        raise kubeapi.ApiError(None, error.stderr.decode('utf-8'))
+
+
+# Kinds other objects of a manifest depend on, applied first
+FIRST_KINDS = ('CustomResourceDefinition', 'Namespace')
+
+
+def apply_manifest(cluster, documents, deadline):
+    """Apply a manifest made of many kinds. Custom resource definitions
+    and namespaces go first, and objects of kinds which the API server
+    does not serve yet, because their definition was just created, are
+    retried with a backoff until the time.monotonic() deadline"""
+    first = [d for d in documents if d.get('kind') in FIRST_KINDS]
+    rest = [d for d in documents if d.get('kind') not in FIRST_KINDS]
+    apply(cluster, first)
+    api = api_client(cluster)
+    if api is None:
+        # kubectl retries discovery on its own
+        apply(cluster, rest)
+        return
+    delay = 0.05
+    while rest:
+        waiting = []
+        for document in rest:
+            try:
+                api.apply(document)
+            except kubeapi.ApiError as error:
+                if not error.not_found or time.monotonic() > deadline:
+                    raise
+                api.forget(document['apiVersion'])
+                waiting.append(document)
+        rest = waiting
+        if rest:
+            time.sleep(delay)
+            delay = min(delay * 2, 2)
+
+
+def wait_for_deployments(cluster, namespace, deadline):
+    """Wait until every deployment of namespace has all its replicas
+    available. Returns the names of those still unavailable when the
+    time.monotonic() deadline passed"""
+    api = api_client(cluster)
+    if api is None:
+        timeout = max(int(deadline - time.monotonic()), 1)
+        result = s.run(['kubectl', 'wait', '--context', 'kind-' + cluster,
+                        '-n', namespace, '--for=condition=Available',
+                        'deployment', '--all',
+                        '--timeout', str(timeout) + 's'],
+                       capture_output=True)
+        if result.returncode == 0:
+            return []
+        return [result.stderr.decode('utf-8').strip()]
+    delay = 0.05
+    while True:
+        deployments = api.get('/apis/apps/v1/namespaces/' + namespace +
+                              '/deployments').get('items', [])
+        pending = [d['metadata']['name'] for d in deployments
+                   if (d.get('status', {}).get('availableReplicas') or 0) <
+                   d.get('spec', {}).get('replicas', 1)]
+        if not pending or time.monotonic() + delay > deadline:
+            return pending
+        time.sleep(delay)
+        delay = min(delay * 2, 2)
+
+
+def load_balancer_ip(cluster, namespace, service):
+    """Return the first ingress IP of a LoadBalancer service or None.
+    Raises kubeapi.ApiError if the service can not be read"""
+    api = api_client(cluster)
+    if api is not None:
+        obj = api.get('/api/v1/namespaces/' + namespace + '/services/' +
+                      service)
+        ingress = obj.get('status', {}).get('loadBalancer', {}).get(
+            'ingress') or [{}]
+        return ingress[0].get('ip')
+    try:
+        result = s.run(['kubectl', '--context', 'kind-' + cluster,
+                        '-n', namespace, 'get', 'service', service, '-o',
+                        'jsonpath={.status.loadBalancer.ingress[0].ip}'],
+                       capture_output=True, check=True)
+    except s.CalledProcessError as error:
+        raise kubeapi.ApiError(None, error.stderr.decode('utf-8'))
+    return result.stdout.decode('utf-8') or None
+
+
+def cluster_info(cluster):
+    """Return what `kubectl cluster-info` prints for the cluster. Raises
+    kubeapi.ApiError if the cluster can not be reached"""
+    api = api_client(cluster)
+    if api is not None:
+        lines = ['Kubernetes control plane is running at ' + api.server]
+        services = api.get('/api/v1/namespaces/kube-system/services',
+                           {'labelSelector':
+                            'kubernetes.io/cluster-service=true'})
+        for service in services.get('items', []):
+            name = service['metadata']['name']
+            ports = service.get('spec', {}).get('ports') or [{}]
+            if ports[0].get('name'):
+                name += ':' + ports[0]['name']
+            title = service['metadata'].get('labels', {}).get(
+                'kubernetes.io/name', service['metadata']['name'])
+            lines.append(title + ' is running at ' + api.server +
+                         '/api/v1/namespaces/kube-system/services/' + name +
+                         '/proxy')
+        return '\n'.join(lines) + '\n'
+    try:
+        result = s.run(['kubectl', 'cluster-info', '--context',
+                        'kind-' + cluster], capture_output=True, check=True)
+    except s.CalledProcessError as error:
+        raise kubeapi.ApiError(None, error.stderr.decode('utf-8'))
+    return result.stdout.decode('utf-8')
+
+
+def api_server_ready(port):
+    """Ask the API server published on port whether it is ready. /readyz
+    is readable anonymously and kind serves it with a self-signed cert"""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    url = 'https://127.0.0.1:' + str(port) + '/readyz'
+    try:
+        with urllib.request.urlopen(url, timeout=2, context=context) as r:
+            return r.status == 200
+    except (urllib.error.URLError, OSError) as error:
+        logger.debug('API server not ready: ' + str(error))
+        return False
+
+
+def wait_until_ready(port, deadline, failed=None):
+    """Poll the API server on port with an exponential backoff starting
+    at 50ms until it is ready, the time.monotonic() deadline passes or
+    failed() returns true. Returns whether the API server is ready"""
+    delay = 0.05
+    while True:
+        if api_server_ready(port):
+            return True
+        if (failed and failed()) or time.monotonic() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, 2)
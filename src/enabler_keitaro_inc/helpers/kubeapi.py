@@ -0,0 +1,434 @@
+from src.enabler_keitaro_inc.enabler import logger
+
+import base64
+import http.client
+import json
+import os
+import ssl
+import tempfile
+import threading
+import urllib.parse
+
+
+# Idle keep-alive connections kept open per context
+POOL_SIZE = 8
+TIMEOUT = 30
+FIELD_MANAGER = 'enabler'
+
+JSON = 'application/json'
+# Asks the API server to leave out everything but the metadata of a list
+METADATA_LIST = 'application/json;as=PartialObjectMetadataList;' \
+    'g=meta.k8s.io;v=v1,' + JSON
+PATCH_TYPES = {
+    'merge': 'application/merge-patch+json',
+    'strategic': 'application/strategic-merge-patch+json',
+    'json': 'application/json-patch+json',
+    'apply': 'application/apply-patch+yaml',
+}
+
+_lock = threading.Lock()
+_clients = {}
+
+
+class ConfigError(Exception):
+    """The kubeconfig does not describe a context this client can use"""
+
+
+class ApiError(Exception):
+    """A request to the API server failed. status is None when the
+    server could not be reached at all"""
+
+    def __init__(self, status, message, reason=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+    @property
+    def not_found(self):
+        return self.status == 404
+
+    @property
+    def conflict(self):
+        return self.status == 409
+
+
+def kubeconfig_paths():
+    """Return the kubeconfig files kubectl would read"""
+    if os.environ.get('KUBECONFIG'):
+        return [path for path in os.environ['KUBECONFIG'].split(os.pathsep)
+                if path]
+    return [os.path.join(os.path.expanduser('~'), '.kube', 'config')]
+
+
+def read_kubeconfig(path):
+    # Imported here to keep the startup of the CLI fast
+    import yaml
+    try:
+        with open(path, 'r') as f:
+            return yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return {}
+    except (OSError, yaml.YAMLError) as error:
+        raise ConfigError('Could not read ' + path + ': ' + str(error))
+
+
+def load_kubeconfig():
+    """Merge the kubeconfig files like kubectl does, the first file
+    defining a cluster, user or context wins"""
+    merged = {'clusters': {}, 'users': {}, 'contexts': {}}
+    for path in kubeconfig_paths():
+        config = read_kubeconfig(path)
+        base = os.path.dirname(os.path.abspath(path))
+        if config.get('current-context'):
+            merged.setdefault('current-context', config['current-context'])
+        for section, key in (('clusters', 'cluster'), ('users', 'user'),
+                             ('contexts', 'context')):
+            for entry in config.get(section) or []:
+                value = dict(entry.get(key) or {})
+                # Relative file references are relative to their kubeconfig
+                value['_base'] = base
+                merged[section].setdefault(entry['name'], value)
+    return merged
+
+
+def _file(entry, name):
+    path = entry.get(name)
+    if path and not os.path.isabs(path):
+        path = os.path.join(entry['_base'], path)
+    return path
+
+
+def _ssl_context(cluster, user):
+    context = ssl.create_default_context()
+    if cluster.get('insecure-skip-tls-verify'):
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    elif cluster.get('certificate-authority-data'):
+        context.load_verify_locations(cadata=base64.b64decode(
+            cluster['certificate-authority-data']).decode('ascii'))
+    elif cluster.get('certificate-authority'):
+        context.load_verify_locations(
+            cafile=_file(cluster, 'certificate-authority'))
+
+    if user.get('client-certificate-data'):
+        # ssl only loads client certificates from files, so they are
+        # written to a private directory which is removed right away
+        with tempfile.TemporaryDirectory() as tmp:
+            cert = os.path.join(tmp, 'client.crt')
+            key = os.path.join(tmp, 'client.key')
+            for path, field in ((cert, 'client-certificate-data'),
+                                (key, 'client-key-data')):
+                with open(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600),
+                          'wb') as f:
+                    f.write(base64.b64decode(user.get(field) or ''))
+            context.load_cert_chain(cert, key)
+    elif user.get('client-certificate'):
+        context.load_cert_chain(_file(user, 'client-certificate'),
+                                _file(user, 'client-key'))
+    return context
+
+
+def client(context):
+    """Return the client shared by every step of the command for a
+    kubeconfig context such as kind-keitaro"""
+    with _lock:
+        api = _clients.get(context)
+        if api is None:
+            api = _clients[context] = Client.from_kubeconfig(context)
+    return api
+
+
+def invalidate(context=None):
+    """Close the connections of the client of context, or of every client,
+    so the kubeconfig is read again on next use"""
+    with _lock:
+        names = list(_clients) if context is None else [context]
+        for name in names:
+            api = _clients.pop(name, None)
+            if api is not None:
+                api.close()
+
+
+def write_kubeconfig(path, config):
+    """Replace the kubeconfig file at path, readable only by its owner"""
+    import yaml
+    tmp = path + '.{}.tmp'.format(os.getpid())
+    with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600),
+              'w') as f:
+        yaml.safe_dump(config, f, default_flow_style=False)
+    os.replace(tmp, path)
+    invalidate()
+
+
+def set_server(cluster, server):
+    """Point cluster in the kubeconfig file defining it to server, which
+    is what `kubectl config set-cluster --server` does"""
+    for path in kubeconfig_paths():
+        config = read_kubeconfig(path)
+        for entry in config.get('clusters') or []:
+            if entry.get('name') == cluster:
+                entry.setdefault('cluster', {})['server'] = server
+                write_kubeconfig(path, config)
+                return path
+    raise ConfigError('Cluster ' + cluster + ' not found in kubeconfig')
+
+
+def export_context(context):
+    """Return a kubeconfig holding only context and the cluster and user
+    it refers to, as found in the kubeconfig files"""
+    entries = {}
+    for path in kubeconfig_paths():
+        config = read_kubeconfig(path)
+        for section in ('clusters', 'users', 'contexts'):
+            for entry in config.get(section) or []:
+                entries.setdefault((section, entry.get('name')), entry)
+    found = entries.get(('contexts', context))
+    if found is None:
+        raise ConfigError('Context ' + context + ' not found in kubeconfig')
+    cluster = entries.get(('clusters', found['context'].get('cluster')))
+    user = entries.get(('users', found['context'].get('user')))
+    if cluster is None or user is None:
+        raise ConfigError('Context ' + context + ' is incomplete')
+    return {'apiVersion': 'v1', 'kind': 'Config', 'clusters': [cluster],
+            'users': [user], 'contexts': [found]}
+
+
+def import_context(exported):
+    """Add the entries of a kubeconfig made by export_context to the
+    first kubeconfig file, replacing those with the same names, and make
+    its context the current one like `kind create cluster` does"""
+    path = kubeconfig_paths()[0]
+    config = read_kubeconfig(path)
+    for section in ('clusters', 'users', 'contexts'):
+        names = set(entry['name'] for entry in exported[section])
+        config[section] = [entry for entry in config.get(section) or []
+                           if entry.get('name') not in names] + \
+            exported[section]
+    config.setdefault('apiVersion', 'v1')
+    config.setdefault('kind', 'Config')
+    config['current-context'] = exported['contexts'][0]['name']
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    write_kubeconfig(path, config)
+    return path
+
+
+class Client(object):
+    """Talks to the API server of one context over a small pool of
+    keep-alive connections, so a command pays for the TLS handshake once
+    instead of once per kubectl fork"""
+
+    def __init__(self, server, ssl_context=None, headers=None,
+                 pool_size=POOL_SIZE, timeout=TIMEOUT):
+        url = urllib.parse.urlsplit(server)
+        self.server = server.rstrip('/')
+        self._scheme = url.scheme
+        self._host = url.hostname
+        self._port = url.port
+        self._prefix = url.path.rstrip('/')
+        self._ssl_context = ssl_context
+        self._headers = dict(headers or {})
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._idle = []
+        self._pool_lock = threading.Lock()
+        self._resources = {}
+
+    @classmethod
+    def from_kubeconfig(cls, context):
+        config = load_kubeconfig()
+        if context not in config['contexts']:
+            raise ConfigError('Context ' + context + ' not found in kubeconfig') # noqa
+        names = config['contexts'][context]
+        cluster = config['clusters'].get(names.get('cluster'))
+        user = config['users'].get(names.get('user'), {})
+        if not cluster or not cluster.get('server'):
+            raise ConfigError('Context ' + context + ' has no server')
+        if user.get('exec') or user.get('auth-provider'):
+            raise ConfigError('Authentication plugins are not supported')
+        if cluster.get('tls-server-name') or cluster.get('proxy-url'):
+            raise ConfigError('tls-server-name and proxy-url are not supported') # noqa
+
+        headers = {}
+        token = user.get('token')
+        if not token and user.get('tokenFile'):
+            with open(_file(user, 'tokenFile'), 'r') as f:
+                token = f.read().strip()
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+        elif user.get('username'):
+            credentials = user['username'] + ':' + user.get('password', '')
+            headers['Authorization'] = 'Basic ' + base64.b64encode(
+                credentials.encode('utf-8')).decode('ascii')
+        try:
+            ssl_context = _ssl_context(cluster, user)
+        except (OSError, ValueError, ssl.SSLError) as error:
+            raise ConfigError('Invalid credentials for context ' + context +
+                              ': ' + str(error))
+        return cls(cluster['server'], ssl_context, headers)
+
+    def _connect(self):
+        if self._scheme == 'http':
+            return http.client.HTTPConnection(self._host, self._port,
+                                              timeout=self._timeout)
+        connection = http.client.HTTPSConnection(
+            self._host, self._port, timeout=self._timeout,
+            context=self._ssl_context)
+        return connection
+
+    def _acquire(self):
+        with self._pool_lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _release(self, connection):
+        with self._pool_lock:
+            if len(self._idle) < self._pool_size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._pool_lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def request(self, method, path, body=None, content_type=JSON,
+                params=None, accept=JSON):
+        """Send a request and return the decoded JSON response. Raises
+        ApiError for error responses and unreachable servers"""
+        return self.send(method, path, body, content_type, params,
+                         accept)[1]
+
+    def send(self, method, path, body=None, content_type=JSON, params=None,
+             accept=JSON):
+        """Like request, returning the HTTP status of the response along
+        with the decoded response"""
+        url = self._prefix + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        headers = dict(self._headers, Accept=accept)
+        data = None
+        if body is not None:
+            data = body if isinstance(body, bytes) else \
+                json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = content_type
+        logger.debug(method + ' ' + self.server + url)
+        # A pooled connection may have been closed by the server in the
+        # meantime, in which case the request is sent once more
+        for attempt in range(2):
+            connection = self._acquire()
+            try:
+                connection.request(method, url, body=data, headers=headers)
+                response = connection.getresponse()
+                payload = response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError,
+                    ConnectionResetError) as error:
+                connection.close()
+                if attempt:
+                    raise ApiError(None, str(error))
+                continue
+            except (OSError, http.client.HTTPException) as error:
+                connection.close()
+                raise ApiError(None, 'Could not reach ' + self.server + ': ' +
+                               str(error))
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            break
+        try:
+            result = json.loads(payload.decode('utf-8')) if payload else {}
+        except ValueError:
+            result = {'message': payload.decode('utf-8', 'replace')}
+        if response.status >= 400:
+            message = result.get('message') if isinstance(result, dict) \
+                else None
+            raise ApiError(response.status, message or response.reason,
+                           result.get('reason')
+                           if isinstance(result, dict) else None)
+        return response.status, result
+
+    def get(self, path, params=None):
+        return self.request('GET', path, params=params)
+
+    def get_metadata(self, path, params=None):
+        """List the objects at path with their metadata only"""
+        return self.request('GET', path, params=params, accept=METADATA_LIST)
+
+    def create(self, path, obj):
+        return self.request('POST', path, obj)
+
+    def patch(self, path, patch, patch_type='merge', params=None):
+        return self.request('PATCH', path, patch, PATCH_TYPES[patch_type],
+                            params)
+
+    def delete(self, path):
+        return self.request('DELETE', path)
+
+    def resource(self, api_version, kind):
+        """Return the plural name of kind and whether it is namespaced,
+        asking the API server once per group version"""
+        if api_version not in self._resources:
+            listing = self.get(self.group_path(api_version))
+            self._resources[api_version] = {
+                r['kind']: (r['name'], r['namespaced'])
+                for r in listing.get('resources', []) if '/' not in r['name']}
+        try:
+            return self._resources[api_version][kind]
+        except KeyError:
+            raise ApiError(404, 'Kind ' + kind + ' not served by ' +
+                           api_version, 'NotFound')
+
+    def forget(self, api_version):
+        """Drop what discovery returned for api_version, e.g. once the
+        definition of a custom resource was created"""
+        self._resources.pop(api_version, None)
+
+    @staticmethod
+    def group_path(api_version):
+        if api_version == 'v1':
+            return '/api/v1'
+        return '/apis/' + api_version
+
+    def path(self, api_version, kind, name=None, namespace=None):
+        """Return the path of an object, or of the collection of kind when
+        name is None"""
+        plural, namespaced = self.resource(api_version, kind)
+        path = self.group_path(api_version)
+        if namespaced:
+            path += '/namespaces/' + (namespace or 'default')
+        path += '/' + plural
+        if name:
+            path += '/' + name
+        return path
+
+    def path_for(self, obj):
+        metadata = obj.get('metadata', {})
+        return self.path(obj['apiVersion'], obj['kind'], metadata.get('name'),
+                         metadata.get('namespace'))
+
+    def get_object(self, api_version, kind, name, namespace=None):
+        """Return the object or None if it does not exist"""
+        try:
+            return self.get(self.path(api_version, kind, name, namespace))
+        except ApiError as error:
+            if error.not_found:
+                return None
+            raise
+
+    def apply(self, obj, field_manager=FIELD_MANAGER, force=True):
+        """Server-side apply obj, creating or updating it in one request"""
+        return self.apply_created(obj, field_manager, force)[1]
+
+    def apply_created(self, obj, field_manager=FIELD_MANAGER, force=True):
+        """Server-side apply obj and return whether it was created, which
+        the API server answers with 201, along with the applied object"""
+        params = {'fieldManager': field_manager}
+        if force:
+            params['force'] = 'true'
+        # JSON is valid YAML so the object does not need to be converted
+        status, result = self.send('PATCH', self.path_for(obj), obj,
+                                   PATCH_TYPES['apply'], params)
+        return status == 201, result
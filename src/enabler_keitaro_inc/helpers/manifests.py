@@ -0,0 +1,31 @@
+from src.enabler_keitaro_inc import templates
+
+import functools
+import json
+import string
+try:
+    from importlib.resources import files
+except ImportError:  # Python < 3.9
+    files = None
+
+
+@functools.lru_cache(maxsize=None)
+def template(name):
+    """Return the text of a template packaged in
+    src/enabler_keitaro_inc/templates, read once per process"""
+    if files is None:
+        import importlib.resources
+        return importlib.resources.read_text(templates, name)
+    return files(templates).joinpath(name).read_text(encoding='utf-8')
+
+
+def render(name, **params):
+    """Render a template into a list of documents. Every ${param} of the
+    template is replaced by the JSON encoding of its value, which is
+    valid YAML, so lists and strings need no quoting in templates"""
+    # Imported here to keep the startup of the CLI fast
+    import yaml
+    text = string.Template(template(name)).substitute(
+        {key: json.dumps(value) for key, value in params.items()})
+    return [document for document in yaml.safe_load_all(text)
+            if document is not None]
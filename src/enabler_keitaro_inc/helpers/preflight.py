@@ -0,0 +1,182 @@
+from src.enabler_keitaro_inc.enabler import logger
+from src.enabler_keitaro_inc.helpers import cache
+
+import json
+import os
+import shutil
+import subprocess as s
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+OK = 'ok'
+ERROR = 'error'
+CRITICAL = 'critical'
+
+# Successful results are reused for TTL seconds as long as the binary
+# they ran and $PATH stay the same
+TTL = int(os.environ.get('ENABLER_PREFLIGHT_TTL', 60 * 60))
+CACHE_FILE = 'preflight.json'
+
+
+class Check(object):
+    """A preflight check running command. parse turns the output of the
+    command into a version and require receives that version and returns
+    an error message, or None when the version is acceptable. Checks
+    of something that can change without the binary changing, such as a
+    daemon being up, are not cacheable"""
+
+    def __init__(self, name, command, label=None, parse=None, require=None,
+                 failure_hint=None, timeout=None, cacheable=True):
+        self.name = name
+        self.command = command
+        self.label = label or name
+        self.parse = parse
+        self.require = require
+        self.failure_hint = failure_hint
+        self.timeout = timeout
+        self.cacheable = cacheable
+
+    def fingerprint(self):
+        """Identify the binary the check would run, None if not found or
+        if the result of the check must not be cached"""
+        if not self.cacheable:
+            return None
+        path = shutil.which(self.command[0])
+        if path is None:
+            return None
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        return [path, st.st_size, st.st_mtime_ns, os.environ.get('PATH')]
+
+    def run(self, timeout):
+        """Run the check and return its CheckResult"""
+        start = time.monotonic()
+        timeout = self.timeout or timeout
+        version = None
+        try:
+            result = s.run(self.command, capture_output=True, check=True,
+                           timeout=timeout)
+            output = result.stdout.decode('utf-8')
+            error = None
+            if self.parse:
+                version = self.parse(output + result.stderr.decode('utf-8'))
+            if self.require:
+                if version is None:
+                    error = '`' + ' '.join(self.command) + '` returned ' \
+                        'something unexpected: ' + output
+                else:
+                    error = self.require(version)
+            status = ERROR if error else OK
+            message = error or '✓ ' + self.label
+        except FileNotFoundError:
+            output = ''
+            status = CRITICAL
+            message = self.name + ' not found in PATH.'
+        except s.TimeoutExpired:
+            output = ''
+            status = CRITICAL
+            message = '`' + ' '.join(self.command) + '` timed out after ' + \
+                str(timeout) + 's'
+        except s.CalledProcessError as error:
+            output = error.stderr.decode('utf-8')
+            status = CRITICAL
+            message = '`' + ' '.join(self.command) + '` returned ' \
+                'something unexpected: ' + output
+            if self.failure_hint:
+                message += '\n' + self.failure_hint
+        return CheckResult(self.name, status, message, output,
+                           time.monotonic() - start,
+                           str(version) if version is not None else None)
+
+
+class CheckResult(object):
+    __slots__ = ('name', 'status', 'message', 'output', 'duration',
+                 'version', 'cached')
+
+    def __init__(self, name, status, message, output, duration,
+                 version=None, cached=False):
+        self.name = name
+        self.status = status
+        self.message = message
+        self.output = output
+        self.duration = duration
+        self.version = version
+        self.cached = cached
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data['status'], data['message'], '',
+                   data['duration'], data.get('version'), cached=True)
+
+    def as_dict(self):
+        return {'name': self.name,
+                'status': self.status,
+                'message': self.message,
+                'version': self.version,
+                'duration': round(self.duration, 3),
+                'cached': self.cached}
+
+    def log(self):
+        if self.status == OK:
+            logger.info(self.message)
+            logger.debug(self.output)
+        elif self.status == ERROR:
+            logger.error(self.message)
+        else:
+            logger.critical(self.message)
+
+
+def cache_path():
+    return os.path.join(cache.cache_dir(), CACHE_FILE)
+
+
+def load_results():
+    try:
+        with open(cache_path(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_results(results):
+    os.makedirs(cache.cache_dir(), exist_ok=True)
+    tmp = cache_path() + '.{}.tmp'.format(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    os.replace(tmp, cache_path())
+
+
+def run_checks(checks, timeout, use_cache=True):
+    """Run all checks concurrently, the total time is that of the
+    slowest check. Checks with a fresh cached result are not run at all.
+    Results are returned in the order of checks"""
+    stored = load_results()
+    now = time.time()
+    results = [None] * len(checks)
+    fingerprints = [check.fingerprint() for check in checks]
+    pending = []
+    for i, check in enumerate(checks):
+        entry = stored.get(check.name)
+        if use_cache and entry and fingerprints[i] is not None and \
+                entry['fingerprint'] == fingerprints[i] and \
+                now - entry['checked'] < TTL:
+            results[i] = CheckResult.from_dict(entry['result'])
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+
+    with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+        ran = executor.map(lambda i: checks[i].run(timeout), pending)
+        for i, result in zip(pending, ran):
+            results[i] = result
+            # Only successes are cached so failures are looked at again
+            if result.status == OK and fingerprints[i] is not None:
+                stored[result.name] = {'fingerprint': fingerprints[i],
+                                       'checked': now,
+                                       'result': result.as_dict()}
+            else:
+                stored.pop(result.name, None)
+    save_results(stored)
+    return results
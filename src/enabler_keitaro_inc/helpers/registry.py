@@ -0,0 +1,126 @@
+from src.enabler_keitaro_inc.enabler import logger
+from src.enabler_keitaro_inc.helpers import containers, manifests
+
+import io
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+
+# A registry:2 container shared by the kind clusters of the host, pushed
+# to at localhost:PORT and reached by the nodes over the kind network
+NAME = 'kind-registry'
+IMAGE = 'registry:2'
+PORT = 5001
+CONTAINER_PORT = 5000
+NETWORK = 'kind'
+
+# Makes containerd read the registry hosts of every node from CERTS_DIR
+CERTS_DIR = '/etc/containerd/certs.d'
+CONTAINERD_PATCH = ('[plugins."io.containerd.grpc.v1.cri".registry]\n'
+                    '  config_path = "' + CERTS_DIR + '"\n')
+
+
+class RegistryError(Exception):
+    """The registry container can not be used as asked"""
+
+
+def published_port(details):
+    """Return the host port of the registry from docker inspect, or None"""
+    bindings = (details.get('HostConfig') or {}).get('PortBindings') or {}
+    for binding in bindings.get('{}/tcp'.format(CONTAINER_PORT)) or []:
+        if binding.get('HostPort'):
+            return int(binding['HostPort'])
+    return None
+
+
+def ensure(name=NAME, port=PORT):
+    """Start the registry container, creating it first if needed.
+    Returns True if it was created. Raises RegistryError when it exists
+    but is published on another port than port"""
+    import docker
+    api = containers.client().api
+    try:
+        details = api.inspect_container(name)
+    except docker.errors.NotFound:
+        try:
+            api.inspect_image(IMAGE)
+        except docker.errors.ImageNotFound:
+            logger.info('Pulling ' + IMAGE)
+            api.pull(IMAGE)
+        api.create_container(
+            IMAGE, name=name, ports=[CONTAINER_PORT],
+            host_config=api.create_host_config(
+                port_bindings={CONTAINER_PORT: ('127.0.0.1', port)},
+                restart_policy={'Name': 'always'}))
+        api.start(name)
+        return True
+    # Clusters may pull from the port it runs on, it is not moved
+    running_port = published_port(details)
+    if running_port != port:
+        raise RegistryError(
+            'Registry ' + name + ' runs at localhost:{}, not {}, use that '
+            'port or remove it with `docker rm -f {}`'.format(
+                running_port, port, name))
+    if not details['State'].get('Running'):
+        api.start(name)
+    return False
+
+
+def patch_config(config):
+    """Return the kind config with the containerd patch that makes nodes
+    read the registry hosts from CERTS_DIR"""
+    config = dict(config)
+    patches = list(config.get('containerdConfigPatches') or [])
+    if CONTAINERD_PATCH not in patches:
+        patches.append(CONTAINERD_PATCH)
+    config['containerdConfigPatches'] = patches
+    return config
+
+
+def hosts_archive(name=NAME, port=PORT):
+    """Return a tar archive of the hosts.toml sending pulls of
+    localhost:port to the registry container"""
+    directory = 'certs.d/localhost:{}'.format(port)
+    content = '[host."http://{}:{}"]\n'.format(name, CONTAINER_PORT).encode()
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w') as tar:
+        for path in ('certs.d', directory):
+            info = tarfile.TarInfo(path)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            tar.addfile(info)
+        info = tarfile.TarInfo(directory + '/hosts.toml')
+        info.size = len(content)
+        info.mode = 0o644
+        tar.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+def connect(nodes, name=NAME, port=PORT):
+    """Attach the registry to the kind network and point containerd of
+    every node at it"""
+    import docker
+    api = containers.client().api
+    try:
+        api.connect_container_to_network(name, NETWORK)
+    except docker.errors.APIError as error:
+        if 'already exists' not in str(error):
+            raise
+    data = hosts_archive(name, port)
+    nodes = [node for node in nodes if node.role != containers.LOAD_BALANCER]
+    if not nodes:
+        return
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        list(executor.map(
+            lambda node: api.put_archive(node.id, '/etc/containerd', data),
+            nodes))
+
+
+def hosting_manifest(port=PORT):
+    """Return the local-registry-hosting ConfigMap advertising the
+    registry to tools running against the cluster"""
+    return manifests.render(
+        'local-registry-hosting.yaml',
+        hosting='host: "localhost:{}"\n'
+                'help: "https://kind.sigs.k8s.io/docs/user/local-registry/"\n'
+                .format(port))
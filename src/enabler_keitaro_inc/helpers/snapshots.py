@@ -0,0 +1,273 @@
+from src.enabler_keitaro_inc.enabler import logger
+from src.enabler_keitaro_inc.helpers import cache, containers
+
+import ipaddress
+import json
+import os
+import re
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Node images are committed as enabler-snapshot/<node name>:<tag>
+REPOSITORY = 'enabler-snapshot'
+TAG = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9_.-]{0,127}$')
+DEFAULT_TAG = 'latest'
+
+API_PORT = '6443/tcp'
+# kind keeps /var, with etcd and the containerd images, on an anonymous
+# volume of every node, which docker commit leaves out
+VAR = '/var'
+# What restore needs of every node in snapshot.json
+NODE_KEYS = ('name', 'image', 'archive', 'hostname', 'labels', 'env', 'tty',
+             'volumes', 'host_config', 'network', 'ipv4', 'ipv6')
+
+
+class SnapshotError(Exception):
+    """A snapshot could not be taken or restored"""
+
+
+def snapshots_dir(cluster=None):
+    path = os.path.join(cache.cache_dir(), 'snapshots')
+    return os.path.join(path, cluster) if cluster else path
+
+
+def snapshot_dir(cluster, tag):
+    return os.path.join(snapshots_dir(cluster), tag)
+
+
+def image_name(node_name, tag):
+    return REPOSITORY + '/' + node_name + ':' + tag
+
+
+def tags(cluster):
+    """Return the tags of the snapshots of a cluster"""
+    try:
+        names = os.listdir(snapshots_dir(cluster))
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if os.path.exists(
+        os.path.join(snapshot_dir(cluster, name), 'snapshot.json')))
+
+
+def _missing(snapshot):
+    """Return the first thing restore needs that the description of a
+    snapshot lacks, or None"""
+    if not isinstance(snapshot, dict):
+        return 'description'
+    for key in ('cluster', 'tag', 'nodes', 'kubeconfig'):
+        if key not in snapshot:
+            return key
+    if not isinstance(snapshot['nodes'], list) or not snapshot['nodes']:
+        return 'nodes'
+    for node in snapshot['nodes']:
+        if not isinstance(node, dict):
+            return 'nodes'
+        for key in NODE_KEYS:
+            if key not in node:
+                return 'nodes.' + key
+    if not isinstance(snapshot['kubeconfig'], dict):
+        return 'kubeconfig'
+    for section in ('clusters', 'users', 'contexts'):
+        if not snapshot['kubeconfig'].get(section):
+            return 'kubeconfig.' + section
+    return None
+
+
+def load(cluster, tag):
+    """Return the description of a snapshot written by take"""
+    try:
+        with open(os.path.join(snapshot_dir(cluster, tag),
+                               'snapshot.json'), 'r') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        available = tags(cluster)
+        raise SnapshotError('no snapshot ' + tag + ' of ' + cluster + (
+            ', there is ' + ', '.join(available) if available else ''))
+    except (OSError, ValueError) as error:
+        raise SnapshotError('snapshot ' + tag + ' of ' + cluster +
+                            ' is damaged: ' + str(error))
+    missing = _missing(snapshot)
+    if missing:
+        raise SnapshotError('snapshot ' + tag + ' of ' + cluster +
+                            ' is damaged: it has no ' + missing)
+    return snapshot
+
+
+def verify(snapshot):
+    """Check that the node images and /var archives of a snapshot are
+    all there, before anything is deleted to restore it"""
+    import docker
+    api = containers.client().api
+    source = snapshot_dir(snapshot['cluster'], snapshot['tag'])
+    name = 'snapshot ' + snapshot['tag'] + ' of ' + snapshot['cluster']
+    for spec in snapshot['nodes']:
+        try:
+            if not tarfile.is_tarfile(os.path.join(source, spec['archive'])):
+                raise SnapshotError(name + ' is damaged: ' +
+                                    spec['archive'] + ' is no archive')
+            api.inspect_image(spec['image'])
+        except docker.errors.ImageNotFound:
+            raise SnapshotError(name + ' is damaged: the image ' +
+                                spec['image'] + ' is gone')
+        except (docker.errors.DockerException, OSError) as error:
+            raise SnapshotError('could not check ' + name + ': ' +
+                                str(error))
+
+
+def node_spec(node):
+    """Return what it takes to create the node container again"""
+    details = containers.client().api.inspect_container(node.id)
+    config = details['Config']
+    host_config = details['HostConfig']
+    network = host_config.get('NetworkMode')
+    endpoint = details['NetworkSettings']['Networks'].get(network) or {}
+    return {'name': node.name,
+            'role': node.role,
+            'hostname': config.get('Hostname'),
+            'labels': config.get('Labels') or {},
+            'env': config.get('Env') or [],
+            'tty': config.get('Tty', False),
+            'volumes': sorted(config.get('Volumes') or {}),
+            'host_config': host_config,
+            'network': network,
+            # Certificates and configs in the node hold its addresses
+            'ipv4': endpoint.get('IPAddress') or None,
+            'ipv6': endpoint.get('GlobalIPv6Address') or None}
+
+
+def pinned_addresses(spec, network):
+    """Return the IPv4 and IPv6 address of the node in the snapshot, or
+    None for each one outside the subnets configured on the network of
+    docker network inspect. Docker only takes a fixed address in those,
+    kind configures the IPv6 subnet alone. The entrypoint of a kind node
+    rewrites its manifests when its address changed"""
+    subnets = [ipaddress.ip_network(config['Subnet'], strict=False)
+               for config in (network.get('IPAM') or {}).get('Config') or []
+               if config.get('Subnet')]
+
+    def pinned(address):
+        if address and any(ipaddress.ip_address(address) in subnet
+                           for subnet in subnets):
+            return address
+        return None
+    return pinned(spec['ipv4']), pinned(spec['ipv6'])
+
+
+def _each(action, items):
+    """Run action on every item at the same time, return the results in
+    their order"""
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=len(items)) as executor:
+        return list(executor.map(action, items))
+
+
+def take(cluster, nodes, tag, kubeconfig):
+    """Commit the stopped nodes of a cluster and archive their /var, all
+    nodes at once. kubeconfig holds the context of the cluster to add
+    back on restore"""
+    import docker
+    api = containers.client().api
+    target = snapshot_dir(cluster, tag)
+    os.makedirs(target, exist_ok=True)
+
+    def snapshot(node):
+        start = time.monotonic()
+        spec = node_spec(node)
+        spec['image'] = image_name(node.name, tag)
+        repository, _, image_tag = spec['image'].rpartition(':')
+        api.commit(node.id, repository=repository, tag=image_tag,
+                   message='enabler kind snapshot')
+        spec['archive'] = node.name + '.var.tar'
+        path = os.path.join(target, spec['archive'])
+        stream, _ = api.get_archive(node.id, VAR)
+        with open(path + '.tmp', 'wb') as f:
+            for chunk in stream:
+                f.write(chunk)
+        os.replace(path + '.tmp', path)
+        logger.debug('Snapshot of {} taken in {:.2f}s'.format(
+            node.name, time.monotonic() - start))
+        return spec
+    try:
+        specs = _each(snapshot, nodes)
+    except (docker.errors.DockerException, OSError) as error:
+        raise SnapshotError('could not snapshot the nodes: ' + str(error))
+
+    # The description is written last, a snapshot without it is unusable
+    path = os.path.join(target, 'snapshot.json')
+    with open(os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                      0o600), 'w') as f:
+        json.dump({'cluster': cluster, 'tag': tag, 'created': time.time(),
+                   'nodes': specs, 'kubeconfig': kubeconfig}, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def restore(snapshot):
+    """Create the node containers of a snapshot, stopped, with their /var
+    as it was. The API server gets a new host port, since the old one may
+    be taken. Returns the IDs of the containers"""
+    import docker
+    api = containers.client().api
+    source = snapshot_dir(snapshot['cluster'], snapshot['tag'])
+    try:
+        networks = dict((name, api.inspect_network(name)) for name in
+                        set(spec['network'] for spec in snapshot['nodes']))
+    except (docker.errors.DockerException, OSError) as error:
+        raise SnapshotError('could not inspect the network: ' + str(error))
+
+    def create(spec):
+        start = time.monotonic()
+        host_config = dict(spec['host_config'])
+        bindings = dict(host_config.get('PortBindings') or {})
+        if API_PORT in bindings:
+            bindings[API_PORT] = [dict(binding, HostPort='')
+                                  for binding in bindings[API_PORT]]
+        host_config['PortBindings'] = bindings
+
+        def create_container(ipv4, ipv6):
+            networking = api.create_networking_config({
+                spec['network']: api.create_endpoint_config(
+                    ipv4_address=ipv4, ipv6_address=ipv6)})
+            return api.create_container(
+                spec['image'], name=spec['name'], hostname=spec['hostname'],
+                labels=spec['labels'], environment=spec['env'],
+                tty=spec['tty'], volumes=spec['volumes'], detach=True,
+                host_config=host_config, networking_config=networking,
+                use_config_proxy=False)
+        ipv4, ipv6 = pinned_addresses(spec, networks[spec['network']])
+        try:
+            container = create_container(ipv4, ipv6)
+        except docker.errors.APIError as error:
+            # Inspect also lists the subnets docker picked by itself
+            if not (ipv4 or ipv6) or \
+                    'user configured subnets' not in str(error):
+                raise
+            logger.debug('Node ' + spec['name'] + ' gets a new address')
+            container = create_container(None, None)
+        try:
+            with open(os.path.join(source, spec['archive']), 'rb') as f:
+                api.put_archive(container['Id'], '/', f)
+        except Exception:
+            api.remove_container(container['Id'], v=True, force=True)
+            raise
+        logger.debug('Node {} restored in {:.2f}s'.format(
+            spec['name'], time.monotonic() - start))
+        return container['Id']
+
+    def create_or_none(spec):
+        try:
+            return create(spec), None
+        except (docker.errors.DockerException, OSError) as error:
+            return None, spec['name'] + ': ' + str(error)
+    results = _each(create_or_none, snapshot['nodes'])
+    created = [id for id, _ in results if id is not None]
+    errors = [error for _, error in results if error is not None]
+    if errors:
+        # Leave no half restored cluster behind
+        for id in created:
+            api.remove_container(id, v=True, force=True)
+        raise SnapshotError('could not restore ' + '; '.join(errors))
+    return created
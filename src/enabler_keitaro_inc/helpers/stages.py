@@ -0,0 +1,115 @@
+from src.enabler_keitaro_inc.enabler import logger
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+# Outcome of a stage
+DONE = 'done'
+RESUMED = 'resumed'
+FAILED = 'failed'
+BLOCKED = 'blocked'
+
+
+class Stage(object):
+    """A unit of work that can run once the stages it needs are done"""
+    __slots__ = ('name', 'action', 'needs')
+
+    def __init__(self, name, action, needs=()):
+        self.name = name
+        self.action = action
+        self.needs = tuple(needs)
+
+
+def order(stages):
+    """Return the names of stages in an order where every stage comes
+    after the stages it needs. Raises ValueError on unknown or circular
+    needs"""
+    by_name = dict((stage.name, stage) for stage in stages)
+    for stage in stages:
+        for need in stage.needs:
+            if need not in by_name:
+                raise ValueError('Stage ' + stage.name + ' needs unknown '
+                                 'stage ' + need)
+    pending = dict((stage.name, set(stage.needs)) for stage in stages)
+    ordered = []
+    while pending:
+        ready = sorted(name for name, needs in pending.items() if not needs)
+        if not ready:
+            raise ValueError('Stages ' + ', '.join(sorted(pending)) +
+                             ' need each other')
+        for name in ready:
+            del pending[name]
+            for needs in pending.values():
+                needs.discard(name)
+        ordered += ready
+    return ordered
+
+
+def run(stages, done=(), on_done=None, workers=None):
+    """Run every stage as soon as the stages it needs are done, at most
+    workers at a time. Stages in done are not run again. on_done(name) is
+    called from the calling thread after every stage that succeeded.
+    Returns a dict of name to (outcome, seconds, error), stages needing a
+    failed stage are blocked while independent ones keep running"""
+    order(stages)
+    by_name = dict((stage.name, stage) for stage in stages)
+    results = dict((name, (RESUMED, 0.0, None))
+                   for name in done if name in by_name)
+    waiting = [stage for stage in stages if stage.name not in results]
+    running = {}
+
+    def timed(stage):
+        start = time.monotonic()
+        stage.action()
+        return time.monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=workers or len(stages) or 1) as executor: # noqa
+        while waiting or running:
+            for stage in list(waiting):
+                outcomes = [results.get(need, (None,))[0]
+                            for need in stage.needs]
+                if any(outcome in (FAILED, BLOCKED) for outcome in outcomes):
+                    waiting.remove(stage)
+                    results[stage.name] = (BLOCKED, 0.0, None)
+                elif all(outcome in (DONE, RESUMED) for outcome in outcomes):
+                    waiting.remove(stage)
+                    logger.debug('Starting stage ' + stage.name)
+                    running[executor.submit(timed, stage)] = stage
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as error:
+                    results[stage.name] = (FAILED, 0.0, error)
+                    continue
+                results[stage.name] = (DONE, seconds, None)
+                logger.debug('Stage {} done in {:.2f}s'.format(stage.name,
+                                                               seconds))
+                if on_done is not None:
+                    on_done(stage.name)
+    return results
+
+
+def load_state(path):
+    """Return the checkpoint at path, a dict of stage name to the digest
+    of its options, or an empty one"""
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def save_state(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.{}.tmp'.format(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
@@ -0,0 +1,181 @@
+from src.enabler_keitaro_inc.enabler import logger
+
+import json
+import os
+import re
+import semver
+import subprocess as s
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+STATE_FILE = '.versions.json'
+# Upstream releases are checked at most once per TTL, in between the
+# recorded answer is reused without any network round-trip
+UPSTREAM_TTL = int(os.environ.get('ENABLER_UPSTREAM_TTL', 24 * 60 * 60))
+TIMEOUT = 10
+
+# Arguments that make each tool print its own version without
+# contacting a cluster
+PROBES = {
+    'kubectl': ['version', '--client'],
+    'helm': ['version', '--short'],
+    'istioctl': ['version', '--remote=false'],
+    'kind': ['version'],
+    'skaffold': ['version'],
+}
+
+VERSION_RE = re.compile(r'v?(\d+\.\d+\.\d+)')
+JAVA_VERSION_RE = re.compile(r'version "(\d+)(?:\.(\d+))?(?:\.(\d+))?')
+
+
+def normalize(version):
+    """Strip the leading v of a tag, v1.29.0 becomes 1.29.0"""
+    if version is None:
+        return None
+    match = VERSION_RE.search(version)
+    return match.group(1) if match else None
+
+
+def parse(text):
+    """Parse the first version found in the output of a tool, such as
+    v3.1.2+gd878d4d or Client Version: v1.29.0, into a semver version"""
+    version = normalize(text)
+    return semver.VersionInfo.parse(version) if version else None
+
+
+def parse_java(text):
+    """Parse the output of java -version. Java 8 and older report
+    1.8.0_292, newer releases 11.0.2 or just 17"""
+    match = JAVA_VERSION_RE.search(text)
+    if match is None:
+        return None
+    parts = [int(part or 0) for part in match.groups()]
+    if parts[0] == 1:
+        parts = parts[1:] + [0]
+    return semver.VersionInfo(*parts)
+
+
+def state_path(bin_dir):
+    return os.path.join(bin_dir, STATE_FILE)
+
+
+def load_state(bin_dir):
+    try:
+        with open(state_path(bin_dir), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(bin_dir, state):
+    tmp = state_path(bin_dir) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, state_path(bin_dir))
+
+
+def fingerprint(path):
+    st = os.stat(path)
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+def probe(path, name):
+    """Run the binary at path and parse the version it reports"""
+    try:
+        result = s.run([path] + PROBES.get(name, ['version']),
+                       capture_output=True, timeout=TIMEOUT)
+    except (OSError, s.TimeoutExpired) as error:
+        logger.debug('Could not probe ' + path + ': ' + str(error))
+        return None
+    return normalize(result.stdout.decode('utf-8') +
+                     result.stderr.decode('utf-8'))
+
+
+def installed_versions(bin_dir, names):
+    """Return the version of every binary in bin_dir, keyed by name.
+    Binaries whose inode, size and mtime did not change since the last
+    probe are not executed again, the others are probed in parallel"""
+    state = load_state(bin_dir)
+    binaries = state.setdefault('binaries', {})
+    versions = {}
+    stale = []
+    for name in names:
+        path = os.path.join(bin_dir, name)
+        if not os.path.exists(path):
+            continue
+        entry = binaries.get(name)
+        if entry and entry['fingerprint'] == fingerprint(path):
+            versions[name] = entry['version']
+        else:
+            stale.append(name)
+    if stale:
+        with ThreadPoolExecutor(max_workers=len(stale)) as executor:
+            probed = executor.map(
+                lambda name: probe(os.path.join(bin_dir, name), name), stale)
+            for name, version in zip(stale, probed):
+                versions[name] = version
+                if version is None:
+                    # Probe again next time, the probe itself may be broken
+                    binaries.pop(name, None)
+                    continue
+                binaries[name] = {
+                    'fingerprint': fingerprint(os.path.join(bin_dir, name)),
+                    'version': version}
+        save_state(bin_dir, state)
+    return versions
+
+
+def latest_releases(bin_dir, repos):
+    """Return the latest upstream release of every GitHub repo, keyed by
+    repo. Answers are reused for UPSTREAM_TTL seconds and revalidated
+    with If-None-Match afterwards so unchanged releases cost a 304"""
+    state = load_state(bin_dir)
+    upstream = state.setdefault('upstream', {})
+    now = time.time()
+    releases = {}
+    due = []
+    for repo in repos:
+        entry = upstream.get(repo)
+        if entry and now - entry['checked'] < UPSTREAM_TTL:
+            releases[repo] = entry['version']
+        else:
+            due.append(repo)
+    if due:
+        with ThreadPoolExecutor(max_workers=len(due)) as executor:
+            checked = executor.map(
+                lambda repo: latest_release(repo, upstream.get(repo)), due)
+            for repo, entry in zip(due, checked):
+                if entry is None:
+                    continue
+                entry['checked'] = now
+                upstream[repo] = entry
+                releases[repo] = entry['version']
+        save_state(bin_dir, state)
+    return releases
+
+
+def latest_release(repo, cached=None):
+    """Ask GitHub for the latest release of repo, revalidating the cached
+    entry with its ETag. Returns the entry or None on failure"""
+    request = urllib.request.Request(
+        'https://api.github.com/repos/' + repo + '/releases/latest',
+        headers={'Accept': 'application/vnd.github+json'})
+    if cached and cached.get('etag'):
+        request.add_header('If-None-Match', cached['etag'])
+    try:
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            tag = json.load(response).get('tag_name')
+            return {'version': normalize(tag),
+                    'etag': response.headers.get('ETag')}
+    except urllib.error.HTTPError as error:
+        if error.code == 304 and cached:
+            return dict(cached)
+        logger.debug('Latest release of ' + repo + ' not found: ' +
+                     str(error))
+    except (urllib.error.URLError, OSError, ValueError) as error:
+        logger.debug('Latest release of ' + repo + ' not found: ' +
+                     str(error))
+    return None
@@ -1,4 +1,3 @@
-from semver import parse
 import click
 
 
@@ -6,6 +5,7 @@ class BasedVersionParamType(click.ParamType):
     name = "semver"
 
     def convert(self, value, param, ctx):
+        from semver import parse
         try:
             parse(value)
             return (value)
@@ -0,0 +1,26 @@
+from src.enabler_keitaro_inc._version import __version__
+
+import functools
+
+
+# setup.py and pyproject.toml name the distribution differently
+DISTRIBUTIONS = ['enabler', 'enabler_keitaro_inc']
+
+
+@functools.lru_cache(maxsize=None)
+def get_version():
+    """Return the version of Enabler. The metadata of the installed
+    distribution is looked up by name, unlike pkg_resources which scans
+    every installed distribution, and the version of the source tree is
+    used when Enabler is not installed"""
+    try:
+        from importlib import metadata
+    except ImportError:
+        # Python 3.7 has no importlib.metadata
+        return __version__
+    for name in DISTRIBUTIONS:
+        try:
+            return metadata.version(name)
+        except metadata.PackageNotFoundError:
+            continue
+    return __version__
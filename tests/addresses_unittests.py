@@ -0,0 +1,41 @@
+import ipaddress
+import unittest
+from src.enabler_keitaro_inc.helpers import addresses
+
+
+class TestAddresses(unittest.TestCase):
+    def test_tail_range(self):
+        self.assertEqual(
+            addresses.format_range(addresses.tail_range('172.18.0.0/16')),
+            '172.18.255.245 - 172.18.255.254')
+        first, last = addresses.tail_range('fc00::/8', 1000)
+        self.assertEqual(int(last) - int(first), 999)
+        with self.assertRaises(ValueError):
+            addresses.tail_range('172.18.0.0/30', 10)
+
+    def test_parse_range(self):
+        first = ipaddress.ip_address('172.18.255.200')
+        last = ipaddress.ip_address('172.18.255.250')
+        for text in ('172.18.255.200-172.18.255.250',
+                     ' 172.18.255.200 - 172.18.255.250 '):
+            self.assertEqual(addresses.parse_range(text), (first, last))
+        self.assertEqual(addresses.parse_range('172.18.255.0/24')[1],
+                         ipaddress.ip_address('172.18.255.255'))
+        for text in ('172.18.255.250-172.18.255.200', '172.18.255.200',
+                     '172.18.255.200-fc00::1', 'foo-bar'):
+            with self.assertRaises(ValueError):
+                addresses.parse_range(text)
+
+    def test_within_and_conflicts(self):
+        address_range = addresses.parse_range('172.18.0.1-172.18.0.10')
+        self.assertTrue(addresses.within(address_range, '172.18.0.0/16'))
+        self.assertFalse(addresses.within(address_range, '172.19.0.0/16'))
+        self.assertFalse(addresses.within(address_range, 'fc00::/64'))
+        used = [('node', ipaddress.ip_address('172.18.0.2')),
+                ('other', ipaddress.ip_address('172.18.0.20')),
+                ('v6', ipaddress.ip_address('fc00::2'))]
+        self.assertEqual(addresses.conflicts(address_range, used), used[:1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,80 @@
+import os
+import tempfile
 import unittest
 from click.testing import CliRunner
 from unittest.mock import patch
 from src.enabler_keitaro_inc.commands.cmd_apps import cli as CLI
+from src.enabler_keitaro_inc.helpers import configdata
 
 
 class TestAppCommands(unittest.TestCase):
     def setUp(self):
         self.runner = CliRunner()
 
-    @patch('src.enabler_keitaro_inc.commands.cmd_apps.s')
-    def test_create_namespace_command(self, mock_s):
-        mock_s.run.return_value.returncode = 0
+    @patch('src.enabler_keitaro_inc.commands.cmd_apps.kube.apply_namespaces')
+    def test_create_namespace_command(self, mock_apply):
+        mock_apply.return_value = [('test-namespace', 'created', None)]
         result = self.runner.invoke(CLI, ['namespace', 'test-namespace'])
         self.assertEqual(result.exit_code, 0)
+        cluster, manifests = mock_apply.call_args[0]
+        self.assertEqual(cluster, '')
+        self.assertEqual(manifests, [{
+            'apiVersion': 'v1', 'kind': 'Namespace',
+            'metadata': {'name': 'test-namespace',
+                         'labels': {'istio-injection': 'enabled'}}}])
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_apps.kube.apply_namespaces')
+    def test_create_namespaces_from_file(self, mock_apply):
+        mock_apply.return_value = [('a', 'created', None),
+                                   ('b', 'unchanged', None),
+                                   ('c', 'failed', 'forbidden')]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'namespaces.yaml')
+            with open(path, 'w') as f:
+                f.write('namespaces:\n'
+                        '- b\n'
+                        '- name: c\n'
+                        '  labels: {team: platform}\n'
+                        '  annotations: {owner: ops}\n')
+            result = self.runner.invoke(
+                CLI, ['namespace', 'a', '-f', path, '--no-istio-injection',
+                      '-o', 'json'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('"status": "failed"', result.output)
+        manifests = mock_apply.call_args[0][1]
+        self.assertEqual([m['metadata'] for m in manifests], [
+            {'name': 'a'}, {'name': 'b'},
+            {'name': 'c', 'labels': {'team': 'platform'},
+             'annotations': {'owner': 'ops'}}])
+
+    def test_namespace_needs_names(self):
+        result = self.runner.invoke(CLI, ['namespace'])
+        self.assertEqual(result.exit_code, 2)
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_apps.kube.apply_batch')
+    @patch('src.enabler_keitaro_inc.commands.cmd_apps.kube.live_annotations')
+    def test_configmap_skips_unchanged(self, mock_live, mock_apply):
+        with tempfile.TemporaryDirectory() as tmp:
+            for directory in ('same', 'changed'):
+                os.makedirs(os.path.join(tmp, 'config', directory))
+                with open(os.path.join(tmp, 'config', directory, 'a.conf'),
+                          'w') as f:
+                    f.write(directory)
+            bundles = configdata.collect(os.path.join(tmp, 'config'))
+            configdata.hash_bundles(bundles)
+            digests = {b.name: b.digest for b in bundles}
+            mock_live.return_value = {
+                'config-same': {
+                    configdata.HASH_ANNOTATION: digests['config-same']},
+                'config-changed': {configdata.HASH_ANNOTATION: 'old'}}
+            mock_apply.return_value = [('config-changed', 'configured',
+                                        None)]
+            result = self.runner.invoke(
+                CLI, ['configmap', os.path.join(tmp, 'config'), '-n', 'apps',
+                      '-o', 'json'])
+        self.assertEqual(result.exit_code, 0)
+        manifests = mock_apply.call_args[0][1]
+        self.assertEqual([m['metadata']['name'] for m in manifests],
+                         ['config-changed'])
+        self.assertEqual(manifests[0]['data'], {'a.conf': 'changed'})
+        self.assertIn('"status": "unchanged"', result.output)
@@ -0,0 +1,143 @@
+import fcntl
+import unittest
+import tempfile
+import shutil
+import os
+import threading
+import time
+from click.testing import CliRunner
+from unittest.mock import MagicMock, patch
+from src.enabler_keitaro_inc.helpers import cache
+from src.enabler_keitaro_inc.commands.cmd_setup import cli as CLI
+
+
+def producer(content):
+    def produce(url, path):
+        with open(path, 'wb') as f:
+            f.write(content)
+    return MagicMock(side_effect=produce)
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.env = patch.dict(os.environ, {'XDG_CACHE_HOME': self.temp_dir})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def test_fetch_uses_cache_on_second_call(self):
+        produce = producer(b'kubectl')
+        first = cache.fetch('https://example.com/kubectl', produce)
+        second = cache.fetch('https://example.com/kubectl', produce)
+        self.assertEqual(first, second)
+        self.assertEqual(produce.call_count, 1)
+        self.assertEqual(os.path.basename(first), cache.sha256sum(first))
+
+    def test_lookup_of_verified_downloads(self):
+        cache.fetch('https://example.com/kind', producer(b'kind'))
+        cache.fetch('https://example.com/helm', producer(b'helm'),
+                    'f' * 64)
+        self.assertIsNotNone(cache.lookup('https://example.com/kind'))
+        self.assertIsNone(cache.lookup('https://example.com/kind',
+                                       verified=True))
+        self.assertIsNotNone(cache.lookup('https://example.com/helm',
+                                          verified=True))
+
+    def test_concurrent_fetch_downloads_once(self):
+        def produce(url, path):
+            # Slow enough for the other fetches to find no cached object
+            time.sleep(0.2)
+            with open(path, 'wb') as f:
+                f.write(b'istioctl')
+        produce = MagicMock(side_effect=produce)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            cache.fetch('https://example.com/istioctl', produce)))
+            for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(produce.call_count, 1)
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(list(cache.load_index()),
+                         ['https://example.com/istioctl'])
+        self.assertFalse([name for name in os.listdir(cache.objects_dir())
+                          if name.startswith('tmp-')])
+
+    def test_store_indexes_under_the_lock(self):
+        path = os.path.join(self.temp_dir, 'download')
+        with open(path, 'wb') as f:
+            f.write(b'kind')
+        replace = os.replace
+
+        def check_locked(source, destination):
+            if os.path.dirname(destination) == cache.objects_dir():
+                # prune must not get the lock before the entry is saved
+                with open(os.path.join(cache.cache_dir(), 'locks',
+                                       'index.lock'), 'a') as f:
+                    with self.assertRaises(BlockingIOError):
+                        fcntl.flock(f.fileno(),
+                                    fcntl.LOCK_EX | fcntl.LOCK_NB)
+            replace(source, destination)
+        with patch('src.enabler_keitaro_inc.helpers.cache.os.replace',
+                   side_effect=check_locked):
+            stored = cache.store('https://example.com/kind', path)
+        cache.prune()
+        self.assertTrue(os.path.exists(stored))
+
+    def test_partial_download_survives_runs(self):
+        paths = []
+
+        def interrupted(url, path):
+            paths.append(path)
+            with open(path + '.part', 'wb') as f:
+                f.write(b'ki')
+            raise OSError('connection reset')
+        with self.assertRaises(OSError):
+            cache.fetch('https://example.com/kind', interrupted)
+        cache.prune()
+        self.assertTrue(os.path.exists(paths[0] + '.part'))
+        produce = producer(b'kind')
+        cache.fetch('https://example.com/kind', produce)
+        # The second run writes where the first one stopped
+        self.assertEqual(produce.call_args[0][1], paths[0])
+
+        stale = os.path.join(cache.objects_dir(), 'tmp-gone.part')
+        with open(stale, 'wb') as f:
+            f.write(b'old')
+        os.utime(stale, (0, 0))
+        cache.prune()
+        self.assertFalse(os.path.exists(stale))
+
+    def test_link(self):
+        cached = cache.fetch('https://example.com/kind', producer(b'kind'))
+        destination = os.path.join(self.temp_dir, 'kind')
+        cache.link(cached, destination)
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), b'kind')
+
+    def test_prune_evicts_least_recently_used(self):
+        cache.fetch('https://example.com/old', producer(b'old'))
+        cache.fetch('https://example.com/new', producer(b'new'))
+        removed = cache.prune(max_size=3)
+        self.assertEqual(removed, ['https://example.com/old'])
+        self.assertEqual(list(cache.load_index()), ['https://example.com/new']) # noqa
+
+    def test_verify_drops_corrupt_objects(self):
+        cached = cache.fetch('https://example.com/helm', producer(b'helm'))
+        with open(cached, 'wb') as f:
+            f.write(b'truncated')
+        self.assertEqual(cache.verify(), ['https://example.com/helm'])
+        self.assertFalse(os.path.exists(cached))
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.logger')
+    def test_cache_list_command(self, mock_logger):
+        cache.fetch('https://example.com/skaffold', producer(b'skaffold'))
+        result = CliRunner().invoke(CLI, ['cache', 'list'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('https://example.com/skaffold',
+                      mock_logger.info.call_args_list[0][0][0])
@@ -0,0 +1,75 @@
+import base64
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.enabler_keitaro_inc.helpers import configdata
+
+
+class TestConfigData(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.app = os.path.join(self.root, 'My_App')
+        self.write('My_App/app.conf', b'listen 80\n')
+        self.write('My_App/nginx.d/default.conf', b'server {}\n')
+        self.write('My_App/nginx.d/logo.png', b'\x89PNG\xff\x00')
+        self.write('My_App/nginx.d/.hidden', b'ignored')
+        self.write('My_App/empty/.gitkeep', b'')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, relative, content):
+        path = os.path.join(self.root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def test_collect(self):
+        bundles = configdata.collect(self.app)
+        self.assertEqual([b.name for b in bundles],
+                         ['my-app', 'my-app-nginx-d'])
+        self.assertEqual(sorted(bundles[1].files),
+                         ['default.conf', 'logo.png'])
+        self.assertEqual([b.name for b in configdata.collect(self.app,
+                                                             'web')],
+                         ['web', 'web-nginx-d'])
+
+    @patch('src.enabler_keitaro_inc.helpers.configdata.logger')
+    def test_collect_warns_about_skipped_files(self, mock_logger):
+        self.write('My_App/nginx.d/my site.conf', b'server {}\n')
+        bundles = configdata.collect(self.app)
+        self.assertEqual(sorted(bundles[1].files),
+                         ['default.conf', 'logo.png'])
+        # Dotfiles are left out silently
+        mock_logger.warning.assert_called_once()
+        self.assertIn('my site.conf', mock_logger.warning.call_args[0][0])
+
+    def test_content_hash(self):
+        bundle = configdata.collect(self.app)[0]
+        digest = configdata.content_hash(bundle)
+        self.assertEqual(configdata.content_hash(bundle), digest)
+        self.write('My_App/app.conf', b'listen 8080\n')
+        self.assertNotEqual(configdata.content_hash(bundle), digest)
+
+    def test_manifests(self):
+        bundles = configdata.collect(self.app)
+        configdata.hash_bundles(bundles)
+        configmap = configdata.manifest(bundles[1], 'ConfigMap', 'apps')
+        self.assertEqual(configmap['metadata']['namespace'], 'apps')
+        self.assertEqual(
+            configmap['metadata']['annotations'][configdata.HASH_ANNOTATION],
+            bundles[1].digest)
+        self.assertEqual(configmap['data'], {'default.conf': 'server {}\n'})
+        self.assertEqual(base64.b64decode(configmap['binaryData']['logo.png']),
+                         b'\x89PNG\xff\x00')
+
+        secret = configdata.manifest(bundles[0], 'Secret', 'apps')
+        self.assertEqual(secret['type'], 'Opaque')
+        self.assertEqual(base64.b64decode(secret['data']['app.conf']),
+                         b'listen 80\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+from unittest.mock import patch
+from src.enabler_keitaro_inc.helpers import containers
+
+
+SUMMARIES = [
+    {'Id': '2', 'Names': ['/test-worker'], 'State': 'exited', 'Ports': [],
+     'Labels': {containers.CLUSTER_LABEL: 'test',
+                containers.ROLE_LABEL: 'worker'}},
+    {'Id': '1', 'Names': ['/test-control-plane'], 'State': 'running',
+     'Ports': [{'IP': '127.0.0.1', 'PrivatePort': 6443,
+                'PublicPort': 38765, 'Type': 'tcp'}],
+     'Labels': {containers.CLUSTER_LABEL: 'test',
+                containers.ROLE_LABEL: 'control-plane'}},
+]
+
+
+class TestContainers(unittest.TestCase):
+    def setUp(self):
+        containers.invalidate()
+
+    @patch('src.enabler_keitaro_inc.helpers.containers.client')
+    def test_inventory_is_fetched_once(self, mock_client):
+        mock_client.return_value.api.containers.return_value = SUMMARIES
+        nodes = containers.inventory('test')
+        self.assertIs(containers.inventory('test'), nodes)
+        mock_client.return_value.api.containers.assert_called_once_with(
+            all=True, filters={'label': 'io.x-k8s.kind.cluster'})
+
+        control_plane, worker = nodes
+        self.assertEqual(control_plane.name, 'test-control-plane')
+        self.assertEqual(control_plane.ports, {'6443/tcp': '38765'})
+        self.assertTrue(control_plane.running)
+        self.assertEqual(worker.role, 'worker')
+        self.assertFalse(worker.running)
+        self.assertIs(containers.api_server_node(nodes), control_plane)
+
+    @patch('src.enabler_keitaro_inc.helpers.containers.client')
+    def test_clusters_are_listed_once(self, mock_client):
+        other = {'Id': '3', 'Names': ['/other-control-plane'],
+                 'State': 'running', 'Ports': [],
+                 'Labels': {containers.CLUSTER_LABEL: 'other',
+                            containers.ROLE_LABEL: 'control-plane'}}
+        mock_client.return_value.api.containers.return_value = \
+            SUMMARIES + [other]
+        self.assertEqual(sorted(containers.clusters()), ['other', 'test'])
+        test = containers.cluster_info('test')
+        self.assertEqual(test.api_port, '38765')
+        self.assertFalse(test.running)
+        self.assertEqual([node.id for node in test.stopped], ['2'])
+        self.assertTrue(containers.cluster_info('other').running)
+        self.assertIsNone(containers.cluster_info('missing'))
+        self.assertEqual(mock_client.return_value.api.containers.call_count,
+                         1)
+
+        # Only the invalidated cluster is listed again
+        api = mock_client.return_value.api
+        api.containers.return_value = SUMMARIES[1:]
+        containers.invalidate('test')
+        self.assertTrue(containers.cluster_info('other').running)
+        self.assertEqual(api.containers.call_count, 1)
+        self.assertTrue(containers.cluster_info('test').running)
+        api.containers.assert_called_with(
+            all=True, filters={'label': 'io.x-k8s.kind.cluster=test'})
+        self.assertEqual(sorted(containers.clusters()), ['other', 'test'])
+        self.assertEqual(api.containers.call_count, 2)
+
+        api.containers.return_value = []
+        containers.invalidate('test')
+        self.assertIsNone(containers.cluster_info('test'))
+        self.assertEqual(sorted(containers.clusters()), ['other'])
+        containers.invalidate()
+        self.assertEqual(containers.clusters(), {})
+        self.assertEqual(api.containers.call_count, 4)
+
+    @patch('src.enabler_keitaro_inc.helpers.containers.client')
+    def test_network(self, mock_client):
+        mock_client.return_value.api.networks.return_value = [
+            {'Name': 'kind-other'}, {'Name': 'kind'}]
+        self.assertEqual(containers.network('kind'), {'Name': 'kind'})
+
+    @patch('src.enabler_keitaro_inc.helpers.containers.client')
+    def test_start_nodes(self, mock_client):
+        nodes = [containers.Node.from_summary(s) for s in SUMMARIES]
+        containers.start_nodes(nodes)
+        started = sorted(c[0][0] for c in
+                         mock_client.return_value.api.start.call_args_list)
+        self.assertEqual(started, ['1', '2'])
+
+    @patch('src.enabler_keitaro_inc.helpers.containers.client')
+    def test_stop_nodes_workers_first(self, mock_client):
+        nodes = [containers.Node.from_summary(s) for s in SUMMARIES]
+        timings = containers.stop_nodes(nodes, grace=1)
+        stopped = [c[0][0] for c in
+                   mock_client.return_value.api.stop.call_args_list]
+        self.assertEqual(stopped, ['2', '1'])
+        mock_client.return_value.api.stop.assert_called_with('1', timeout=1)
+        self.assertEqual([node.id for node, _ in timings], ['2', '1'])
+
+    @patch('src.enabler_keitaro_inc.helpers.containers.client')
+    def test_node_watcher(self, mock_client):
+        mock_client.return_value.api.events.return_value = iter([
+            {'status': 'die',
+             'Actor': {'Attributes': {'name': 'test-worker'}}}])
+        watcher = containers.NodeWatcher('test')
+        watcher._thread.join()
+        self.assertEqual(watcher.died, ['test-worker'])
+
+    @patch('src.enabler_keitaro_inc.helpers.containers.client')
+    def test_network_addresses(self, mock_client):
+        mock_client.return_value.api.inspect_network.return_value = {
+            'IPAM': {'Config': [{'Subnet': '172.18.0.0/16',
+                                 'Gateway': '172.18.0.1'}]},
+            'Containers': {'1': {'Name': 'test-control-plane',
+                                 'IPv4Address': '172.18.0.2/16',
+                                 'IPv6Address': 'fc00::2/64'}}}
+        used = containers.network_addresses({'Id': 'abc'})
+        self.assertEqual([(name, str(address)) for name, address in used],
+                         [('gateway', '172.18.0.1'),
+                          ('test-control-plane', '172.18.0.2'),
+                          ('test-control-plane', 'fc00::2')])
@@ -0,0 +1,49 @@
+import unittest
+import tempfile
+import shutil
+import os
+from src.enabler_keitaro_inc.helpers import cache, dependencies, download
+
+
+MANIFEST = """
+kubectl:
+  version: v1.29.0
+  url: "https://example.com/{version}/bin/{os}/amd64/kubectl"
+  sha256:
+    linux: abc123
+helm: "https://get.helm.sh/helm-v3.1.2-{}-amd64.tar.gz"
+"""
+
+
+class TestDependencies(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.temp_dir, 'dependencies.yaml')
+        with open(self.manifest, 'w') as f:
+            f.write(MANIFEST)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_load(self):
+        kubectl, helm = dependencies.load(self.manifest, 'linux')
+        self.assertEqual(kubectl.url,
+                         'https://example.com/v1.29.0/bin/linux/amd64/kubectl') # noqa
+        self.assertEqual(kubectl.expected_sha256(), 'abc123')
+        # Plain URL templates from older manifests are still accepted
+        self.assertEqual(helm.url,
+                         'https://get.helm.sh/helm-v3.1.2-linux-amd64.tar.gz') # noqa
+        # Nothing to verify helm against
+        with self.assertRaises(download.DownloadError):
+            helm.expected_sha256()
+
+    def test_verify_installed(self):
+        for name in ['kind', 'helm']:
+            with open(os.path.join(self.temp_dir, name), 'wb') as f:
+                f.write(name.encode())
+        dependencies.record_checksums(self.temp_dir, {
+            'kind': cache.sha256sum(os.path.join(self.temp_dir, 'kind')),
+            'helm': '0' * 64})
+        failed = dependencies.verify_installed(self.temp_dir,
+                                               ['kind', 'helm', 'kubectl'])
+        self.assertEqual(sorted(failed), ['helm', 'kubectl'])
@@ -0,0 +1,187 @@
+import unittest
+import tempfile
+import shutil
+import os
+import io
+import hashlib
+import tarfile
+import threading
+import urllib.error
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from src.enabler_keitaro_inc.helpers import download
+
+
+PAYLOAD = b'enabler' * 4096
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        RangeHandler.requests.append(self.path)
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+        if self.path == '/busy' and RangeHandler.requests.count('/busy') == 1:
+            self.send_error(503)
+            return
+        if self.path == '/short' and 'Range' not in self.headers:
+            # The connection drops halfway through the body
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(PAYLOAD)))
+            self.end_headers()
+            self.wfile.write(PAYLOAD[:1000])
+            return
+        offset = 0
+        if 'Range' in self.headers:
+            offset = int(self.headers['Range'][6:-1])
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(PAYLOAD) - offset))
+        self.end_headers()
+        self.wfile.write(PAYLOAD[offset:])
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        RangeHandler.requests = []
+        self.temp_dir = tempfile.mkdtemp()
+        self.server = HTTPServer(('127.0.0.1', 0), RangeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start() # noqa
+        self.url = 'http://127.0.0.1:{}/bin'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_fetch(self):
+        destination = os.path.join(self.temp_dir, 'kind')
+        download.fetch(self.url, destination)
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), PAYLOAD)
+        self.assertFalse(os.path.exists(download.partial_path(destination)))
+
+    def test_fetch_resumes_partial_download(self):
+        destination = os.path.join(self.temp_dir, 'kind')
+        with open(download.partial_path(destination), 'wb') as f:
+            f.write(PAYLOAD[:1000])
+        download.fetch(self.url, destination)
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), PAYLOAD)
+
+    def test_fetch_verifies_checksum(self):
+        destination = os.path.join(self.temp_dir, 'kubectl')
+        download.fetch(self.url, destination,
+                       sha256=hashlib.sha256(PAYLOAD).hexdigest())
+        self.assertTrue(os.path.exists(destination))
+
+    def test_fetch_checksum_mismatch_after_resume(self):
+        destination = os.path.join(self.temp_dir, 'kubectl')
+        with open(download.partial_path(destination), 'wb') as f:
+            f.write(b'corrupt!' * 10)
+        with self.assertRaises(download.ChecksumError):
+            download.fetch(self.url, destination,
+                           sha256=hashlib.sha256(PAYLOAD).hexdigest())
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    @patch('src.enabler_keitaro_inc.helpers.download.time.sleep')
+    def test_fetch_fails_at_once_on_client_error(self, mock_sleep):
+        destination = os.path.join(self.temp_dir, 'kind')
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            download.fetch(self.url[:-4] + '/missing', destination)
+        self.assertEqual(error.exception.code, 404)
+        self.assertEqual(RangeHandler.requests, ['/missing'])
+        mock_sleep.assert_not_called()
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    @patch('src.enabler_keitaro_inc.helpers.download.time.sleep')
+    def test_fetch_retries_server_error(self, mock_sleep):
+        destination = os.path.join(self.temp_dir, 'kind')
+        download.fetch(self.url[:-4] + '/busy', destination)
+        self.assertEqual(RangeHandler.requests, ['/busy', '/busy'])
+        mock_sleep.assert_called_once_with(download.BACKOFF)
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), PAYLOAD)
+
+    @patch('src.enabler_keitaro_inc.helpers.download.time.sleep')
+    def test_fetch_resumes_short_body(self, mock_sleep):
+        destination = os.path.join(self.temp_dir, 'kind')
+        download.fetch(self.url[:-4] + '/short', destination,
+                       sha256=hashlib.sha256(PAYLOAD).hexdigest())
+        self.assertEqual(RangeHandler.requests, ['/short', '/short'])
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), PAYLOAD)
+
+    @patch('src.enabler_keitaro_inc.helpers.download.time.sleep')
+    def test_next_run_resumes_failed_download(self, mock_sleep):
+        destination = os.path.join(self.temp_dir, 'kind')
+        with self.assertRaises(urllib.error.ContentTooShortError):
+            download.fetch(self.url[:-4] + '/short', destination, retries=1)
+        self.assertEqual(os.path.getsize(download.partial_path(destination)),
+                         1000)
+        download.fetch(self.url[:-4] + '/short', destination,
+                       sha256=hashlib.sha256(PAYLOAD).hexdigest())
+        self.assertEqual(RangeHandler.requests, ['/short', '/short'])
+        self.assertEqual(os.listdir(self.temp_dir), ['kind'])
+
+    def test_run_parallel_collects_failures(self):
+        def fail():
+            raise OSError('boom')
+        failed = download.run_parallel([('ok', len, ('abc',)),
+                                        ('broken', fail, ())])
+        self.assertEqual(list(failed), ['broken'])
+
+
+class TestStreamingExtract(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+            for name, content in [('linux-amd64/LICENSE', b'license'),
+                                  ('linux-amd64/helm', b'helm binary')]:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                info.mode = 0o755
+                tar.addfile(info, io.BytesIO(content))
+        self.archive = archive.getvalue()
+        self.sha256 = hashlib.sha256(self.archive).hexdigest()
+        archive_bytes = self.archive
+
+        class TarHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(archive_bytes)))
+                self.end_headers()
+                self.wfile.write(archive_bytes)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), TarHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start() # noqa
+        self.url = 'http://127.0.0.1:{}/helm.tar.gz'.format(self.server.server_port) # noqa
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_extract_only_wanted_member(self):
+        destination = os.path.join(self.temp_dir, 'helm')
+        download.extract(self.url, destination, 'helm', sha256=self.sha256)
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), b'helm binary')
+        self.assertTrue(os.access(destination, os.X_OK))
+        self.assertEqual(os.listdir(self.temp_dir), ['helm'])
+
+    def test_extract_checksum_mismatch(self):
+        destination = os.path.join(self.temp_dir, 'helm')
+        with self.assertRaises(download.ChecksumError):
+            download.extract(self.url, destination, 'helm', sha256='0' * 64)
+        self.assertEqual(os.listdir(self.temp_dir), [])
@@ -0,0 +1,35 @@
+import unittest
+from unittest.mock import patch
+from src.enabler_keitaro_inc.helpers import helm
+
+
+class TestHelm(unittest.TestCase):
+    @patch('src.enabler_keitaro_inc.helpers.helm.run')
+    def test_release(self, mock_run):
+        mock_run.return_value = ('[{"name": "metallb", "status": "deployed", '
+                                 '"chart": "metallb-4.6.0"}]')
+        entry = helm.release('metallb', 'metallb', 'keitaro')
+        self.assertEqual(helm.chart_version(entry, 'metallb'), '4.6.0')
+        self.assertIn('kind-keitaro', mock_run.call_args[0][0])
+        mock_run.return_value = '[]'
+        self.assertIsNone(helm.release('metallb', 'metallb', 'keitaro'))
+
+    @patch('src.enabler_keitaro_inc.helpers.helm.run')
+    def test_ensure_repo_updates_known_repo(self, mock_run):
+        mock_run.side_effect = ['[{"name": "bitnami", "url": "x"}]', '']
+        helm.ensure_repo('bitnami', 'x')
+        self.assertEqual(mock_run.call_args_list[-1][0][0],
+                         ['repo', 'update'])
+        self.assertEqual(mock_run.call_count, 2)
+
+    @patch('src.enabler_keitaro_inc.helpers.helm.run')
+    def test_ensure_repo_adds_missing_repo(self, mock_run):
+        mock_run.side_effect = [helm.HelmError('no repositories to show'),
+                                '', '']
+        helm.ensure_repo('bitnami', 'x')
+        self.assertEqual(mock_run.call_args_list[1][0][0],
+                         ['repo', 'add', 'bitnami', 'x'])
+
+
+if __name__ == '__main__':
+    unittest.main()
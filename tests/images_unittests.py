@@ -0,0 +1,134 @@
+import io
+import tarfile
+import unittest
+from unittest.mock import patch
+from src.enabler_keitaro_inc.helpers import containers, images, registry
+from src.enabler_keitaro_inc.helpers.containers import Node
+
+
+NODES = [Node('1', 'test-control-plane', 'control-plane', 'running', {}),
+         Node('2', 'test-worker', 'worker', 'running', {}),
+         Node('3', 'test-external-load-balancer', containers.LOAD_BALANCER,
+              'running', {})]
+
+
+class FakeProcess(object):
+    def __init__(self, args, stdin=None, stdout=None, stderr=None):
+        self.args = args
+        self.returncode = 0
+        self.stdout = io.BytesIO(b'x' * int(images.CHUNK_SIZE * 2.5))
+        self.stderr = io.BytesIO()
+        self.received = []
+        self.stdin = self
+
+    def write(self, chunk):
+        self.received.append(chunk)
+
+    def close(self):
+        pass
+
+    def wait(self):
+        return self.returncode
+
+    def kill(self):
+        pass
+
+
+class TestImages(unittest.TestCase):
+    @patch('src.enabler_keitaro_inc.helpers.images.node_image_id')
+    def test_missing(self, mock_node_image_id):
+        present = {('1', 'app:1'): 'sha256:a', ('1', 'db:2'): 'sha256:b',
+                   ('2', 'app:1'): 'sha256:old'}
+        mock_node_image_id.side_effect = \
+            lambda node, image: present.get((node.id, image))
+        result = images.missing(NODES[:2], {'app:1': 'sha256:a',
+                                            'db:2': 'sha256:b'})
+        self.assertEqual(result, {NODES[0]: [], NODES[1]: ['app:1', 'db:2']})
+
+    @patch('src.enabler_keitaro_inc.helpers.images.s.Popen')
+    def test_stream_saves_once(self, mock_popen):
+        processes = []
+
+        def popen(args, **kwargs):
+            processes.append(FakeProcess(args, **kwargs))
+            return processes[-1]
+        mock_popen.side_effect = popen
+        self.assertEqual(images.stream(['app:1', 'db:2'], NODES[:2]), {})
+        save, first, second = processes
+        self.assertEqual(save.args, ['docker', 'save', 'app:1', 'db:2'])
+        self.assertEqual(first.args[:5], ['docker', 'exec', '--privileged',
+                                          '-i', 'test-control-plane'])
+        self.assertEqual(first.args[5:], images.IMPORT)
+        # Both nodes got the whole archive, read once
+        self.assertEqual(len(first.received), 3)
+        self.assertEqual(first.received, second.received)
+        self.assertEqual(save.stdout.read(), b'')
+
+    @patch('src.enabler_keitaro_inc.helpers.images.s.Popen')
+    def test_stream_keeps_feeding_other_nodes(self, mock_popen):
+        processes = []
+
+        def popen(args, **kwargs):
+            processes.append(FakeProcess(args, **kwargs))
+            if len(processes) == 2:
+                def broken(chunk):
+                    raise BrokenPipeError()
+                processes[-1].write = broken
+                processes[-1].returncode = 1
+            return processes[-1]
+        mock_popen.side_effect = popen
+        self.assertEqual(images.stream(['app:1'], NODES[:2]),
+                         {'test-control-plane': 'import stopped reading'})
+        self.assertEqual(len(processes[2].received), 3)
+
+
+class TestRegistry(unittest.TestCase):
+    def test_hosts_archive(self):
+        data = registry.hosts_archive(port=5001)
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            hosts = tar.extractfile('certs.d/localhost:5001/hosts.toml')
+            self.assertEqual(hosts.read(),
+                             b'[host."http://kind-registry:5000"]\n')
+
+    def test_patch_config(self):
+        config = {'kind': 'Cluster', 'containerdConfigPatches': ['a']}
+        patched = registry.patch_config(registry.patch_config(config))
+        self.assertEqual(patched['containerdConfigPatches'],
+                         ['a', registry.CONTAINERD_PATCH])
+        self.assertEqual(config['containerdConfigPatches'], ['a'])
+
+    @patch('src.enabler_keitaro_inc.helpers.registry.containers.client')
+    def test_connect(self, mock_client):
+        registry.connect(NODES)
+        api = mock_client.return_value.api
+        api.connect_container_to_network.assert_called_once_with(
+            'kind-registry', 'kind')
+        self.assertEqual(sorted(c[0][0] for c in
+                                api.put_archive.call_args_list), ['1', '2'])
+
+    @patch('src.enabler_keitaro_inc.helpers.registry.containers.client')
+    def test_ensure_reuses_registry_on_its_port(self, mock_client):
+        api = mock_client.return_value.api
+        api.inspect_container.return_value = {
+            'State': {'Running': False},
+            'HostConfig': {'PortBindings': {'5000/tcp': [
+                {'HostIp': '127.0.0.1', 'HostPort': '5001'}]}}}
+        self.assertFalse(registry.ensure(port=5001))
+        api.start.assert_called_once_with('kind-registry')
+        api.create_container.assert_not_called()
+
+        with self.assertRaises(registry.RegistryError) as error:
+            registry.ensure(port=5002)
+        self.assertIn('runs at localhost:5001, not 5002',
+                      str(error.exception))
+        api.start.assert_called_once_with('kind-registry')
+
+    def test_hosting_manifest(self):
+        configmap, = registry.hosting_manifest(5001)
+        self.assertEqual(configmap['metadata']['namespace'], 'kube-public')
+        self.assertIn('localhost:5001',
+                      configmap['data']['localRegistryHosting.v1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
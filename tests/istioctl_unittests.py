@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.enabler_keitaro_inc.helpers import istioctl
+
+
+class TestIstioctl(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.env = patch.dict(os.environ, {'XDG_CACHE_HOME': self.tmp})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.tmp)
+
+    @patch('src.enabler_keitaro_inc.helpers.istioctl.versions.probe')
+    @patch('src.enabler_keitaro_inc.helpers.istioctl.s.run')
+    def test_render_is_cached(self, mock_run, mock_probe):
+        mock_probe.return_value = '1.20.3'
+        mock_run.return_value.stdout = b'kind: Namespace\n'
+        self.assertEqual(istioctl.render(['profile=default']),
+                         ('kind: Namespace\n', False))
+        self.assertEqual(istioctl.render(['profile=default']),
+                         ('kind: Namespace\n', True))
+        mock_run.assert_called_once_with(
+            ['istioctl', 'manifest', 'generate', '--set', 'profile=default'],
+            capture_output=True, check=True)
+
+        # Other flags or another istioctl render again
+        istioctl.render(['profile=demo'])
+        mock_probe.return_value = '1.21.0'
+        istioctl.render(['profile=default'])
+        self.assertEqual(mock_run.call_count, 3)
+        self.assertNotEqual(istioctl.manifest_path('1.20.3', ['a']),
+                            istioctl.manifest_path('1.20.3', ['b']))
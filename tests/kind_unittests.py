@@ -1,18 +1,33 @@
+import json
 import unittest
 from click.testing import CliRunner
-from unittest.mock import MagicMock, patch
-from src.enabler_keitaro_inc.commands.cmd_kind import cli as CLI
+from unittest.mock import patch
+from src.enabler_keitaro_inc.commands.cmd_kind import cli as CLI, \
+    ClusterError
+from src.enabler_keitaro_inc.enabler import Environment
+from src.enabler_keitaro_inc.helpers import kind, kubeapi, snapshots
+from src.enabler_keitaro_inc.helpers.containers import ClusterInfo, Node
 
 
 class TestKindCommands(unittest.TestCase):
     def setUp(self):
         self.runner = CliRunner()
+        # Environment as set up by the root command for --kube-context
+        self.env = Environment()
+        self.env.kube_context = 'test'
 
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kindconfig.port_conflicts', # noqa
+           return_value=[])
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind.cluster',
+           return_value=None)
     @patch('src.enabler_keitaro_inc.commands.cmd_kind.s')
-    def test_create_command(self, mock_s):
+    def test_create_command(self, mock_s, mock_cluster, mock_conflicts):
         mock_s.run.return_value.returncode = 0
-        result = self.runner.invoke(CLI, ['create'])
+        result = self.runner.invoke(CLI, ['create'], obj=self.env)
         self.assertEqual(result.exit_code, 0)
+        mock_cluster.assert_called_once_with('test')
+        self.assertEqual(mock_s.run.call_args[0][0][:5],
+                         ['kind', 'create', 'cluster', '--name', 'test'])
 
     @patch('src.enabler_keitaro_inc.commands.cmd_kind.s')
     def test_delete_command(self, mock_s):
@@ -26,24 +41,308 @@ class TestKindCommands(unittest.TestCase):
         result = self.runner.invoke(CLI, ['status'])
         self.assertEqual(result.exit_code, 0)
 
-    @patch('src.enabler_keitaro_inc.commands.cmd_kind.docker')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kube')
+    def test_status_of_stopped_cluster(self, mock_kube, mock_kind):
+        mock_kind.cluster.return_value = ClusterInfo('test', [
+            Node('1', 'test-control-plane', 'control-plane', 'exited', {})])
+        result = self.runner.invoke(CLI, ['status', '--kube-context',
+                                          'test'])
+        self.assertEqual(result.exit_code, 1)
+        mock_kube.kubectl_info.assert_not_called()
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.containers')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kube')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.click_spinner.spinner')
+    def test_start_command(self, mock_spinner, mock_kube, mock_kind,
+                           mock_containers):
+        nodes = [Node('1', 'test-control-plane', 'control-plane', 'exited',
+                      {}),
+                 Node('2', 'test-worker', 'worker', 'running', {})]
+        started = [Node('1', 'test-control-plane', 'control-plane',
+                        'running', {'6443/tcp': '38765'}), nodes[1]]
+        mock_kind.cluster.side_effect = [ClusterInfo('test', nodes),
+                                         ClusterInfo('test', started)]
+        mock_kube.wait_until_ready.return_value = True
+        result = self.runner.invoke(CLI, ['start'], obj=self.env)
+        self.assertEqual(result.exit_code, 0)
+        # The API server is not asked while a node is stopped
+        mock_kube.kubectl_info.assert_not_called()
+        mock_containers.start_nodes.assert_called_once_with(nodes[:1])
+        mock_kind.cluster.assert_called_with('test', refresh=True)
+        self.assertEqual(mock_kube.wait_until_ready.call_args[0][0], '38765')
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.containers')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kube')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.click_spinner.spinner')
+    def test_start_command_not_ready(self, mock_spinner, mock_kube, mock_kind,
+                                     mock_containers):
+        mock_kind.cluster.return_value = ClusterInfo('test', [Node(
+            '1', 'test-control-plane', 'control-plane', 'running',
+            {'6443/tcp': '38765'})])
+        mock_kube.kubectl_info.return_value = False
+        mock_kube.wait_until_ready.return_value = False
+        result = self.runner.invoke(CLI, ['start', '--timeout', '1'],
+                                    obj=self.env)
+        self.assertEqual(result.exit_code, 1)
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.containers')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.click_spinner.spinner')
+    def test_stop_command(self, mock_spinner, mock_kind, mock_containers):
+        nodes = [
+            Node('1', 'test-control-plane', 'control-plane', 'running', {}),
+            Node('2', 'test-worker', 'worker', 'exited', {})]
+        mock_kind.cluster.return_value = ClusterInfo('test', nodes)
+        mock_containers.stop_nodes.return_value = []
+        result = self.runner.invoke(CLI, ['stop'], obj=self.env)
+        self.assertEqual(result.exit_code, 0)
+        mock_containers.stop_nodes.assert_called_once_with(nodes[:1],
+                                                           grace=10)
+        mock_containers.invalidate.assert_called_once_with('test')
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.containers')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.click_spinner.spinner')
+    def test_stop_command_fast(self, mock_spinner, mock_kind,
+                               mock_containers):
+        mock_kind.cluster.return_value = ClusterInfo('test', [])
+        mock_containers.stop_nodes.return_value = []
+        result = self.runner.invoke(CLI, ['stop', '--fast'], obj=self.env)
+        self.assertEqual(result.exit_code, 0)
+        mock_containers.stop_nodes.assert_called_once_with(
+            [], grace=mock_containers.FAST_STOP_GRACE)
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.containers')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    def test_stop_many_clusters(self, mock_kind, mock_containers):
+        running = Node('1', 'ci-1-control-plane', 'control-plane', 'running',
+                       {})
+        fleet = {'ci-1': ClusterInfo('ci-1', [running])}
+        mock_kind.select.return_value = ['ci-1', 'ci-2']
+        mock_kind.cluster.side_effect = fleet.get
+        mock_containers.stop_nodes.return_value = [(running, 0.5)]
+        result = self.runner.invoke(CLI, ['stop', 'ci-*', 'ci-2', '-o',
+                                          'json', '--parallel', '2'])
+        self.assertEqual(result.exit_code, 1)
+        mock_kind.select.assert_called_once_with(('ci-*', 'ci-2'))
+        results = json.loads(result.stdout)
+        self.assertEqual([(r['cluster'], r['status']) for r in results],
+                         [('ci-1', 'ok'), ('ci-2', 'failed')])
+        self.assertEqual(results[1]['message'], 'does not exist')
+        mock_containers.stop_nodes.assert_called_once_with(
+            [running], grace=10)
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.containers')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    def test_stop_reports_docker_errors(self, mock_kind, mock_containers):
+        import docker
+        fleet = dict((name, ClusterInfo(name, [Node(
+            name, name + '-control-plane', 'control-plane', 'running', {})]))
+            for name in ('ci-1', 'ci-2'))
+        mock_kind.clusters.return_value = fleet
+        mock_kind.cluster.side_effect = fleet.get
+
+        def stop_nodes(nodes, grace):
+            if nodes[0].name == 'ci-1-control-plane':
+                raise docker.errors.APIError('daemon went away')
+            return [(nodes[0], 0.5)]
+        mock_containers.stop_nodes.side_effect = stop_nodes
+        result = self.runner.invoke(CLI, ['stop', '--all', '-o', 'json'])
+        self.assertEqual(result.exit_code, 1)
+        results = json.loads(result.stdout)
+        self.assertEqual([(r['cluster'], r['status']) for r in results],
+                         [('ci-1', 'failed'), ('ci-2', 'ok')])
+        self.assertEqual(results[0]['message'],
+                         'failed, APIError: daemon went away')
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
     @patch('src.enabler_keitaro_inc.commands.cmd_kind.kube')
     @patch('src.enabler_keitaro_inc.commands.cmd_kind.click_spinner.spinner')
-    def test_start_command(self, mock_spinner, mock_kube, mock_docker):
+    def test_status_all_clusters(self, mock_spinner, mock_kube, mock_kind):
+        fleet = dict((name, ClusterInfo(name, [Node(
+            name, name + '-control-plane', 'control-plane', 'running', {})]))
+            for name in ('ci-1', 'ci-2', 'ci-3'))
+        mock_kind.clusters.return_value = fleet
+        mock_kind.cluster.side_effect = fleet.get
         mock_kube.kubectl_info.return_value = True
-        mock_container = MagicMock()
-        mock_container.name = 'test-control-plane'
-        mock_container.status = 'running'
-        mock_docker.from_env.return_value.containers.list.return_value = [mock_container] # noqa
-        result = self.runner.invoke(CLI, ['start'])
+        result = self.runner.invoke(CLI, ['status', '--all'])
         self.assertEqual(result.exit_code, 0)
+        lines = result.output.splitlines()
+        self.assertEqual(lines[0].split(),
+                         ['CLUSTER', 'STATUS', 'SECONDS', 'MESSAGE'])
+        self.assertEqual([line.split()[:2] for line in lines[1:]],
+                         [['ci-1', 'ok'], ['ci-2', 'ok'], ['ci-3', 'ok']])
 
-    @patch('src.enabler_keitaro_inc.commands.cmd_kind.docker')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.s')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.containers')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    def test_delete_removes_nodes_first(self, mock_kind, mock_containers,
+                                        mock_s):
+        nodes = [Node('1', 'test-control-plane', 'control-plane', 'running',
+                      {})]
+        mock_kind.cluster.return_value = ClusterInfo('test', nodes)
+        result = self.runner.invoke(CLI, ['delete'], obj=self.env)
+        self.assertEqual(result.exit_code, 0)
+        mock_containers.remove_nodes.assert_called_once_with(nodes)
+        self.assertEqual(mock_s.run.call_args[0][0],
+                         ['kind', 'delete', 'cluster', '--name', 'test'])
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.images')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
     @patch('src.enabler_keitaro_inc.commands.cmd_kind.click_spinner.spinner')
-    def test_stop_command(self, mock_spinner, mock_docker):
-        mock_container = MagicMock()
-        mock_container.name = 'test-control-plane'
-        mock_container.status = 'running'
-        mock_docker.from_env.return_value.containers.list.return_value = [mock_container] # noqa
-        result = self.runner.invoke(CLI, ['stop'])
+    def test_load_skips_nodes_with_images(self, mock_spinner, mock_kind,
+                                          mock_images):
+        nodes = [Node('1', 'test-control-plane', 'control-plane', 'running',
+                      {}),
+                 Node('2', 'test-worker', 'worker', 'running', {})]
+        mock_kind.cluster.return_value = ClusterInfo('test', nodes)
+        mock_images.image_id.side_effect = lambda name: 'sha256:' + name
+        mock_images.missing.return_value = {nodes[0]: [],
+                                            nodes[1]: ['app:1']}
+        mock_images.stream.return_value = {}
+        result = self.runner.invoke(CLI, ['load', 'app:1', 'db:2'],
+                                    obj=self.env)
+        self.assertEqual(result.exit_code, 0)
+        mock_images.missing.assert_called_once_with(
+            nodes, {'app:1': 'sha256:app:1', 'db:2': 'sha256:db:2'})
+        mock_images.stream.assert_called_once_with(['app:1'], nodes[1:])
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kube')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.registry')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    def test_registry_command(self, mock_kind, mock_registry, mock_kube):
+        nodes = [Node('1', 'test-control-plane', 'control-plane', 'running',
+                      {})]
+        mock_kind.cluster.return_value = ClusterInfo('test', nodes)
+        mock_registry.ensure.return_value = True
+        result = self.runner.invoke(CLI, ['registry', '--port', '5002'],
+                                    obj=self.env)
         self.assertEqual(result.exit_code, 0)
+        mock_registry.ensure.assert_called_once_with(port=5002)
+        mock_registry.connect.assert_called_once_with(nodes, port=5002)
+        mock_kube.apply.assert_called_once_with(
+            'test', mock_registry.hosting_manifest.return_value)
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.start_cluster')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.stop_cluster')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.snapshots.take')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kubeapi')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    def test_snapshot_restarts_running_cluster(self, mock_kind, mock_kubeapi,
+                                               mock_take, mock_stop,
+                                               mock_start):
+        mock_kubeapi.ApiError = kubeapi.ApiError
+        mock_kubeapi.ConfigError = kubeapi.ConfigError
+        nodes = [Node('1', 'test-control-plane', 'control-plane', 'running',
+                      {})]
+        mock_kind.cluster.return_value = ClusterInfo('test', nodes)
+        result = self.runner.invoke(CLI, ['snapshot', '--tag', 'istio'],
+                                    obj=self.env)
+        self.assertEqual(result.exit_code, 0)
+        mock_kubeapi.export_context.assert_called_once_with('kind-test')
+        mock_take.assert_called_once_with(
+            'test', nodes, 'istio', mock_kubeapi.export_context.return_value)
+        mock_stop.assert_called_once()
+        mock_start.assert_called_once_with('test', 300)
+
+        result = self.runner.invoke(CLI, ['snapshot', '--tag', 'a/b'],
+                                    obj=self.env)
+        self.assertEqual(result.exit_code, 2)
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.logger')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.start_cluster')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.stop_cluster')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.snapshots.take')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kubeapi')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    def test_snapshot_error_survives_failed_restart(self, mock_kind,
+                                                    mock_kubeapi, mock_take,
+                                                    mock_stop, mock_start,
+                                                    mock_logger):
+        mock_kubeapi.ApiError = kubeapi.ApiError
+        mock_kubeapi.ConfigError = kubeapi.ConfigError
+        mock_kind.cluster.return_value = ClusterInfo('test', [
+            Node('1', 'test-control-plane', 'control-plane', 'running', {})])
+        mock_take.side_effect = snapshots.SnapshotError('disk full')
+        mock_start.side_effect = ClusterError('was not ready after 300s')
+        result = self.runner.invoke(CLI, ['snapshot'], obj=self.env)
+        self.assertEqual(result.exit_code, 1)
+        mock_start.assert_called_once_with('test', 300)
+        errors = [c[0][0] for c in mock_logger.error.call_args_list]
+        self.assertTrue(errors[-1].startswith("Kind cluster 'test' disk "
+                                              "full"))
+        self.assertIn("Kind cluster 'test' could not be started again: "
+                      "was not ready after 300s", errors)
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.start_cluster')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.delete_cluster')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.snapshots')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kubeapi')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    def test_restore(self, mock_kind, mock_kubeapi, mock_snapshots,
+                     mock_delete, mock_start):
+        mock_kubeapi.ApiError = kubeapi.ApiError
+        mock_kubeapi.ConfigError = kubeapi.ConfigError
+        mock_snapshots.SnapshotError = snapshots.SnapshotError
+        snapshot = mock_snapshots.load.return_value
+        mock_kind.cluster.return_value = ClusterInfo('test', [])
+        result = self.runner.invoke(CLI, ['restore'], obj=self.env)
+        self.assertEqual(result.exit_code, 1)
+        mock_snapshots.restore.assert_not_called()
+
+        result = self.runner.invoke(CLI, ['restore', '--force'],
+                                    obj=self.env)
+        self.assertEqual(result.exit_code, 0)
+        mock_snapshots.load.assert_called_with('test', 'latest')
+        mock_delete.assert_called_once_with('test')
+        mock_snapshots.restore.assert_called_once_with(snapshot)
+        mock_kubeapi.import_context.assert_called_once_with(
+            snapshot['kubeconfig'])
+        mock_start.assert_called_once_with('test', 300)
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.start_cluster')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.delete_cluster')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.snapshots')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kubeapi')
+    @patch('src.enabler_keitaro_inc.commands.cmd_kind.kind')
+    def test_restore_keeps_cluster_of_broken_snapshot(self, mock_kind,
+                                                      mock_kubeapi,
+                                                      mock_snapshots,
+                                                      mock_delete,
+                                                      mock_start):
+        mock_kubeapi.ApiError = kubeapi.ApiError
+        mock_kubeapi.ConfigError = kubeapi.ConfigError
+        mock_snapshots.SnapshotError = snapshots.SnapshotError
+        mock_kind.cluster.return_value = ClusterInfo('test', [])
+        mock_snapshots.verify.side_effect = snapshots.SnapshotError(
+            'snapshot latest of test is damaged: the image '
+            'enabler-snapshot/test-control-plane:latest is gone')
+        result = self.runner.invoke(CLI, ['restore', '--force', '-o',
+                                          'json'], obj=self.env)
+        self.assertEqual(result.exit_code, 1)
+        mock_delete.assert_not_called()
+        self.assertIn('is gone', json.loads(result.stdout)[0]['message'])
+
+        # Errors after the delete still end up in the report
+        mock_snapshots.verify.side_effect = None
+        mock_kubeapi.import_context.side_effect = PermissionError(
+            'kubeconfig is read only')
+        result = self.runner.invoke(CLI, ['restore', '--force', '-o',
+                                          'json'], obj=self.env)
+        self.assertEqual(result.exit_code, 1)
+        self.assertEqual(json.loads(result.stdout)[0]['message'],
+                         'could not be restored: kubeconfig is read only')
+        mock_start.assert_not_called()
+
+
+class TestSelect(unittest.TestCase):
+    @patch('src.enabler_keitaro_inc.helpers.kind.containers.clusters')
+    def test_select(self, mock_clusters):
+        mock_clusters.return_value = {'ci-1': None, 'ci-2': None,
+                                      'dev': None}
+        self.assertEqual(kind.select(['ci-*', 'dev', 'ci-1']),
+                         ['ci-1', 'ci-2', 'dev'])
+        self.assertEqual(kind.select(['missing', 'qa-*']), ['missing'])
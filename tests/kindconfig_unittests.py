@@ -0,0 +1,121 @@
+import os
+import socket
+import tempfile
+import unittest
+from unittest.mock import mock_open, patch
+from src.enabler_keitaro_inc.helpers import kindconfig
+
+
+CONFIG = {
+    'kind': 'Cluster',
+    'apiVersion': 'kind.x-k8s.io/v1alpha4',
+    'nodes': [
+        {'role': 'control-plane',
+         'extraPortMappings': [{'containerPort': 80, 'hostPort': 8080},
+                               {'containerPort': 53, 'hostPort': 5353,
+                                'protocol': 'UDP'}]},
+        {'role': 'worker',
+         'extraPortMappings': [{'containerPort': 443, 'hostPort': 8443,
+                                'listenAddress': '127.0.0.1'},
+                               {'containerPort': 80, 'hostPort': 0}]},
+    ],
+}
+
+PROC_TCP = '''\
+  sl  local_address rem_address   st tx_queue rx_queue
+   0: 0100007F:20FB 00000000:0000 0A 00000000:00000000
+   1: 00000000:1F90 00000000:0000 01 00000000:00000000
+'''
+
+PROC_TCP6 = '''\
+  sl  local_address rem_address   st tx_queue rx_queue
+   0: 00000000000000000000000000000000:1F90 00000000000000000000000000000000:0000 0A 0
+'''  # noqa
+
+
+class TestKindConfig(unittest.TestCase):
+    def test_valid_config(self):
+        self.assertEqual(kindconfig.validate(CONFIG), [])
+
+    def test_every_error_is_reported(self):
+        config = {
+            'kind': 'Cluster',
+            'apiVersion': 'kind.x-k8s.io/v1alpha4',
+            'node': [],
+            'nodes': [{'role': 'master',
+                       'extraPortMappings': [{'hostPort': '80'},
+                                             {'containerPort': 70000,
+                                              'hostPort': True}]}],
+            'featureGates': {'SomeGate': 'yes'},
+        }
+        self.assertEqual(sorted(kindconfig.validate(config)), sorted([
+            'node: unknown field',
+            'nodes[0].role: expected one of control-plane, worker, '
+            'got "master"',
+            'nodes[0].extraPortMappings[0].containerPort: missing',
+            'nodes[0].extraPortMappings[0].hostPort: expected integer, '
+            'got "80"',
+            'nodes[0].extraPortMappings[1].containerPort: 70000 is out of '
+            'range',
+            'nodes[0].extraPortMappings[1].hostPort: expected integer, '
+            'got true',
+            'featureGates.SomeGate: expected boolean, got "yes"',
+        ]))
+
+    def test_unknown_api_version(self):
+        self.assertEqual(len(kindconfig.validate({'kind': 'Cluster'})), 1)
+        self.assertIs(kindconfig.validator('kind.x-k8s.io/v1alpha4'),
+                      kindconfig.validator('kind.x-k8s.io/v1alpha4'))
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'kind.yaml')
+            with open(path, 'w') as f:
+                f.write('- not a mapping\n')
+            with self.assertRaises(ValueError):
+                kindconfig.load(path)
+
+    def test_port_mappings(self):
+        self.assertEqual(kindconfig.port_mappings(CONFIG), [
+            (0, '0.0.0.0', 8080, 'TCP'), (0, '0.0.0.0', 5353, 'UDP'),
+            (1, '127.0.0.1', 8443, 'TCP')])
+
+    def test_port_conflicts_read_proc_once(self):
+        tables = {'/proc/net/tcp': PROC_TCP, '/proc/net/tcp6': PROC_TCP6,
+                  '/proc/net/udp': PROC_TCP.splitlines()[0]}
+        opened = []
+
+        def fake_open(path, mode='r'):
+            opened.append(path)
+            if path not in tables:
+                raise FileNotFoundError(path)
+            return mock_open(read_data=tables[path])()
+        mappings = kindconfig.port_mappings(CONFIG) + [
+            (1, '0.0.0.0', 8080, 'TCP')]
+        with patch('builtins.open', fake_open):
+            conflicts = kindconfig.port_conflicts(mappings)
+        # 8443 is only held on 127.0.0.1 and 8080 on :: by a listener,
+        # the 8080 socket on 0.0.0.0 is not listening
+        self.assertEqual(conflicts, [
+            'nodes[0] TCP 0.0.0.0:8080: port is in use',
+            'nodes[1] TCP 127.0.0.1:8443: port is in use',
+            'nodes[1] TCP 0.0.0.0:8080: also mapped by nodes[0]',
+            'nodes[1] TCP 0.0.0.0:8080: port is in use'])
+        # Every table is read once, udp6 is missing on this fake host
+        self.assertEqual(sorted(opened), ['/proc/net/tcp', '/proc/net/tcp6',
+                                          '/proc/net/udp', '/proc/net/udp6'])
+
+    @patch('src.enabler_keitaro_inc.helpers.kindconfig.listening',
+           return_value=None)
+    def test_port_conflicts_without_proc(self, mock_listening):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            sock.listen(1)
+            port = sock.getsockname()[1]
+            self.assertEqual(
+                kindconfig.port_conflicts([(0, '127.0.0.1', port, 'TCP')]),
+                ['nodes[0] TCP 127.0.0.1:{}: port is in use'.format(port)])
+
+
+if __name__ == '__main__':
+    unittest.main()
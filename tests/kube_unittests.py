@@ -0,0 +1,52 @@
+import time
+import unittest
+from unittest.mock import patch
+from src.enabler_keitaro_inc.helpers import kube
+
+
+class TestWaitUntilReady(unittest.TestCase):
+    @patch('src.enabler_keitaro_inc.helpers.kube.time.sleep')
+    @patch('src.enabler_keitaro_inc.helpers.kube.api_server_ready')
+    def test_backoff_until_ready(self, mock_ready, mock_sleep):
+        mock_ready.side_effect = [False, False, False, True]
+        deadline = time.monotonic() + 60
+        self.assertTrue(kube.wait_until_ready('38765', deadline))
+        delays = [call[0][0] for call in mock_sleep.call_args_list]
+        self.assertEqual(delays, [0.05, 0.1, 0.2])
+        mock_ready.assert_called_with('38765')
+
+    @patch('src.enabler_keitaro_inc.helpers.kube.time.sleep')
+    @patch('src.enabler_keitaro_inc.helpers.kube.api_server_ready')
+    def test_deadline(self, mock_ready, mock_sleep):
+        mock_ready.return_value = False
+        self.assertFalse(kube.wait_until_ready('38765', time.monotonic()))
+        mock_sleep.assert_not_called()
+
+    @patch('src.enabler_keitaro_inc.helpers.kube.time.sleep')
+    @patch('src.enabler_keitaro_inc.helpers.kube.api_server_ready')
+    def test_node_died(self, mock_ready, mock_sleep):
+        mock_ready.return_value = False
+        deadline = time.monotonic() + 60
+        self.assertFalse(kube.wait_until_ready('38765', deadline,
+                                               failed=lambda: ['worker']))
+
+    def test_unreachable_api_server(self):
+        # Nothing listens on port 1
+        self.assertFalse(kube.api_server_ready(1))
+
+
+class TestAnnotate(unittest.TestCase):
+    @patch('src.enabler_keitaro_inc.helpers.kube.api_client')
+    def test_merge_patch(self, mock_client):
+        api = mock_client.return_value
+        api.path.return_value = '/api/v1/namespaces/istio-system'
+        kube.annotate('test', 'v1', 'Namespace', 'istio-system', {'a': 'b'})
+        # Only the annotation is sent, labels owned by the apply stay
+        api.patch.assert_called_once_with('/api/v1/namespaces/istio-system',
+                                          {'metadata': {'annotations': {
+                                              'a': 'b'}}})
+        api.apply.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,284 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+import yaml
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from src.enabler_keitaro_inc.helpers import kube, kubeapi
+
+
+DISCOVERY = {
+    '/api/v1': [{'name': 'namespaces', 'kind': 'Namespace',
+                 'namespaced': False},
+                {'name': 'namespaces/status', 'kind': 'Namespace',
+                 'namespaced': False},
+                {'name': 'services', 'kind': 'Service', 'namespaced': True},
+                {'name': 'configmaps', 'kind': 'ConfigMap',
+                 'namespaced': True}],
+    '/apis/metallb.io/v1beta1': [{'name': 'ipaddresspools',
+                                  'kind': 'IPAddressPool',
+                                  'namespaced': True}],
+    '/apis/apps/v1': [{'name': 'deployments', 'kind': 'Deployment',
+                       'namespaced': True}],
+    '/apis/apiextensions.k8s.io/v1': [{'name': 'customresourcedefinitions',
+                                       'kind': 'CustomResourceDefinition',
+                                       'namespaced': False}],
+}
+
+PLURALS = set(r['name'] for resources in DISCOVERY.values()
+              for r in resources)
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """Serves a tiny in-memory API server with discovery, get, create
+    and server-side apply"""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def record(self):
+        url = urllib.parse.urlsplit(self.path)
+        self.server.requests.append(
+            (self.command, url.path, urllib.parse.parse_qs(url.query),
+             self.headers.get('Content-Type'),
+             self.headers.get('Authorization')))
+        return url.path
+
+    def do_GET(self):
+        path = self.record()
+        if path in self.server.discovery:
+            self.reply(200, {'resources': self.server.discovery[path]})
+        elif path.rsplit('/', 1)[-1] in PLURALS:
+            self.reply(200, {'items': [
+                obj for key, obj in self.server.objects.items()
+                if key.rsplit('/', 1)[0] == path]})
+        elif path == '/version':
+            self.reply(200, {'gitVersion': 'v1.29.2'})
+        elif path in self.server.objects:
+            self.reply(200, self.server.objects[path])
+        else:
+            self.reply(404, {'kind': 'Status', 'reason': 'NotFound',
+                             'message': path + ' not found'})
+
+    def do_POST(self):
+        path = self.record()
+        obj = self.body()
+        path += '/' + obj['metadata']['name']
+        if path in self.server.objects:
+            self.reply(409, {'kind': 'Status', 'reason': 'AlreadyExists',
+                             'message': 'already exists'})
+        else:
+            self.server.objects[path] = obj
+            self.reply(201, obj)
+
+    def do_PATCH(self):
+        path = self.record()
+        obj = self.body()
+        created = path not in self.server.objects
+        self.server.objects[path] = obj
+        if obj['kind'] == 'CustomResourceDefinition':
+            # The new kind is served from now on
+            spec = obj['spec']
+            self.server.discovery['/apis/' + spec['group'] + '/' +
+                                  spec['versions'][0]['name']] = [{
+                                      'name': spec['names']['plural'],
+                                      'kind': spec['names']['kind'],
+                                      'namespaced': True}]
+        self.reply(201 if created else 200, obj)
+
+
+class TestKubeApi(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeApiHandler)
+        self.server.connections = 0
+        self.server.requests = []
+        self.server.objects = {}
+        self.server.discovery = dict(DISCOVERY)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+        self.tmp = tempfile.mkdtemp()
+        self.kubeconfig = os.path.join(self.tmp, 'config')
+        config = {
+            'apiVersion': 'v1', 'kind': 'Config',
+            'current-context': 'kind-test',
+            'clusters': [{'name': 'kind-test', 'cluster': {
+                'server': 'http://127.0.0.1:{}'.format(
+                    self.server.server_address[1])}}],
+            'users': [{'name': 'kind-test', 'user': {'token': 'secret'}}],
+            'contexts': [{'name': 'kind-test', 'context': {
+                'cluster': 'kind-test', 'user': 'kind-test'}}],
+        }
+        with open(self.kubeconfig, 'w') as f:
+            yaml.safe_dump(config, f)
+        self.env = patch.dict(os.environ, {'KUBECONFIG': self.kubeconfig})
+        self.env.start()
+        kubeapi.invalidate()
+
+    def tearDown(self):
+        kubeapi.invalidate()
+        self.env.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def test_requests_share_one_connection(self):
+        self.assertTrue(kube.kubectl_info('test'))
+        self.assertTrue(kube.ensure_namespace('test', 'apps',
+                                              {'istio-injection': 'enabled'}))
+        self.assertFalse(kube.ensure_namespace('test', 'apps'))
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(
+            self.server.objects['/api/v1/namespaces/apps']['metadata'],
+            {'name': 'apps', 'labels': {'istio-injection': 'enabled'}})
+        for request in self.server.requests:
+            self.assertEqual(request[4], 'Bearer secret')
+
+    def test_server_side_apply(self):
+        pool = {'apiVersion': 'metallb.io/v1beta1', 'kind': 'IPAddressPool',
+                'metadata': {'name': 'ip-pool', 'namespace': 'metallb'},
+                'spec': {'addresses': ['172.18.255.246-172.18.255.255']}}
+        kube.apply('test', [pool])
+        method, path, params, content_type, _ = self.server.requests[-1]
+        self.assertEqual(method, 'PATCH')
+        self.assertEqual(
+            path, '/apis/metallb.io/v1beta1/namespaces/metallb/'
+            'ipaddresspools/ip-pool')
+        self.assertEqual(params, {'fieldManager': ['enabler'],
+                                  'force': ['true']})
+        self.assertEqual(content_type, 'application/apply-patch+yaml')
+
+    def test_apply_namespaces(self):
+        kube.ensure_namespace('test', 'existing', {'team': 'a'})
+        kube.ensure_namespace('test', 'relabeled')
+        requests = len(self.server.requests)
+        results = kube.apply_namespaces('test', [
+            kube.namespace_manifest('new', {'istio-injection': 'enabled'}),
+            kube.namespace_manifest('existing', {'team': 'a'}),
+            kube.namespace_manifest('relabeled', {'team': 'b'})])
+        self.assertEqual(results, [('new', kube.CREATED, None),
+                                   ('existing', kube.UNCHANGED, None),
+                                   ('relabeled', kube.CONFIGURED, None)])
+        # One list and one apply per namespace that changed
+        methods = [r[0] for r in self.server.requests[requests:]]
+        self.assertEqual(sorted(methods), ['GET', 'PATCH', 'PATCH'])
+
+    def test_apply_batch_reports_what_the_server_did(self):
+        # Created by someone else, so enabler did not list it as its own
+        kubeapi.client('kind-test').create(
+            '/api/v1/namespaces/default/configmaps',
+            {'metadata': {'name': 'unmanaged'}})
+        results = kube.apply_batch('test', [
+            {'apiVersion': 'v1', 'kind': 'ConfigMap',
+             'metadata': {'name': name, 'namespace': 'default'}}
+            for name in ('unmanaged', 'new')])
+        self.assertEqual(results, [('unmanaged', kube.CONFIGURED, None),
+                                   ('new', kube.CREATED, None)])
+
+    def test_live_annotations(self):
+        configmap = {'apiVersion': 'v1', 'kind': 'ConfigMap',
+                     'metadata': {'name': 'app', 'namespace': 'default',
+                                  'annotations': {'hash': 'abc'}},
+                     'data': {'key': 'value'}}
+        kube.apply('test', [configmap])
+        self.assertEqual(
+            kube.live_annotations('test', 'default', 'configmaps',
+                                  'managed=true'),
+            {'app': {'hash': 'abc'}})
+        _, path, params, _, _ = self.server.requests[-1]
+        self.assertEqual(path, '/api/v1/namespaces/default/configmaps')
+        self.assertEqual(params, {'labelSelector': ['managed=true']})
+
+    def test_apply_manifest_waits_for_definitions(self):
+        definition = {
+            'apiVersion': 'apiextensions.k8s.io/v1',
+            'kind': 'CustomResourceDefinition',
+            'metadata': {'name': 'gateways.networking.istio.io'},
+            'spec': {'group': 'networking.istio.io',
+                     'names': {'plural': 'gateways', 'kind': 'Gateway'},
+                     'versions': [{'name': 'v1beta1'}]}}
+        gateway = {'apiVersion': 'networking.istio.io/v1beta1',
+                   'kind': 'Gateway',
+                   'metadata': {'name': 'grafana-gateway',
+                                'namespace': 'istio-system'}}
+        # The gateway comes first but needs its definition
+        kube.apply_manifest('test', [gateway, definition],
+                            time.monotonic() + 10)
+        self.assertIn('/apis/networking.istio.io/v1beta1/namespaces/'
+                      'istio-system/gateways/grafana-gateway',
+                      self.server.objects)
+
+    def test_wait_for_deployments(self):
+        self.server.objects['/apis/apps/v1/namespaces/istio-system/'
+                            'deployments/istiod'] = {
+            'metadata': {'name': 'istiod'}, 'spec': {'replicas': 1},
+            'status': {}}
+        self.assertEqual(kube.wait_for_deployments('test', 'istio-system',
+                                                   time.monotonic()),
+                         ['istiod'])
+        self.server.objects['/apis/apps/v1/namespaces/istio-system/'
+                            'deployments/istiod']['status'] = {
+            'availableReplicas': 1}
+        self.assertEqual(kube.wait_for_deployments('test', 'istio-system',
+                                                   time.monotonic()), [])
+
+    def test_errors(self):
+        api = kubeapi.client('kind-test')
+        self.assertIsNone(api.get_object('v1', 'Service', 'missing',
+                                         'istio-system'))
+        api.create('/api/v1/namespaces', {'metadata': {'name': 'apps'}})
+        with self.assertRaises(kubeapi.ApiError) as error:
+            api.create('/api/v1/namespaces', {'metadata': {'name': 'apps'}})
+        self.assertTrue(error.exception.conflict)
+        with self.assertRaises(kubeapi.ConfigError):
+            kubeapi.client('kind-missing')
+
+    def test_set_server(self):
+        node = type('Node', (), {'name': 'test-control-plane',
+                                 'ports': {'6443/tcp': '38765'}})
+        self.assertTrue(kube.kubeconfig_set(node, 'test'))
+        config = kubeapi.load_kubeconfig()
+        self.assertEqual(config['clusters']['kind-test']['server'],
+                         'https://127.0.0.1:38765')
+
+    def test_export_and_import_context(self):
+        exported = kubeapi.export_context('kind-test')
+        self.assertEqual([entry['name'] for entry in exported['users']],
+                         ['kind-test'])
+        with open(self.kubeconfig, 'w') as f:
+            yaml.safe_dump({'current-context': 'other', 'contexts': [
+                {'name': 'other', 'context': {}}]}, f)
+        with self.assertRaises(kubeapi.ConfigError):
+            kubeapi.export_context('kind-test')
+        kubeapi.import_context(exported)
+        config = kubeapi.load_kubeconfig()
+        self.assertEqual(sorted(config['contexts']), ['kind-test', 'other'])
+        self.assertEqual(config['current-context'], 'kind-test')
+        self.assertTrue(kube.kubectl_info('test'))
+
+
+if __name__ == '__main__':
+    unittest.main()
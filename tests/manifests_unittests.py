@@ -0,0 +1,33 @@
+import unittest
+import yaml
+from src.enabler_keitaro_inc.helpers import manifests
+
+
+class TestManifests(unittest.TestCase):
+    def test_render_crd(self):
+        pool, advertisement = manifests.render(
+            'metallb-crd.yaml', addresses=['172.18.255.246-172.18.255.255'])
+        self.assertEqual(pool['kind'], 'IPAddressPool')
+        self.assertEqual(pool['spec']['addresses'],
+                         ['172.18.255.246-172.18.255.255'])
+        self.assertEqual(advertisement['spec']['ipAddressPools'],
+                         ['ip-pool'])
+
+    def test_render_configmap(self):
+        configmap, = manifests.render(
+            'metallb-configmap.yaml',
+            addresses=['172.18.255.246 - 172.18.255.255', 'fc00::a-fc00::f'])
+        config = yaml.safe_load(configmap['data']['config'])
+        self.assertEqual(config['address-pools'][0]['addresses'],
+                         ['172.18.255.246 - 172.18.255.255',
+                          'fc00::a-fc00::f'])
+
+    def test_templates_are_read_once(self):
+        manifests.template.cache_clear()
+        manifests.render('metallb-crd.yaml', addresses=[])
+        manifests.render('metallb-crd.yaml', addresses=[])
+        self.assertEqual(manifests.template.cache_info().misses, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,29 +22,26 @@ class TestPlatformCommands(unittest.TestCase):
         # Clean up the temporary directory after the test
         shutil.rmtree(self.temp_dir)
 
-    @patch('src.enabler_keitaro_inc.commands.cmd_platform.s')
-    def test_platform_init(self, mock_s):
-        mock_s.run.return_value.returncode = 0
+    def test_platform_init(self):
         result = self.runner.invoke(CLI, ['platform', 'init', 'all', self.temp_dir]) # noqa
         self.assertEqual(result.exit_code, 0)
 
-    @patch('src.enabler_keitaro_inc.commands.cmd_platform.s')
-    def test_platform_info(self, mock_s):
-        mock_s.run.return_value.returncode = 0
+    @patch('src.enabler_keitaro_inc.commands.cmd_platform.kube')
+    def test_platform_info(self, mock_kube):
+        mock_kube.load_balancer_ip.return_value = '172.18.255.246'
+        mock_kube.cluster_info.return_value = 'Kubernetes control plane'
         result = self.runner.invoke(CLI, ['platform', 'info', '--kube-context', '']) # noqa
         self.assertEqual(result.exit_code, 0)
+        mock_kube.load_balancer_ip.assert_called_once_with(
+            '', 'istio-system', 'istio-ingressgateway')
 
     @patch('src.enabler_keitaro_inc.commands.cmd_platform.click.confirm')
-    @patch('src.enabler_keitaro_inc.commands.cmd_platform.s')
-    def test_platform_keys(self, mock_s, mock_confirm):
-        mock_s.run.return_value.returncode = 0
+    def test_platform_keys(self, mock_confirm):
         mock_confirm.return_value = False
         result = self.runner.invoke(CLI, ['platform', 'keys'])
         self.assertEqual(result.exit_code, 0)
 
-    @patch('src.enabler_keitaro_inc.commands.cmd_platform.s')
-    def test_platform_release(self, mock_s):
-        mock_s.run.return_value.returncode = 0
+    def test_platform_release(self):
         simulated_path = 'platform/microservice'
         # Create the simulated path if it doesn't exist
         if not os.path.exists(simulated_path):
@@ -52,8 +49,6 @@ class TestPlatformCommands(unittest.TestCase):
         result = self.runner.invoke(CLI, ['platform', 'release', '2.1.7', simulated_path]) # noqa
         self.assertEqual(result.exit_code, 0)
 
-    @patch('src.enabler_keitaro_inc.commands.cmd_platform.s')
-    def test_platform_version(self, mock_s):
-        mock_s.run.return_value.returncode = 0
+    def test_platform_version(self):
         result = self.runner.invoke(CLI, ['platform', 'version'])
         self.assertEqual(result.exit_code, 0)
@@ -1,24 +1,107 @@
 import unittest
+import json
+import time
+import tempfile
+import shutil
+import os
+import sys
+import subprocess
 from click.testing import CliRunner
 from unittest.mock import patch
 from src.enabler_keitaro_inc.commands.cmd_preflight import cli as CLI
 
 
+OUTPUTS = {
+    'java': (b'', b'openjdk version "11.0.2" 2019-01-15'),
+    'helm': (b'v3.1.2+gd878d4d', b''),
+    'istioctl': (b'1.5.1', b''),
+}
+
+
+def fake_run(command, **kwargs):
+    stdout, stderr = OUTPUTS.get(command[0], (b'ok', b''))
+    return subprocess.CompletedProcess(command, 0, stdout, stderr)
+
+
 class TestPreflightCommands(unittest.TestCase):
     def setUp(self):
         self.runner = CliRunner()
+        self.temp_dir = tempfile.mkdtemp()
+        self.env = patch.dict(os.environ, {'XDG_CACHE_HOME': self.temp_dir})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.temp_dir)
 
-    @patch('src.enabler_keitaro_inc.commands.cmd_preflight.s')
-    def test_preflight_command(self, mock_s):
-        mock_s.run.return_value.returncode = 0
+    @patch('src.enabler_keitaro_inc.helpers.preflight.s.run')
+    def test_preflight_command(self, mock_run):
+        mock_run.side_effect = fake_run
         with self.runner.isolated_filesystem():
-            result = self.runner.invoke(CLI)
+            result = self.runner.invoke(CLI, ['--output', 'json'])
 
             self.assertEqual(result.exit_code, 0)
-            self.assertIn('java jdk 11', result.output)
-            self.assertIn('docker', result.output)
-            self.assertIn('helm 3', result.output)
-            self.assertIn('kind', result.output)
-            self.assertIn('skaffold', result.output)
-            self.assertIn('kubectl', result.output)
-            self.assertIn('istioctl', result.output)
+            checks = json.loads(result.output)['checks']
+            messages = [check['message'] for check in checks]
+            self.assertIn('✓ java jdk 11', messages)
+            self.assertIn('✓ docker', messages)
+            self.assertIn('✓ helm 3', messages)
+            self.assertIn('✓ kind', messages)
+            self.assertIn('✓ skaffold', messages)
+            self.assertIn('✓ kubectl', messages)
+            self.assertIn('✓ istioctl', messages)
+
+    @patch('src.enabler_keitaro_inc.helpers.preflight.s.run')
+    def test_preflight_checks_run_concurrently(self, mock_run):
+        def slow_run(command, **kwargs):
+            time.sleep(0.2)
+            return fake_run(command)
+        mock_run.side_effect = slow_run
+        result = self.runner.invoke(CLI, ['--output', 'json'])
+        self.assertLess(json.loads(result.output)['duration'], 0.2 * 3)
+
+    @patch('src.enabler_keitaro_inc.helpers.preflight.s.run')
+    def test_preflight_missing_tool_and_timeout(self, mock_run):
+        def run(command, **kwargs):
+            if command[0] == 'docker':
+                raise subprocess.TimeoutExpired(command, kwargs['timeout'])
+            if command[0] == 'kind':
+                raise FileNotFoundError()
+            return fake_run(command)
+        mock_run.side_effect = run
+        result = self.runner.invoke(CLI, ['--output', 'json'])
+        checks = dict((c['name'], c) for c in json.loads(result.output)['checks']) # noqa
+        self.assertEqual(checks['docker']['status'], 'critical')
+        self.assertEqual(checks['kind']['message'], 'kind not found in PATH.')
+
+    @patch('src.enabler_keitaro_inc.helpers.preflight.shutil.which')
+    @patch('src.enabler_keitaro_inc.helpers.preflight.s.run')
+    def test_preflight_warm_cache_does_not_fork(self, mock_run, mock_which):
+        mock_which.return_value = sys.executable
+        mock_run.side_effect = fake_run
+        self.runner.invoke(CLI, ['--output', 'json'])
+        self.assertEqual(mock_run.call_count, 7)
+
+        # Only the docker daemon is checked again
+        result = self.runner.invoke(CLI, ['--output', 'json'])
+        self.assertEqual(mock_run.call_count, 8)
+        self.assertEqual(mock_run.call_args[0][0], ['docker', 'ps'])
+        checks = json.loads(result.output)['checks']
+        self.assertEqual([check['name'] for check in checks
+                          if not check['cached']], ['docker'])
+        self.assertEqual(checks[0]['version'], '11.0.2')
+
+        self.runner.invoke(CLI, ['--output', 'json', '--no-cache'])
+        self.assertEqual(mock_run.call_count, 15)
+
+    @patch('src.enabler_keitaro_inc.helpers.preflight.s.run')
+    def test_preflight_old_helm(self, mock_run):
+        def run(command, **kwargs):
+            if command[0] == 'helm':
+                return subprocess.CompletedProcess(command, 0, b'v2.16.1', b'') # noqa
+            return fake_run(command)
+        mock_run.side_effect = run
+        result = self.runner.invoke(CLI, ['--output', 'json'])
+        checks = dict((c['name'], c) for c in json.loads(result.output)['checks']) # noqa
+        self.assertEqual(checks['helm']['status'], 'error')
+        self.assertEqual(checks['helm']['version'], '2.16.1')
@@ -1,48 +1,288 @@
 import unittest
 from click.testing import CliRunner
 from unittest.mock import MagicMock, patch
-from src.enabler_keitaro_inc.commands.cmd_setup import cli as CLI
+from src.enabler_keitaro_inc.commands.cmd_setup import cli as CLI, \
+    install_binary
+from src.enabler_keitaro_inc.helpers import download, istioctl, kubeapi
+import ipaddress
 import os
 
+MANIFEST = """apiVersion: v1
+kind: Namespace
+metadata:
+  name: istio-system
+---
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: istiod
+  namespace: istio-system
+"""
+
 
 class TestSetupCommands(unittest.TestCase):
     def setUp(self):
         self.runner = CliRunner()
 
-    @patch('src.enabler_keitaro_inc.commands.cmd_setup.urllib.request')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.versions')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.download.fetch')
     @patch('src.enabler_keitaro_inc.commands.cmd_setup.os.stat')
     @patch('src.enabler_keitaro_inc.commands.cmd_setup.os.chmod')
-    def test_init_command(self, mock_chmod, mock_stat, mock_request):
+    def test_init_command(self, mock_chmod, mock_stat, mock_fetch,
+                          mock_versions):
 
         permission = 0o755
         os.chmod('enabler/bin', permission)
 
-        mock_request.urlretrieve.side_effect = [
-            ('enabler/bin/kubectl', None),
-            ('enabler/bin/helm.tar.gz', None),
-            ('enabler/bin/istioctl.tar.gz', None),
-            ('enabler/bin/kind', None),
-            ('enabler/bin/skaffold', None),
-        ]
         mock_stat.return_value.st_mode = 0o755
         mock_chmod.return_value = None
+        mock_versions.installed_versions.return_value = {}
+        mock_versions.latest_releases.return_value = {}
 
         result = self.runner.invoke(CLI, ['init'])
         print(result.output)
         self.assertEqual(result.exit_code, 0)
 
-    @patch('src.enabler_keitaro_inc.commands.cmd_setup.docker.from_env')
-    @patch('src.enabler_keitaro_inc.commands.cmd_setup.docker.networks')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.download.run_parallel') # noqa
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.versions')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.dependencies.load')
+    def test_init_keeps_binary_of_unknown_version(self, mock_load,
+                                                  mock_versions, mock_run):
+        dep = MagicMock(version='v0.8.1', github=None)
+        dep.name = 'kind'
+        mock_load.return_value = [dep]
+        # The version probe of bin/kind failed
+        mock_versions.installed_versions.return_value = {'kind': None}
+        mock_versions.normalize.return_value = '0.8.1'
+        mock_versions.latest_releases.return_value = {}
+        mock_run.return_value = {}
+        with self.runner.isolated_filesystem():
+            os.makedirs('bin')
+            open('bin/kind', 'w').close()
+            result = self.runner.invoke(CLI, ['init'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertTrue(os.path.exists('bin/kind'))
+        self.assertEqual(mock_run.call_args[0][0], [])
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.cache')
+    def test_install_from_warm_cache_stays_offline(self, mock_cache):
+        dep = MagicMock(url='https://example.com/kind', pinned_sha256=None,
+                        member=None)
+        dep.name = 'kind'
+        mock_cache.lookup.return_value = '/cache/objects/abc'
+        digests = {}
+        install_binary(dep, digests)
+        dep.expected_sha256.assert_not_called()
+        mock_cache.lookup.assert_called_once_with(dep.url, None,
+                                                  verified=True)
+        mock_cache.link.assert_called_once_with('/cache/objects/abc',
+                                                'bin/kind')
+        self.assertEqual(digests, {'kind': 'abc'})
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.download_and_make_executable') # noqa
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.cache')
+    def test_install_needs_a_checksum(self, mock_cache, mock_download):
+        dep = MagicMock(url='https://example.com/kind', pinned_sha256=None,
+                        member=None)
+        dep.name = 'kind'
+        dep.expected_sha256.side_effect = download.DownloadError(
+            'Could not fetch the checksum of kind')
+        mock_cache.lookup.return_value = None
+        mock_download.return_value = '/cache/objects/abc'
+        with self.assertRaises(download.DownloadError):
+            install_binary(dep, {})
+        mock_cache.lookup.assert_called_once_with(dep.url, None,
+                                                  verified=True)
+        mock_download.assert_not_called()
+
+        digests = {}
+        install_binary(dep, digests, insecure=True)
+        mock_download.assert_called_once_with(dep.url, 'bin/kind', 'kind',
+                                              None)
+        self.assertEqual(digests, {'kind': 'abc'})
+
+    def invoke_metallb(self):
+        # Nothing is read from or written to the working directory
+        with self.runner.isolated_filesystem():
+            result = self.runner.invoke(CLI, ['metallb'])
+            self.assertEqual(os.listdir('.'), [])
+        return result
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.ensure_namespace')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.apply')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.get_object')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.helm')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.containers')
     @patch('src.enabler_keitaro_inc.commands.cmd_setup.logger')
-    @patch('src.enabler_keitaro_inc.commands.cmd_setup.s')
-    def test_metallb_command(self, mock_s, mock_logger, mock_networks, mock_from_env):  # noqa
-        mock_network = MagicMock()
-        mock_network['Name'] = 'kind'
-        mock_network['IPAM']['Config'][0]['Subnet'] = '192.168.0.0/24'
-        mock_from_env.return_value.networks.return_value = [mock_network]
-        mock_s.run.return_value.returncode = 0
-        mock_logger.info.return_value = None
-
-        result = self.runner.invoke(CLI, ['metallb'])
+    def test_metallb_command(self, mock_logger, mock_containers, mock_helm,
+                             mock_get, mock_apply, mock_namespace):
+        mock_containers.network.return_value = {
+            'Id': 'abc', 'Name': 'kind',
+            'IPAM': {'Config': [{'Subnet': '192.168.0.0/24'}]}}
+        mock_containers.network_addresses.return_value = []
+        mock_helm.release.return_value = None
+        mock_get.return_value = None
+
+        result = self.invoke_metallb()
+        self.assertEqual(result.exit_code, 0)
+        # helm creates no namespace, --create-namespace needs helm 3.2
+        mock_namespace.assert_called_once_with('', 'metallb')
+        mock_helm.ensure_repo.assert_called_once_with(
+            'bitnami', 'https://charts.bitnami.com/bitnami')
+        mock_helm.upgrade_install.assert_called_once_with(
+            'metallb', 'bitnami/metallb', '4.6.0', 'metallb', '')
+        documents = mock_apply.call_args[0][1]
+        self.assertEqual(documents[0]['spec']['addresses'],
+                         ['192.168.0.245 - 192.168.0.254'])
+        mock_logger.info.assert_called_with('✓ Metallb installed on cluster.') # noqa
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.apply')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.get_object')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.helm.ensure_repo')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.helm.upgrade_install')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.helm.release')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.containers')
+    def test_metallb_reconcile_unchanged(self, mock_containers, mock_release,
+                                         mock_upgrade, mock_repo, mock_get,
+                                         mock_apply):
+        mock_containers.network.return_value = {
+            'Id': 'abc', 'Name': 'kind',
+            'IPAM': {'Config': [{'Subnet': '192.168.0.0/24'}]}}
+        mock_containers.network_addresses.return_value = []
+        mock_release.return_value = {'name': 'metallb', 'status': 'deployed',
+                                     'chart': 'metallb-4.6.0'}
+
+        def live(cluster, api_version, kind, name, namespace):
+            # The API server adds defaults to what was applied
+            if kind == 'IPAddressPool':
+                return {'metadata': {'name': name, 'namespace': namespace,
+                                     'uid': '1'},
+                        'spec': {'addresses': ['192.168.0.245 - 192.168.0.254'], # noqa
+                                 'autoAssign': True}}
+            return {'metadata': {'name': name, 'namespace': namespace},
+                    'spec': {'ipAddressPools': ['ip-pool']}}
+        mock_get.side_effect = live
+
+        result = self.invoke_metallb()
+        self.assertEqual(result.exit_code, 0)
+        mock_repo.assert_not_called()
+        mock_upgrade.assert_not_called()
+        mock_apply.assert_not_called()
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.ensure_namespace')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.apply')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.get_object')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.helm')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.containers')
+    def test_metallb_dual_stack(self, mock_containers, mock_helm, mock_get,
+                                mock_apply, mock_namespace):
+        mock_containers.network.return_value = {
+            'Id': 'abc', 'Name': 'kind',
+            'IPAM': {'Config': [{'Subnet': '172.18.0.0/16'},
+                                {'Subnet': 'fc00:f853:ccd:e793::/64'}]}}
+        mock_containers.network_addresses.return_value = [
+            ('kind-control-plane', ipaddress.ip_address('172.18.0.2'))]
+        mock_helm.release.return_value = None
+        mock_get.return_value = None
+
+        result = self.runner.invoke(CLI, ['metallb', '--pool-size', '5'])
         self.assertEqual(result.exit_code, 0)
-        self.assertIn('✓ Metallb installed on cluster.', result.output)
+        documents = mock_apply.call_args[0][1]
+        self.assertEqual(documents[0]['spec']['addresses'], [
+            '172.18.255.250 - 172.18.255.254',
+            'fc00:f853:ccd:e793:ffff:ffff:ffff:fffa - '
+            'fc00:f853:ccd:e793:ffff:ffff:ffff:fffe'])
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.helm')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.containers')
+    def test_metallb_pool_overlaps_containers(self, mock_containers,
+                                              mock_helm):
+        mock_containers.network.return_value = {
+            'Id': 'abc', 'Name': 'kind',
+            'IPAM': {'Config': [{'Subnet': '172.18.0.0/16'}]}}
+        mock_containers.network_addresses.return_value = [
+            ('kind-worker', ipaddress.ip_address('172.18.0.3'))]
+
+        result = self.runner.invoke(
+            CLI, ['metallb', '--ip-addresspool', '172.18.0.1-172.18.0.10'])
+        self.assertEqual(result.exit_code, 1)
+        mock_helm.upgrade_install.assert_not_called()
+
+
+class TestIstioCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+        self.digest = istioctl.manifest_hash(MANIFEST)
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.istioctl.verify_install') # noqa
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.get_object')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.istioctl.render')
+    def test_istio_up_to_date(self, mock_render, mock_get, mock_verify):
+        mock_render.return_value = (MANIFEST, True)
+        mock_get.return_value = {'metadata': {'annotations': {
+            istioctl.HASH_ANNOTATION: self.digest}}}
+        result = self.runner.invoke(CLI, ['istio'])
+        self.assertEqual(result.exit_code, 0)
+        mock_verify.assert_not_called()
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.annotate')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.apply')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.wait_for_deployments') # noqa
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.apply_manifest')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.istioctl.verify_install') # noqa
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.get_object')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.istioctl.render')
+    def test_istio_install(self, mock_render, mock_get, mock_verify,
+                           mock_apply_manifest, mock_wait, mock_apply,
+                           mock_annotate):
+        mock_render.return_value = (MANIFEST, False)
+        mock_get.return_value = None
+        mock_verify.return_value = ''
+        mock_wait.return_value = []
+        result = self.runner.invoke(CLI, ['istio', 'monitoring-tools'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('addonComponents.grafana.enabled=true',
+                      mock_render.call_args[0][0])
+        documents = mock_apply_manifest.call_args[0][1]
+        self.assertEqual([d['kind'] for d in documents],
+                         ['Namespace', 'Deployment'])
+        applied = [call[0][1][0]['kind'] for call in mock_apply.call_args_list] # noqa
+        self.assertEqual(applied, ['Gateway'])
+        # The hash is patched in, the labels of the namespace stay
+        mock_annotate.assert_called_once_with(
+            '', 'v1', 'Namespace', istioctl.NAMESPACE,
+            {istioctl.HASH_ANNOTATION: self.digest})
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.apply')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.wait_for_deployments') # noqa
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.apply_manifest')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.istioctl.verify_install') # noqa
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.get_object')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.istioctl.render')
+    def test_istio_not_ready(self, mock_render, mock_get, mock_verify,
+                             mock_apply_manifest, mock_wait, mock_apply):
+        mock_render.return_value = (MANIFEST, False)
+        mock_get.return_value = None
+        mock_verify.return_value = ''
+        mock_wait.return_value = ['istiod']
+        result = self.runner.invoke(CLI, ['istio'])
+        self.assertEqual(result.exit_code, 1)
+        mock_apply.assert_not_called()
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.apply')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.wait_for_deployments') # noqa
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.apply_manifest')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.istioctl.verify_install') # noqa
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.kube.get_object')
+    @patch('src.enabler_keitaro_inc.commands.cmd_setup.istioctl.render')
+    def test_istio_wait_fails(self, mock_render, mock_get, mock_verify,
+                              mock_apply_manifest, mock_wait, mock_apply):
+        mock_render.return_value = (MANIFEST, False)
+        mock_get.return_value = None
+        mock_verify.return_value = ''
+        mock_wait.side_effect = kubeapi.ApiError(
+            None, 'Could not reach https://127.0.0.1:6443')
+        result = self.runner.invoke(CLI, ['istio'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIsInstance(result.exception, SystemExit)
+        mock_apply.assert_not_called()
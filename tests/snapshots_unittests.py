@@ -0,0 +1,204 @@
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.enabler_keitaro_inc.helpers import snapshots
+from src.enabler_keitaro_inc.helpers.containers import Node
+
+
+NODES = [Node('1', 'test-control-plane', 'control-plane', 'exited', {}),
+         Node('2', 'test-worker', 'worker', 'exited', {})]
+
+KUBECONFIG = {'clusters': [{'name': 'kind-test'}],
+              'users': [{'name': 'kind-test'}],
+              'contexts': [{'name': 'kind-test'}]}
+
+
+def inspect(id):
+    return {
+        'Config': {'Hostname': 'node' + id,
+                   'Labels': {'io.x-k8s.kind.cluster': 'test'},
+                   'Env': ['container=docker'], 'Tty': True,
+                   'Volumes': {'/var': {}}},
+        'HostConfig': {'NetworkMode': 'kind', 'Privileged': True,
+                       'PortBindings': {'6443/tcp': [
+                           {'HostIp': '127.0.0.1', 'HostPort': '38765'}]}
+                       if id == '1' else {}},
+        'NetworkSettings': {'Networks': {'kind': {
+            'IPAddress': '172.18.0.' + id,
+            'GlobalIPv6Address': 'fc00:f853:ccd:e793::' + id}}}}
+
+
+# docker network inspect kind, kind only passes the IPv6 --subnet
+KIND_NETWORK = {'Name': 'kind', 'EnableIPv6': True,
+                'IPAM': {'Driver': 'default', 'Config': [
+                    {'Subnet': 'fc00:f853:ccd:e793::/64',
+                     'Gateway': 'fc00:f853:ccd:e793::1'}]}}
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.env = patch.dict(os.environ, {'XDG_CACHE_HOME': self.tmp})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.tmp)
+
+    @patch('src.enabler_keitaro_inc.helpers.snapshots.containers.client')
+    def test_take_and_restore(self, mock_client):
+        api = mock_client.return_value.api
+        api.inspect_container.side_effect = inspect
+        api.get_archive.side_effect = \
+            lambda id, path: ([b'var of ', id.encode()], {})
+        snapshots.take('test', NODES, 'base', KUBECONFIG)
+
+        self.assertEqual(sorted(c[1]['repository'] for c in
+                                api.commit.call_args_list),
+                         ['enabler-snapshot/test-control-plane',
+                          'enabler-snapshot/test-worker'])
+        self.assertEqual(snapshots.tags('test'), ['base'])
+        snapshot = snapshots.load('test', 'base')
+        self.assertEqual(snapshot['kubeconfig'], KUBECONFIG)
+        with open(os.path.join(snapshots.snapshot_dir('test', 'base'),
+                               'test-worker.var.tar'), 'rb') as f:
+            self.assertEqual(f.read(), b'var of 2')
+
+        archives = {}
+        api.inspect_network.return_value = KIND_NETWORK
+        api.create_container.side_effect = \
+            lambda image, **kwargs: {'Id': kwargs['name']}
+        api.put_archive.side_effect = \
+            lambda id, path, f: archives.setdefault(id, f.read())
+        self.assertEqual(sorted(snapshots.restore(snapshot)),
+                         ['test-control-plane', 'test-worker'])
+        self.assertEqual(archives['test-control-plane'], b'var of 1')
+        calls = dict((c[1]['name'], c) for c in
+                     api.create_container.call_args_list)
+        image, = calls['test-control-plane'][0]
+        options = calls['test-control-plane'][1]
+        self.assertEqual(image, 'enabler-snapshot/test-control-plane:base')
+        self.assertEqual(options['volumes'], ['/var'])
+        # The API server gets a free port, the node keeps its address
+        self.assertEqual(options['host_config']['PortBindings'],
+                         {'6443/tcp': [{'HostIp': '127.0.0.1',
+                                        'HostPort': ''}]})
+        # Only the address in the configured subnet is kept
+        api.create_endpoint_config.assert_any_call(
+            ipv4_address=None, ipv6_address='fc00:f853:ccd:e793::1')
+
+    def test_pinned_addresses(self):
+        spec = {'ipv4': '172.18.0.2', 'ipv6': 'fc00:f853:ccd:e793::2'}
+        self.assertEqual(snapshots.pinned_addresses(spec, KIND_NETWORK),
+                         (None, 'fc00:f853:ccd:e793::2'))
+        network = {'IPAM': {'Config': [{'Subnet': '172.18.0.0/16'}]}}
+        self.assertEqual(snapshots.pinned_addresses(spec, network),
+                         ('172.18.0.2', None))
+        self.assertEqual(snapshots.pinned_addresses(
+            {'ipv4': '172.18.0.2', 'ipv6': None}, {'IPAM': None}),
+            (None, None))
+
+    @patch('src.enabler_keitaro_inc.helpers.snapshots.containers.client')
+    def test_restore_without_addresses_docker_refuses(self, mock_client):
+        import docker
+        api = mock_client.return_value.api
+        api.inspect_container.side_effect = inspect
+        api.get_archive.return_value = ([b''], {})
+        snapshots.take('test', NODES[:1], 'base', KUBECONFIG)
+
+        api.inspect_network.return_value = {'IPAM': {'Config': [
+            {'Subnet': '172.18.0.0/16', 'Gateway': '172.18.0.1'}]}}
+        api.create_endpoint_config.side_effect = \
+            lambda **kwargs: kwargs
+        api.create_networking_config.side_effect = \
+            lambda networks: networks['kind']
+
+        def create(image, **kwargs):
+            if kwargs['networking_config']['ipv4_address']:
+                raise docker.errors.APIError(
+                    'user specified IP address is supported only when '
+                    'connecting to networks with user configured subnets')
+            return {'Id': kwargs['name']}
+        api.create_container.side_effect = create
+        self.assertEqual(snapshots.restore(snapshots.load('test', 'base')),
+                         ['test-control-plane'])
+        self.assertEqual(api.create_container.call_count, 2)
+
+    @patch('src.enabler_keitaro_inc.helpers.snapshots.containers.client')
+    def test_failed_restore_removes_nodes(self, mock_client):
+        import docker
+        api = mock_client.return_value.api
+        api.inspect_container.side_effect = inspect
+        api.get_archive.return_value = ([b''], {})
+        snapshots.take('test', NODES, 'base', KUBECONFIG)
+
+        def create(image, **kwargs):
+            if kwargs['name'] == 'test-worker':
+                raise docker.errors.APIError('Address already in use')
+            return {'Id': kwargs['name']}
+        api.create_container.side_effect = create
+        with self.assertRaises(snapshots.SnapshotError):
+            snapshots.restore(snapshots.load('test', 'base'))
+        api.remove_container.assert_called_once_with(
+            'test-control-plane', v=True, force=True)
+
+    @patch('src.enabler_keitaro_inc.helpers.snapshots.containers.client')
+    def test_verify(self, mock_client):
+        import docker
+        api = mock_client.return_value.api
+        api.inspect_container.side_effect = inspect
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w'):
+            pass
+        api.get_archive.return_value = ([archive.getvalue()], {})
+        snapshots.take('test', NODES, 'base', KUBECONFIG)
+        snapshot = snapshots.load('test', 'base')
+        snapshots.verify(snapshot)
+
+        api.inspect_image.side_effect = docker.errors.ImageNotFound('gone')
+        with self.assertRaises(snapshots.SnapshotError) as error:
+            snapshots.verify(snapshot)
+        self.assertIn('enabler-snapshot/test-control-plane:base is gone',
+                      str(error.exception))
+        api.inspect_image.side_effect = None
+        with open(os.path.join(snapshots.snapshot_dir('test', 'base'),
+                               'test-worker.var.tar'), 'wb') as f:
+            f.write(b'truncated')
+        with self.assertRaises(snapshots.SnapshotError) as error:
+            snapshots.verify(snapshot)
+        self.assertIn('test-worker.var.tar is no archive',
+                      str(error.exception))
+
+    def test_incomplete_snapshot(self):
+        os.makedirs(snapshots.snapshot_dir('test', 'base'))
+        with open(os.path.join(snapshots.snapshot_dir('test', 'base'),
+                               'snapshot.json'), 'w') as f:
+            json.dump({'cluster': 'test', 'tag': 'base', 'nodes': [
+                {'name': 'test-control-plane'}], 'kubeconfig': KUBECONFIG},
+                f)
+        with self.assertRaises(snapshots.SnapshotError) as error:
+            snapshots.load('test', 'base')
+        self.assertEqual(str(error.exception), 'snapshot base of test is '
+                         'damaged: it has no nodes.image')
+
+    def test_missing_snapshot(self):
+        with self.assertRaises(snapshots.SnapshotError) as error:
+            snapshots.load('test', 'base')
+        self.assertEqual(str(error.exception), 'no snapshot base of test')
+        os.makedirs(snapshots.snapshot_dir('test', 'broken'))
+        with open(os.path.join(snapshots.snapshot_dir('test', 'broken'),
+                               'snapshot.json'), 'w') as f:
+            json.dump({}, f)
+            f.write('}')
+        self.assertEqual(snapshots.tags('test'), ['broken'])
+        with self.assertRaises(snapshots.SnapshotError):
+            snapshots.load('test', 'broken')
+
+
+if __name__ == '__main__':
+    unittest.main()
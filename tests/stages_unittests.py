@@ -0,0 +1,68 @@
+import os
+import tempfile
+import threading
+import unittest
+from src.enabler_keitaro_inc.helpers import stages
+
+
+class TestStages(unittest.TestCase):
+    def test_order(self):
+        plan = [stages.Stage('istio', None, ['cluster', 'metallb']),
+                stages.Stage('metallb', None, ['cluster']),
+                stages.Stage('cluster', None),
+                stages.Stage('init', None)]
+        self.assertEqual(stages.order(plan),
+                         ['cluster', 'init', 'metallb', 'istio'])
+
+    def test_order_rejects_unknown_and_circular_needs(self):
+        with self.assertRaises(ValueError):
+            stages.order([stages.Stage('istio', None, ['metallb'])])
+        with self.assertRaises(ValueError):
+            stages.order([stages.Stage('a', None, ['b']),
+                          stages.Stage('b', None, ['a'])])
+
+    def test_independent_stages_run_together(self):
+        # Both stages wait for each other, so they only finish when they
+        # run at the same time
+        barrier = threading.Barrier(2, timeout=5)
+        ran = []
+        plan = [stages.Stage('init', barrier.wait),
+                stages.Stage('cluster', barrier.wait),
+                stages.Stage('metallb', lambda: ran.append('metallb'),
+                             ['init', 'cluster'])]
+        done = []
+        results = stages.run(plan, on_done=done.append)
+        self.assertEqual(ran, ['metallb'])
+        self.assertEqual(sorted(done), ['cluster', 'init', 'metallb'])
+        self.assertEqual(set(outcome for outcome, _, _ in results.values()),
+                         {stages.DONE})
+
+    def test_failure_blocks_dependents_only(self):
+        def fail():
+            raise RuntimeError('boom')
+        ran = []
+        plan = [stages.Stage('cluster', fail),
+                stages.Stage('metallb', lambda: ran.append('metallb'),
+                             ['cluster']),
+                stages.Stage('istio', lambda: ran.append('istio'),
+                             ['metallb']),
+                stages.Stage('platform', lambda: ran.append('platform')),
+                stages.Stage('init', lambda: ran.append('init'))]
+        results = stages.run(plan, done=['init'])
+        self.assertEqual(ran, ['platform'])
+        self.assertEqual(results['cluster'][0], stages.FAILED)
+        self.assertEqual(str(results['cluster'][2]), 'boom')
+        self.assertEqual(results['metallb'][0], stages.BLOCKED)
+        self.assertEqual(results['istio'][0], stages.BLOCKED)
+        self.assertEqual(results['init'][0], stages.RESUMED)
+
+    def test_state(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'up', 'keitaro.json')
+            self.assertEqual(stages.load_state(path), {})
+            stages.save_state(path, {'cluster': 'abc'})
+            self.assertEqual(stages.load_state(path), {'cluster': 'abc'})
+
+
+if __name__ == '__main__':
+    unittest.main()
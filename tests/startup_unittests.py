@@ -0,0 +1,68 @@
+import unittest
+import os
+import subprocess
+import sys
+from src.enabler_keitaro_inc import enabler
+from src.enabler_keitaro_inc.enabler import cli as CLI
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported just to start the CLI
+HEAVY_MODULES = ['docker', 'git', 'requests', 'yaml', 'cryptography',
+                 'pkg_resources']
+
+# Budget in microseconds for everything the CLI imports on top of what
+# the interpreter imports on its own
+IMPORT_BUDGET = 250000
+
+CLI_SCRIPT = ('import sys; from src.enabler_keitaro_inc.enabler import cli; '
+              'cli(sys.argv[1:])')
+
+
+def import_times(script, *args):
+    """Run script under python -X importtime and return the cumulative
+    import time of every imported module, keyed by module name, and the
+    names of the top level imports"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script] + list(args),
+        cwd=ROOT, capture_output=True, text=True)
+    times = {}
+    top_level = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        times[name.strip()] = int(cumulative)
+        # Nested imports are indented and counted in their parent
+        if not name.startswith('  '):
+            top_level.append(name.strip())
+    return times, top_level
+
+
+class TestStartup(unittest.TestCase):
+    def assert_fast_startup(self, *args):
+        _, interpreter = import_times('pass')
+        times, top_level = import_times(CLI_SCRIPT, *args)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, times)
+        total = sum(times[name] for name in top_level
+                    if name not in interpreter)
+        self.assertLess(total, IMPORT_BUDGET)
+
+    def test_help_startup(self):
+        self.assert_fast_startup('--help')
+
+    def test_version_startup(self):
+        self.assert_fast_startup('version')
+
+    def test_command_registry_matches_modules(self):
+        folder = os.path.join(ROOT, 'src', 'enabler_keitaro_inc', 'commands')
+        modules = sorted(f[4:-3] for f in os.listdir(folder)
+                         if f.startswith('cmd_') and f.endswith('.py'))
+        self.assertEqual(sorted(enabler.COMMANDS), modules)
+        for name, short_help in enabler.COMMANDS.items():
+            command = CLI.get_command(None, name)
+            self.assertEqual(command.short_help, short_help)
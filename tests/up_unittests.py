@@ -0,0 +1,124 @@
+import click
+import os
+import tempfile
+import unittest
+from click.testing import CliRunner
+from unittest.mock import patch
+from src.enabler_keitaro_inc.commands import cmd_kind, cmd_setup, cmd_up
+from src.enabler_keitaro_inc.commands.cmd_up import cli as CLI
+from src.enabler_keitaro_inc.helpers.containers import ClusterInfo
+
+
+CONFIG = '''
+cluster: keitaro
+stages:
+  cluster:
+    config: kind-cluster.yaml
+  metallb:
+    version: 4.6.0
+  istio:
+    monitoring: true
+'''
+
+
+@patch('src.enabler_keitaro_inc.commands.cmd_up.kube.kubectl_info',
+       return_value=True)
+@patch('src.enabler_keitaro_inc.commands.cmd_up.kind.cluster',
+       return_value=None)
+@patch('src.enabler_keitaro_inc.commands.cmd_up.invoke')
+class TestUpCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+        self.cache = tempfile.TemporaryDirectory()
+        self.env = patch.dict(os.environ, {'XDG_CACHE_HOME': self.cache.name})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.cache.cleanup()
+
+    def up(self, *args, config=CONFIG):
+        with self.runner.isolated_filesystem():
+            with open('enabler.yaml', 'w') as f:
+                f.write(config)
+            with open('kind-cluster.yaml', 'w') as f:
+                f.write('kind: Cluster\n')
+            return self.runner.invoke(CLI, list(args))
+
+    def test_up_runs_stages_in_order(self, mock_invoke, mock_cluster,
+                                     mock_info):
+        result = self.up()
+        self.assertEqual(result.exit_code, 0)
+        commands = [c[0][1] for c in mock_invoke.call_args_list]
+        self.assertEqual(commands, [cmd_kind.create, cmd_setup.metallb,
+                                    cmd_setup.istio])
+        create, metallb, istio = mock_invoke.call_args_list
+        self.assertEqual(create[1], {'kube_context': 'keitaro',
+                                     'configfile': 'kind-cluster.yaml',
+                                     'with_registry': False})
+        self.assertEqual(metallb[1]['version'], '4.6.0')
+        self.assertEqual(istio[1]['monitoring_tools'], 'monitoring-tools')
+        # Nothing is left to resume
+        self.assertFalse(os.path.exists(cmd_up.state_path('keitaro')))
+
+    def test_cluster_waits_for_init(self, mock_invoke, mock_cluster,
+                                    mock_info):
+        result = self.up(config='stages: {init: {}, cluster: {}}',
+                         *['--kube-context', 'keitaro'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual([c[0][1] for c in mock_invoke.call_args_list],
+                         [cmd_setup.init, cmd_kind.create])
+
+    def test_existing_cluster_is_started(self, mock_invoke, mock_cluster,
+                                         mock_info):
+        mock_cluster.return_value = ClusterInfo('other', [])
+        result = self.up(config='stages: {cluster: {timeout: 60}}',
+                         *['--kube-context', 'other'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(mock_invoke.call_args[0][1], cmd_kind.start)
+        self.assertEqual(mock_invoke.call_args[1],
+                         {'kube_context': 'other', 'timeout': 60})
+
+    def test_failed_run_resumes(self, mock_invoke, mock_cluster, mock_info):
+        def fail_metallb(ctx, command, **params):
+            if command is cmd_setup.metallb:
+                raise click.Abort()
+        mock_invoke.side_effect = fail_metallb
+        result = self.up()
+        self.assertEqual(result.exit_code, 1)
+        self.assertEqual([c[0][1] for c in mock_invoke.call_args_list],
+                         [cmd_kind.create, cmd_setup.metallb])
+        self.assertTrue(os.path.exists(cmd_up.state_path('keitaro')))
+
+        mock_invoke.reset_mock()
+        mock_invoke.side_effect = None
+        result = self.up()
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual([c[0][1] for c in mock_invoke.call_args_list],
+                         [cmd_setup.metallb, cmd_setup.istio])
+
+        # --fresh runs the completed stages again
+        mock_invoke.side_effect = fail_metallb
+        self.up()
+        mock_invoke.reset_mock()
+        self.up('--fresh')
+        self.assertEqual(mock_invoke.call_args_list[0][0][1],
+                         cmd_kind.create)
+
+    def test_invalid_config(self, mock_invoke, mock_cluster, mock_info):
+        result = self.up(config='stages: {deploy: {}}')
+        self.assertEqual(result.exit_code, 2)
+        result = self.up(config='stages: {metallb: {size: 5}}')
+        self.assertEqual(result.exit_code, 2)
+        result = self.up(config='''
+cluster: keitaro
+stages:
+  cluster: {needs: [istio]}
+  istio: {}
+''')
+        self.assertEqual(result.exit_code, 2)
+        mock_invoke.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
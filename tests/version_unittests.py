@@ -1,15 +1,29 @@
 import unittest
+import time
 from unittest.mock import patch
+from click.testing import CliRunner
 from src.enabler_keitaro_inc.enabler import CLI
+from src.enabler_keitaro_inc.commands.cmd_version import cli as VERSION_CLI
+from src.enabler_keitaro_inc import version
 
 
 class TestVersionCommands(unittest.TestCase):
     def setUp(self):
         self.cli = CLI(runner=None)
+        version.get_version.cache_clear()
 
-    @patch('src.enabler_keitaro_inc.enabler.subprocess.run')
-    def test_version_command(self, mock_subprocess_run):
-        mock_subprocess_run.return_value.stdout = 'Enabler 0.1.2'
-        version = self.cli.version_command()
-        expected_version = 'Enabler 0.1.2'
-        self.assertEqual(version, expected_version)
+    def test_version_command(self):
+        expected_version = 'Enabler ' + version.get_version()
+        self.assertEqual(self.cli.version_command(), expected_version)
+
+    @patch('src.enabler_keitaro_inc.commands.cmd_version.logger')
+    def test_version_cli(self, mock_logger):
+        result = CliRunner().invoke(VERSION_CLI)
+        self.assertEqual(result.exit_code, 0)
+        mock_logger.info.assert_called_once_with(
+            'Enabler ' + version.get_version())
+
+    def test_version_lookup_latency(self):
+        start = time.monotonic()
+        version.get_version()
+        self.assertLess(time.monotonic() - start, 0.05)
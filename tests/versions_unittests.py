@@ -0,0 +1,65 @@
+import unittest
+import tempfile
+import shutil
+import os
+import io
+import time
+import urllib.error
+from unittest.mock import patch
+from src.enabler_keitaro_inc.helpers import versions
+
+
+class TestVersions(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.kind = os.path.join(self.temp_dir, 'kind')
+        with open(self.kind, 'w') as f:
+            f.write('#!/bin/sh\necho "kind v0.22.0 go1.21.7 linux/amd64"\n')
+        os.chmod(self.kind, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_installed_versions_probes_once(self):
+        self.assertEqual(versions.installed_versions(self.temp_dir, ['kind']),
+                         {'kind': '0.22.0'})
+        with patch('src.enabler_keitaro_inc.helpers.versions.s.run') as run:
+            self.assertEqual(
+                versions.installed_versions(self.temp_dir, ['kind', 'helm']),
+                {'kind': '0.22.0'})
+            run.assert_not_called()
+
+    def test_latest_releases_within_ttl_skip_network(self):
+        versions.save_state(self.temp_dir, {'upstream': {
+            'kubernetes-sigs/kind': {'version': '0.23.0', 'etag': '"abc"',
+                                     'checked': time.time()}}})
+        with patch('src.enabler_keitaro_inc.helpers.versions.urllib.request.urlopen') as urlopen: # noqa
+            releases = versions.latest_releases(self.temp_dir,
+                                                ['kubernetes-sigs/kind'])
+            urlopen.assert_not_called()
+        self.assertEqual(releases, {'kubernetes-sigs/kind': '0.23.0'})
+
+    @patch('src.enabler_keitaro_inc.helpers.versions.urllib.request.urlopen')
+    def test_latest_release_not_modified(self, mock_urlopen):
+        mock_urlopen.side_effect = urllib.error.HTTPError(
+            'https://api.github.com', 304, 'Not Modified', {}, io.BytesIO())
+        cached = {'version': '0.23.0', 'etag': '"abc"', 'checked': 0}
+        entry = versions.latest_release('kubernetes-sigs/kind', cached)
+        request = mock_urlopen.call_args[0][0]
+        self.assertEqual(request.get_header('If-none-match'), '"abc"')
+        self.assertEqual(entry['version'], '0.23.0')
+
+    def test_parse(self):
+        self.assertEqual(str(versions.parse('v3.1.2+gd878d4d')), '3.1.2')
+        self.assertEqual(str(versions.parse('Client Version: v1.29.0')),
+                         '1.29.0')
+        self.assertIsNone(versions.parse('unknown'))
+
+    def test_parse_java(self):
+        self.assertEqual(
+            versions.parse_java('openjdk version "11.0.2" 2019-01-15').major,
+            11)
+        self.assertEqual(
+            versions.parse_java('java version "1.8.0_292"').major, 8)
+        self.assertEqual(
+            versions.parse_java('openjdk version "17" 2021-09-14').major, 17)